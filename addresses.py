@@ -0,0 +1,177 @@
+#!/usr/bin/python3 -OO
+'''
+dense integer ids for every address (hash160) seen on the chain
+
+the C++ commands keep a google dense_hash_map of Hash160 to a struct per
+address. a Python dict of bytes to objects costs several hundred bytes per
+entry, which rules out the hundreds of millions of addresses on mainnet.
+instead, AddressTable keeps an open-addressing hash table of 32-bit ids in
+an `array`, and the hash160s themselves in one flat bytearray indexed by
+id. per-address data then lives in columns (`array` or NumPy) indexed by
+the same ids, see allbalances.py.
+
+cost is 20 bytes per address for the hash, 1 for its script type, and
+4 to 8 for the hash table, which is kept between 1/4 and 1/2 full.
+the same table works for other uniformly distributed keys, such as txids,
+given their `keylength`.
+'''
+from __future__ import division, print_function
+import sys, os, struct, logging, mmap
+from array import array
+from binascii import a2b_hex
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+HASH160_LENGTH = 20
+CAPACITY = 1 << 20  # initial number of hash table slots
+
+class AddressTable(object):
+    '''
+    map each hash160 to a dense id: 0, 1, 2... in order of first appearance
+
+    >>> table = AddressTable(capacity=4)
+    >>> [table.add(bytes([n]) * 20) for n in (7, 8, 7, 9, 10)]
+    [0, 1, 0, 2, 3]
+    >>> len(table), len(table.slots)
+    (4, 8)
+    >>> table.lookup(bytes([9]) * 20), table.lookup(bytes([11]) * 20)
+    (2, -1)
+    >>> table.hash160(3) == bytes([10]) * 20
+    True
+    '''
+    def __init__(self, capacity=CAPACITY, keylength=HASH160_LENGTH):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.keylength = keylength
+        self.slots = array('I', [0]) * size  # id + 1, or 0 for empty slot
+        self.hashes = bytearray()
+        self.kinds = bytearray()  # script type from solve_output_script
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def find(self, hash160):
+        '''
+        return slot index for hash160, and its id or -1 if not present
+        '''
+        mask = len(self.slots) - 1
+        # hash160s are already uniformly distributed, no need to rehash
+        index = struct.unpack('<Q', hash160[:8])[0] & mask
+        while True:
+            slot = self.slots[index]
+            if not slot:
+                return index, -1
+            start = (slot - 1) * self.keylength
+            if self.hashes[start:start + self.keylength] == hash160:
+                return index, slot - 1
+            index = (index + 1) & mask
+
+    def lookup(self, hash160):
+        '''
+        return id of hash160, or -1 if never seen
+        '''
+        return self.find(hash160)[1]
+
+    def add(self, hash160, kind=0):
+        '''
+        return id of hash160, assigning the next one if it is new
+        '''
+        index, found = self.find(hash160)
+        if found >= 0:
+            return found
+        found = len(self.kinds)
+        self.hashes += hash160
+        self.kinds.append(kind)
+        self.slots[index] = found + 1
+        if 2 * len(self.kinds) > len(self.slots):
+            self.grow()
+        return found
+
+    def grow(self):
+        '''
+        double the hash table and reinsert all ids
+        '''
+        logging.debug('growing address table to %d slots',
+                      2 * len(self.slots))
+        self.slots = array('I', [0]) * (2 * len(self.slots))
+        mask = len(self.slots) - 1
+        for identifier in range(len(self.kinds)):
+            start = identifier * self.keylength
+            index = struct.unpack(
+                '<Q', bytes(self.hashes[start:start + 8]))[0] & mask
+            while self.slots[index]:
+                index = (index + 1) & mask
+            self.slots[index] = identifier + 1
+
+    def hash160(self, identifier):
+        '''
+        return the hash160 for an id
+        '''
+        start = identifier * self.keylength
+        return bytes(self.hashes[start:start + self.keylength])
+
+    def save(self, prefix):
+        '''
+        write the table to prefix.hashes, prefix.kinds and prefix.slots
+        '''
+        for name in ('hashes', 'kinds'):
+            with open('%s.%s' % (prefix, name), 'wb') as outfile:
+                outfile.write(getattr(self, name))
+        with open(prefix + '.slots', 'wb') as outfile:
+            self.slots.tofile(outfile)
+
+    key = hash160  # for tables of other keys, such as txids
+
+    @classmethod
+    def load(cls, prefix, keylength=HASH160_LENGTH, mapped=False):
+        '''
+        read back a table written by `save`
+
+        with `mapped`, the files are memory-mapped read-only instead, so a
+        lookup reads a few pages rather than the whole table first; such
+        a table cannot be added to.
+        '''
+        table = cls(capacity=1, keylength=keylength)
+        if mapped:
+            for name in ('hashes', 'kinds', 'slots'):
+                setattr(table, name, map_file('%s.%s' % (prefix, name)))
+            table.slots = table.slots.cast('I')
+            return table
+        for name in ('hashes', 'kinds'):
+            with open('%s.%s' % (prefix, name), 'rb') as infile:
+                setattr(table, name, bytearray(infile.read()))
+        table.slots = array('I')
+        with open(prefix + '.slots', 'rb') as infile:
+            table.slots.frombytes(infile.read())
+        return table
+
+def map_file(filename):
+    '''
+    read-only memoryview of a whole file, mapped unless it is empty
+    '''
+    with open(filename, 'rb') as infile:
+        if not os.path.getsize(filename):  # mmap refuses empty files
+            return memoryview(b'')
+        return memoryview(mmap.mmap(infile.fileno(), 0,
+                                    access=mmap.ACCESS_READ))
+
+def to_hash160(address):
+    '''
+    accept a hex hash160 or, through script.py, a hex public key or a
+    base58 address
+
+    >>> from binascii import b2a_hex
+    >>> b2a_hex(to_hash160('06f1b66fa14429389cbffa656966993eab656f37'))
+    b'06f1b66fa14429389cbffa656966993eab656f37'
+    '''
+    if len(address) == 40:
+        return a2b_hex(address.encode())
+    # these need script.py, and through it python-bitcoinlib
+    if len(address) in (66, 130):  # compressed or uncompressed public key
+        from script import pubkey_to_hash
+        return pubkey_to_hash(a2b_hex(address.encode()))
+    from script import addr_to_hash
+    return addr_to_hash(address)
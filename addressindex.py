@@ -0,0 +1,497 @@
+#!/usr/bin/python3 -OO
+'''
+persistent address index: every output paid to an address, and its spend
+
+cb/transactions.cpp, and a Python port of it, scan the whole chain for
+the addresses asked for. this builds, in one pass, an index answering the
+same question for any address afterwards, without a scan: in milliseconds
+for most, and decoding about 2 million postings a second for the busiest,
+such as satoshidice's.
+
+every output whose script solves to a hash160 (P2PKH, P2PK through the
+hash of its key, P2SH) is a posting (height, tx, output index, value)
+plus, once spent, a spend pointer (height, tx, input index), where tx is
+the position of the transaction in its block. the postings of an address
+are in chain order and delta encoded: the height as the difference from
+the previous posting's, the spend height as the difference from the
+output's, plus one, or 0 while unspent. the seven numbers per posting
+are then written as LEB128 varints, so most take one byte each.
+
+during the pass, postings and spends only go to flat run files. at the
+end, outside memory:
+
+ * the spends are written into the postings they spend, in run.sorted,
+   a memory-mapped file of 36-byte records in chain order
+ * each CHUNK of its records is sorted by address id, in place
+ * the chunks are merged a range of address ids at a time, of about
+   BATCH postings, which are encoded and appended to postings.data,
+   their offsets to postings.offsets
+
+so the memory used does not grow with the chain, nor with the busiest
+address, whose postings are encoded in pieces: sorting takes about 45
+bytes per posting of a CHUNK, and encoding about 430 per posting of a
+range, of up to twice BATCH, for a peak of about 200 MB. besides the
+index, the run files take about 24 bytes of disk per posting and 20 per
+spend, and run.sorted 36 per posting.
+
+lookups memory-map everything, the AddressTable included, and decode
+one address's postings with a few NumPy operations.
+
+    python3 -OO addressindex.py --directory index
+    python3 -OO addressindex.py --directory index --query 1dice8EMZmqKvrGE4Qc9bUFf9PX3xaYDp
+'''
+from __future__ import division, print_function
+import sys, os, logging, time
+import numpy
+from blockparse import solve_output_script, show_hash, to_hex
+from outpoints import OutpointMap, COINBASE, outpoint
+from addresses import AddressTable, to_hash160
+from columns import Column, load_column
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+DICE = '1dice8EMZmqKvrGE4Qc9bUFf9PX3xaYDp'  # default, as in transactions.cpp
+# index files kept for lookups, and run files used while building
+INDEX = (
+    ('block.tx', 'q'),  # serial number of first transaction of each height
+    ('block.time', 'I'),
+    ('tx.txid', 32),  # by serial number, in internal byte order
+    ('postings.offsets', 'q'),  # of each address id's postings, then size
+    ('postings.data', 1),
+)
+RUNS = (
+    ('run.address', 'i'),  # postings, in chain order
+    ('run.height', 'i'),
+    ('run.tx', 'i'),
+    ('run.index', 'i'),
+    ('run.value', 'q'),
+    ('run.posting', 'q'),  # spends: number of the posting spent
+    ('run.spendheight', 'i'),
+    ('run.spendtx', 'i'),
+    ('run.spendindex', 'i'),
+)
+FIELDS = 7  # numbers per posting
+# a posting with its spend, as in run.sorted
+RECORD = numpy.dtype([('address', 'i4'), ('height', 'i4'), ('tx', 'i4'),
+                      ('index', 'i4'), ('value', 'i8'), ('spendheight', 'i4'),
+                      ('spendtx', 'i4'), ('spendindex', 'i4')])
+CHUNK = 1 << 22  # postings sorted at once
+BATCH = 1 << 18  # postings encoded at once, up to twice as many
+SEPARATOR = '    ' + '=' * 215
+
+class AddressIndex(Callback):
+    '''
+    build a persistent index of the transactions of every address
+    '''
+    name = 'addressindex'
+    aliases = ('transactions', 'txs', 'book', 'tally')
+    needTXHash = True
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-d', '--directory', default='index',
+                            help='directory of the index files'
+                            ' (default: %(default)s)')
+        parser.add_argument('-q', '--query', action='store_true',
+                            help='with `python3 addressindex.py`, show'
+                            ' the addresses from the index instead of'
+                            ' building it')
+        parser.add_argument('-c', '--csv', action='store_true',
+                            help='produce CSV-formatted output instead'
+                            ' column-formatted')
+        parser.add_argument('addresses', nargs='*',
+                            help='base58 addresses, hex hash160s or hex'
+                            ' public keys to show the transactions of'
+                            ' once the index is built')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.options = options
+        self.directory = options.directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.files = dict(
+            (name, Column(os.path.join(self.directory, name), typecode))
+            for name, typecode in INDEX[:3] + RUNS)
+        self.addresses = AddressTable()
+        # outputs paying an address, to their posting number
+        self.pending = OutpointMap()
+        self.created, self.wanted = [], []
+        self.transactions = self.postings = 0
+        return 0
+
+    def startBlock(self, block):
+        self.height = block['height']
+        self.files['block.tx'].append(self.transactions)
+        self.files['block.time'].append(block['time'])
+        self.position = -1
+
+    def startTX(self, transaction, txhash):
+        self.files['tx.txid'].append(txhash)
+        self.transactions += 1
+        self.position += 1
+        self.inputIndex = 0
+
+    def startInput(self, txin):
+        if txin[0] != COINBASE:
+            self.wanted.append((txin[0] + txin[1], self.position,
+                                self.inputIndex))
+        self.inputIndex += 1
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        kind, hash160 = solve_output_script(outputscript)
+        if kind < 0:
+            return
+        for name, number in (('run.address',
+                              self.addresses.add(hash160, kind)),
+                             ('run.height', self.height),
+                             ('run.tx', self.position),
+                             ('run.index', outputindex),
+                             ('run.value', value)):
+            self.files[name].append(number)
+        self.created.append((outpoint(txhash, outputindex),
+                             (self.postings, b'')))
+        self.postings += 1
+
+    def endBlock(self, block):
+        self.pending.update(self.created)
+        found = self.pending.pop_many([key for key, position, index
+                                       in self.wanted])
+        for key, position, index in self.wanted:
+            if key in found:
+                for name, number in (('run.posting', found[key][0]),
+                                     ('run.spendheight', self.height),
+                                     ('run.spendtx', position),
+                                     ('run.spendindex', index)):
+                    self.files[name].append(number)
+        del self.created[:], self.wanted[:]
+
+    def wrapup(self):
+        self.pending.close()
+        self.files['block.tx'].append(self.transactions)
+        for column in self.files.values():
+            column.close()
+        self.addresses.save(os.path.join(self.directory, 'address'))
+        logging.info('sorting %d postings of %d addresses', self.postings,
+                     len(self.addresses))
+        sort_runs(self.directory, self.postings)
+        for name, typecode in RUNS:
+            os.remove(os.path.join(self.directory, name))
+        size = merge_runs(self.directory, len(self.addresses))
+        os.remove(os.path.join(self.directory, 'run.sorted'))
+        logging.info('index of %d addresses written to %s, %d bytes of'
+                     ' postings', len(self.addresses), self.directory, size)
+        if self.options.addresses:
+            show(Postings(self.directory), self.options.addresses,
+                 self.options.csv)
+
+class Postings(object):
+    '''
+    lookups in an index built by AddressIndex, all memory-mapped
+    '''
+    def __init__(self, directory):
+        for name, typecode in INDEX:
+            setattr(self, name.replace('.', '_'),
+                    load_column(os.path.join(directory, name), typecode))
+        self.addresses = AddressTable.load(os.path.join(directory, 'address'),
+                                           mapped=True)
+
+    def lookup(self, hash160):
+        '''
+        postings of `hash160` as a dict of NumPy arrays, in chain order
+
+        keys are height, tx (serial number), index and value, then
+        spendheight, spendtx and spendindex, -1 while unspent.
+        '''
+        identifier = self.addresses.lookup(hash160)
+        if identifier < 0:
+            return decode_postings(b'', self.block_tx)
+        start, end = self.postings_offsets[identifier:identifier + 2]
+        return decode_postings(self.postings_data[start:end].tobytes(),
+                               self.block_tx)
+
+    def txid(self, transaction):
+        '''
+        hash of transaction serial number `transaction`, as displayed
+        '''
+        return show_hash(self.tx_txid[transaction].tobytes())
+
+def sort_runs(directory, count, chunk=CHUNK):
+    '''
+    write the `count` postings of the run files, with their spends, to
+    run.sorted, each `chunk` of them sorted by address
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for name, typecode in RUNS:
+    ...     column = Column(os.path.join(directory, name), typecode)
+    ...     column.extend(dict((
+    ...         ('run.address', [1, 0, 1]), ('run.height', [0, 1, 3]),
+    ...         ('run.tx', [0, 0, 2]), ('run.index', [0, 0, 1]),
+    ...         ('run.value', [50, 7, 300]), ('run.posting', [0]),
+    ...         ('run.spendheight', [3]), ('run.spendtx', [2]),
+    ...         ('run.spendindex', [0])))[name])
+    ...     column.close()
+    >>> sort_runs(directory, 3, chunk=2)
+    >>> load_column(os.path.join(directory, 'run.sorted'), RECORD).tolist()
+    [(0, 1, 0, 0, 7, 0, 0, 0), (1, 0, 0, 0, 50, 4, 2, 0), \
+(1, 3, 2, 1, 300, 0, 0, 0)]
+    >>> merge_runs(directory, 2, batch=1)
+    22
+    >>> load_column(os.path.join(directory, 'postings.offsets'), 'q').tolist()
+    [0, 7, 22]
+    >>> import shutil; shutil.rmtree(directory)
+    '''
+    path = lambda name: os.path.join(directory, name)
+    runs = dict((name, load_column(path(name), typecode))
+                for name, typecode in RUNS)
+    with open(path('run.sorted'), 'wb') as outfile:
+        outfile.truncate(count * RECORD.itemsize)
+    if not count:
+        return
+    records = numpy.memmap(path('run.sorted'), RECORD, 'r+')
+    for start in range(0, count, chunk):
+        end = min(count, start + chunk)
+        for name in ('address', 'height', 'tx', 'index', 'value'):
+            records[name][start:end] = runs['run.' + name][start:end]
+    # most outputs are spent soon after, so these writes are mostly local
+    posting = runs['run.posting']
+    for start in range(0, len(posting), chunk):
+        spent = numpy.asarray(posting[start:start + chunk])
+        records['spendheight'][spent] = \
+            runs['run.spendheight'][start:start + chunk] - \
+            records['height'][spent] + 1
+        for name in ('spendtx', 'spendindex'):
+            records[name][spent] = runs['run.' + name][start:start + chunk]
+    for start in range(0, count, chunk):
+        part = records[start:start + chunk]
+        part[:] = part[numpy.argsort(part['address'], kind='stable')]
+    records.flush()
+
+def merge_runs(directory, count, batch=BATCH, chunk=CHUNK):
+    '''
+    merge the chunks of run.sorted, of `count` addresses, into
+    postings.offsets and postings.data, returning the size of the data
+
+    the postings of each range of addresses are taken from every chunk in
+    turn, so they stay in chain order, and encoded together; a range is
+    narrowed to a single address if needed to stay within twice `batch`
+    postings, and that address encoded in pieces if even it is not
+    '''
+    path = lambda name: os.path.join(directory, name)
+    records = load_column(path('run.sorted'), RECORD)
+    chunks = [records[start:start + chunk]
+              for start in range(0, len(records), chunk)]
+    keys = [part['address'] for part in chunks]
+    positions = numpy.zeros(len(chunks), numpy.int64)
+    first, size = 0, 0
+    step = max(1, count * batch // max(1, len(records)))
+    with open(path('postings.offsets'), 'wb') as offsets, \
+            open(path('postings.data'), 'wb') as data:
+        while first < count:
+            last = min(count, first + step)
+            ends = numpy.array([key.searchsorted(last) for key in keys],
+                               numpy.int64)
+            found = int((ends - positions).sum())
+            if found > 2 * batch and last - first > 1:
+                step = max(1, (last - first) // 2)
+                continue
+            pieces = [part[start:end] for part, start, end in
+                      zip(chunks, positions.tolist(), ends.tolist())
+                      if end > start]
+            if found > 2 * batch:  # one address, encoded in pieces
+                offsets.write(numpy.int64(size).tobytes())
+                previous = None
+                for piece in pieces:
+                    for start in range(0, len(piece), batch):
+                        part = piece[start:start + batch]
+                        sizes, encoded = encode_postings(part, first, 1,
+                                                         previous)
+                        data.write(encoded)
+                        size += len(encoded)
+                        previous = int(part['height'][-1])
+            else:
+                sizes, encoded = encode_postings(
+                    numpy.concatenate(pieces) if pieces else
+                    numpy.zeros(0, RECORD), first, last - first)
+                starts = numpy.cumsum(sizes) - sizes
+                offsets.write((size + starts).astype(numpy.int64).tobytes())
+                data.write(encoded)
+                size += len(encoded)
+            if found < batch // 2:
+                step *= 2
+            first, positions = last, ends
+        offsets.write(numpy.int64(size).tobytes())
+    return size
+
+def encode_postings(records, first, count, previous=None):
+    '''
+    encode postings `records`, of addresses `first` to `first + count`,
+    in chain order, address by address, returning the size of each
+    address's postings and the data
+
+    `previous` is the height of the posting before the first, when the
+    postings of one address are encoded in pieces
+
+    >>> records = numpy.array([(1, 0, 0, 0, 50, 4, 2, 0),
+    ...                        (0, 1, 0, 0, 7, 0, 0, 0),
+    ...                        (1, 3, 2, 1, 300, 0, 0, 0)], RECORD)
+    >>> sizes, data = encode_postings(records, 0, 2)
+    >>> sizes.tolist(), len(data)
+    ([7, 15], 22)
+    >>> postings = decode_postings(data[7:], numpy.array([0, 1, 2, 5]))
+    >>> postings['height'].tolist(), postings['value'].tolist()
+    ([0, 3], [50, 300])
+    >>> postings['spendtx'].tolist(), postings['spendindex'].tolist()
+    ([7, -1], [0, -1])
+    >>> encode_postings(records[2:], 1, 1, 0)[1] == data[14:]
+    True
+    '''
+    records = records[numpy.argsort(records['address'], kind='stable')]
+    address = records['address']
+    height = records['height'].astype(numpy.int64)
+    before = numpy.roll(height, 1)
+    starting = numpy.ones(len(records), dtype=bool)  # first of address
+    starting[1:] = address[1:] != address[:-1]
+    if len(records) and previous is not None:
+        starting[0], before[0] = False, previous
+    delta = height - numpy.where(starting, 0, before)
+    fields = numpy.stack([delta] + [records[name].astype(numpy.int64)
+                                    for name in RECORD.names[2:]], axis=1)
+    data, lengths = encode_varints(fields.ravel())
+    sizes = lengths.reshape(-1, FIELDS).sum(axis=1)
+    return numpy.bincount(address - first, weights=sizes,
+                          minlength=count).astype(numpy.int64), data
+
+def decode_postings(data, blocktx):
+    '''
+    postings of one address from their encoded data, as in `lookup`
+    '''
+    fields = decode_varints(data).astype(numpy.int64).reshape(-1, FIELDS)
+    height = numpy.cumsum(fields[:, 0])
+    spent = fields[:, 4] > 0
+    spendheight = numpy.where(spent, height + fields[:, 4] - 1, -1)
+    return {
+        'height': height,
+        'tx': blocktx[height] + fields[:, 1],
+        'index': fields[:, 2],
+        'value': fields[:, 3],
+        'spendheight': spendheight,
+        'spendtx': numpy.where(spent, blocktx[numpy.maximum(spendheight, 0)]
+                               + fields[:, 5], -1),
+        'spendindex': numpy.where(spent, fields[:, 6], -1),
+    }
+
+def encode_varints(values):
+    '''
+    LEB128 encoding of non-negative integers, and the length of each
+
+    >>> data, lengths = encode_varints([0, 127, 128, 300])
+    >>> to_hex(data), lengths.tolist()
+    ('007f8001ac02', [1, 1, 2, 2])
+    '''
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    lengths = numpy.ones(len(values), numpy.int64)
+    rest = values >> 7
+    while rest.any():
+        lengths += rest > 0
+        rest >>= 7
+    ends = numpy.cumsum(lengths)
+    starts = ends - lengths
+    data = numpy.zeros(int(ends[-1]) if len(ends) else 0, numpy.uint8)
+    for shift in range(int(lengths.max()) if len(lengths) else 0):
+        more = lengths > shift
+        group = (values[more] >> (7 * shift)) & 0x7f
+        data[starts[more] + shift] = group | numpy.where(
+            lengths[more] > shift + 1, 0x80, 0).astype(numpy.uint64)
+    return data.tobytes(), lengths
+
+def decode_varints(data):
+    '''
+    inverse of `encode_varints`, as a NumPy array
+
+    >>> decode_varints(encode_varints([0, 127, 128, 300, 2 ** 40])[0]).tolist()
+    [0, 127, 128, 300, 1099511627776]
+    '''
+    data = numpy.frombuffer(data, numpy.uint8)
+    ends = numpy.flatnonzero(data < 0x80)  # last byte of each number
+    groups = (data & 0x7f).astype(numpy.uint64)
+    values = groups[ends]
+    lengths = numpy.diff(ends, prepend=-1)
+    # fold in the more significant groups, from the end of each number
+    for shift in range(1, int(lengths.max()) if len(lengths) else 0):
+        more = lengths > shift
+        values[more] = (values[more] << numpy.uint64(7)) | \
+            groups[ends[more] - shift]
+    return values
+
+def show(postings, addresses, csv=False):
+    '''
+    print the transactions of `addresses` as cb/transactions.cpp does
+
+    outputs received and spent by the addresses, in chain order, with
+    the running balance of all of them together.
+    '''
+    events = []
+    for address in addresses:
+        hash160 = to_hash160(address)
+        found = postings.lookup(hash160)
+        for tx, height, value in zip(found['tx'].tolist(),
+                                     found['height'].tolist(),
+                                     found['value'].tolist()):
+            events.append((tx, 1, height, hash160, value))
+        spent = found['spendtx'] >= 0
+        for tx, height, value in zip(found['spendtx'][spent].tolist(),
+                                     found['spendheight'][spent].tolist(),
+                                     found['value'][spent].tolist()):
+            events.append((tx, 0, height, hash160, -value))
+    # as in the parse, a transaction's inputs come before its outputs
+    events.sort(key=lambda event: event[:2])
+    logging.info('Dumping all transactions for %d address(es)',
+                 len(addresses))
+    if csv:
+        print('"Time", "Address", ' + ' ' * 34 + '"TXId", ' + ' ' * 67 +
+              '"TXAmount",      "NewBalance"')
+    else:
+        print('    Time (GMT)                  Address' + ' ' * 37 +
+              'Transaction' + ' ' * 68 + 'OldBalance' + ' ' * 21 +
+              'Amount' + ' ' * 17 + 'NewBalance')
+        print(SEPARATOR)
+    balance = added = subtracted = 0
+    for tx, kind, height, hash160, value in events:
+        blocktime = int(postings.block_time[height])
+        if csv:
+            print('%6d, "%s", "%s",%17.08f,%17.08f' % (
+                blocktime // 86400 + 25569, to_hex(hash160),
+                postings.txid(tx), value * 1e-8, (balance + value) * 1e-8))
+        else:
+            print('    %s    %s    %s %24.08f %s %24.08f = %24.08f' % (
+                time.asctime(time.gmtime(blocktime)), to_hex(hash160),
+                postings.txid(tx), balance * 1e-8, '+-'[value < 0],
+                abs(value) * 1e-8, (balance + value) * 1e-8))
+        if value > 0:
+            added += value
+        else:
+            subtracted -= value
+        balance += value
+    if not csv:
+        print(SEPARATOR)
+        logging.info('transactions  = %d', len(events))
+        logging.info('received      = %17.08f', added * 1e-8)
+        logging.info('spent         = %17.08f', subtracted * 1e-8)
+        logging.info('balance       = %17.08f', balance * 1e-8)
+
+if __name__ == '__main__':
+    OPTIONS = AddressIndex().optionParser().parse_known_args()[0]
+    if OPTIONS.query:
+        if not OPTIONS.addresses:
+            logging.warning('no addresses specified, using satoshi\'s dice'
+                            ' address %s', DICE)
+        show(Postings(OPTIONS.directory), OPTIONS.addresses or [DICE],
+             OPTIONS.csv)
+    else:
+        main(command='addressindex')
@@ -0,0 +1,244 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/allBalances.cpp: balance of every address on the chain
+
+addresses get dense ids from addresses.AddressTable, and everything known
+about them is kept in columns indexed by id (`array('q')` and
+`array('I')`, viewed as NumPy arrays for sorting when NumPy is installed)
+rather than in an object per address. per address that is 24 bytes of
+64-bit balance, received and sent, 24 bytes of 32-bit counters and times,
+plus about 30 bytes in the AddressTable: roughly 80 bytes, or 24 GB for
+300 million addresses.
+
+it can be used from the command line, as `callback.py allBalances`, or
+from inside another process such as the explorer, by registering an
+AllBalances with callback.process and calling `balance_of` on it.
+'''
+from __future__ import division, print_function
+import sys, os, logging, heapq, time
+from array import array
+from binascii import a2b_hex
+from blockparse import solve_output_script, to_hex
+from addresses import AddressTable
+from callback import Callback, main
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+# column name and array typecode, all indexed by address id
+COLUMNS = (
+    ('balance', 'q'),
+    ('received', 'q'),
+    ('sent', 'q'),
+    ('txcount', 'I'),  # number of distinct transactions
+    ('nbin', 'I'),  # number of outputs paying to address
+    ('nbout', 'I'),  # number of inputs spending from address
+    ('lastin', 'I'),  # block time of last output to address
+    ('lastout', 'I'),  # block time of last spend from address
+    ('lasttx', 'I'),  # serial number, modulo 2**32, of last transaction
+)
+SEPARATOR = '-' * 165
+ADDRESS_PREFIX = {3: b'\x05'}  # version byte for P2SH, default is b'\0'
+
+class AllBalances(Callback):
+    '''
+    dump the balance for all addresses that appear in the blockchain
+
+    >>> balances = AllBalances(); balances.init(['--atBlock', '2'])
+    0
+    >>> for height in range(4):
+    ...     balances.startBlock({'height': height, 'time': 0})
+    ...     print(height, balances.active, balances.done)
+    0 True False
+    1 True False
+    2 False True
+    3 False True
+    '''
+    name = 'allBalances'
+    aliases = ('balances',)
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-a', '--atBlock', type=int, default=-1,
+                            help='only take into account transactions in'
+                            ' blocks strictly older than <block>'
+                            ' (default: all)')
+        parser.add_argument('-l', '--limit', type=int, default=-1,
+                            help='limit output to top N balances'
+                            ' (default: output all addresses)')
+        parser.add_argument('-w', '--withAddr', type=int, default=500,
+                            help='only show address for top N results'
+                            ' (default: N=%(default)s)')
+        parser.add_argument('-s', '--snapshot', type=int, action='append',
+                            default=[], help='save columns, as they stand'
+                            ' before block <height>, to allBalances.<height>'
+                            '.* files; may be repeated')
+        parser.add_argument('-c', '--capacity', type=int, default=1 << 20,
+                            help='expected number of addresses, to avoid'
+                            ' regrowing the address table')
+        parser.add_argument('restrict', nargs='*',
+                            help='hex hash160s to restrict output to')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.cutoffBlock = options.atBlock
+        self.limit = options.limit
+        self.showAddr = options.withAddr
+        self.snapshots = set(options.snapshot)
+        self.restrict = set(a2b_hex(key.encode()) for key in options.restrict)
+        self.addresses = AddressTable(2 * options.capacity)
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+        self.serial = 0
+        self.blockTime = 0
+        self.active = True
+        if self.cutoffBlock >= 0:
+            logging.info('only taking into account transactions'
+                         ' before block %d', self.cutoffBlock)
+        if self.restrict:
+            logging.info('restricting output to %d addresses',
+                         len(self.restrict))
+        return 0
+
+    def startBlock(self, block):
+        height = block['height']
+        if height in self.snapshots:
+            self.save('allBalances.%d' % height)
+        if 0 <= self.cutoffBlock <= height:
+            self.active = False
+            # nothing left to count, nor any snapshot to save
+            self.done = height > max(self.snapshots, default=-1)
+        self.blockTime = block['time']
+
+    def startTX(self, transaction, txhash):
+        self.serial = (self.serial + 1) & 0xffffffff
+
+    def move(self, script, value):
+        '''
+        credit (positive value) or debit (negative) the address of script
+        '''
+        kind, hash160 = solve_output_script(script)
+        if kind < 0 or not self.active:
+            return
+        if self.restrict and hash160 not in self.restrict:
+            return
+        identifier = self.addresses.add(hash160, kind)
+        if identifier == len(self.balance):
+            for name, typecode in COLUMNS:
+                getattr(self, name).append(0)
+        self.balance[identifier] += value
+        if value > 0:
+            self.received[identifier] += value
+            self.nbin[identifier] += 1
+            self.lastin[identifier] = self.blockTime
+        else:
+            self.sent[identifier] -= value
+            self.nbout[identifier] += 1
+            self.lastout[identifier] = self.blockTime
+        if self.lasttx[identifier] != self.serial:
+            self.lasttx[identifier] = self.serial
+            self.txcount[identifier] += 1
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        self.move(outputscript, value)
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        self.move(outputscript, -value)
+
+    def balance_of(self, hash160):
+        '''
+        return everything known about an address as a dict, or None
+        '''
+        identifier = self.addresses.lookup(hash160)
+        if identifier < 0:
+            return None
+        return dict((name, getattr(self, name)[identifier])
+                    for name, typecode in COLUMNS if name != 'lasttx')
+
+    def richest(self, limit=-1):
+        '''
+        return address ids by decreasing balance, the top `limit` if >= 0
+
+        uses a heap for top N, and a NumPy argsort of the balance column
+        (no per-address Python objects) when all are wanted.
+        '''
+        count = len(self.balance)
+        if 0 <= limit < count:
+            return heapq.nlargest(limit, range(count),
+                                  key=self.balance.__getitem__)
+        elif numpy is not None:
+            balances = numpy.frombuffer(self.balance, dtype=numpy.int64)
+            return numpy.argsort(-balances, kind='stable')
+        return sorted(range(count), key=self.balance.__getitem__,
+                      reverse=True)
+
+    def save(self, prefix):
+        '''
+        write the address table and all columns to prefix.* files
+        '''
+        logging.info('saving balances to %s.*', prefix)
+        self.addresses.save(prefix)
+        for name, typecode in COLUMNS:
+            with open('%s.%s' % (prefix, name), 'wb') as outfile:
+                getattr(self, name).tofile(outfile)
+
+    def load(self, prefix):
+        '''
+        replace current state with that written by `save`
+        '''
+        self.addresses = AddressTable.load(prefix)
+        for name, typecode in COLUMNS:
+            column = array(typecode)
+            with open('%s.%s' % (prefix, name), 'rb') as infile:
+                column.frombytes(infile.read())
+            setattr(self, name, column)
+
+    def wrapup(self):
+        # base58 needs script.py, and through it python-bitcoinlib
+        from script import hash_to_addr
+        logging.info('dumping %s balances ...',
+                     len(self.restrict) or 'all')
+        print(SEPARATOR)
+        print('%24s %40s %34s %6s %-24s  %6s %s' % (
+            'Balance', 'Hash160', 'Base58', 'nbIn', 'lastTimeIn',
+            'nbOut', 'lastTimeOut'))
+        print(SEPARATOR)
+        shown, nonzero = 0, 0
+        for identifier in self.richest(self.limit):
+            hash160 = self.addresses.hash160(identifier)
+            balance = self.balance[identifier]
+            nonzero += balance > 0
+            if shown < self.showAddr or self.restrict:
+                address = hash_to_addr(hash160, ADDRESS_PREFIX.get(
+                    self.addresses.kinds[identifier], b'\0'))
+            else:
+                address = 'X' * 34
+            print('%24.8f %s %34s %6d %s  %6d %s' % (
+                balance * 1e-8, to_hex(hash160), address,
+                self.nbin[identifier], gmtime(self.lastin[identifier]),
+                self.nbout[identifier], gmtime(self.lastout[identifier])))
+            shown += 1
+        logging.info('found %d addresses with non zero balance'
+                     ' among those shown', nonzero)
+        logging.info('found %d addresses in total', len(self.addresses))
+        logging.info('shown: %d addresses', shown)
+        print()
+
+def gmtime(timestamp):
+    '''
+    format a block time the way the C++ version does, via asctime
+
+    >>> gmtime(1231006505)
+    'Sat Jan  3 18:15:05 2009'
+    '''
+    return time.asctime(time.gmtime(timestamp))
+
+if __name__ == '__main__':
+    main(command='allBalances')
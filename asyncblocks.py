@@ -0,0 +1,84 @@
+#!/usr/bin/python3 -OO
+'''
+asyncio versions of the block iterators of blockparse
+
+`nextchunk`, `nextblock` and `next_transaction` here are async generators
+yielding just what the blockparse generators of the same names do. each
+item is fetched by the blocking generator in an executor thread, so its
+file reads, and its sleeps while waiting for the next block, never hold
+up the event loop; the blocking generator is only ever advanced by one
+thread at a time.
+
+    async for block in nextblock(blockfiles):
+        ...
+
+    python3 -OO asyncblocks.py [BLOCKFILE]
+'''
+from __future__ import division, print_function
+import sys, os, logging, asyncio
+import blockparse
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+DONE = object()  # what `next` returns at the end of a generator
+
+async def iterate(generator, executor=None):
+    '''
+    the items of a blocking generator, each fetched in `executor`
+
+    >>> async def squares():
+    ...     return [item async for item in iterate(n * n for n in range(4))]
+    >>> asyncio.run(squares())
+    [0, 1, 4, 9]
+    '''
+    loop = asyncio.get_event_loop()
+    while True:
+        item = await loop.run_in_executor(executor, next, generator, DONE)
+        if item is DONE:
+            return
+        yield item
+
+def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True,
+              executor=None):
+    '''
+    raw blocks in file order, as from blockparse.nextchunk
+    '''
+    return iterate(blockparse.nextchunk(blockfiles, minblock, maxblock, wait),
+                   executor)
+
+def nextblock(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True,
+              events=None, provisional=False, executor=None,
+              snapshot=None):
+    '''
+    confirmed blocks in blockchain order, as from blockparse.nextblock,
+    or with `provisional`, its (event, height, block) triples
+    '''
+    return iterate(blockparse.nextblock(blockfiles, minblock, maxblock, wait,
+                                        events, provisional, snapshot),
+                   executor)
+
+def next_transaction(blockfiles=None, minblock=0, maxblock=sys.maxsize,
+                     wait=True, executor=None):
+    '''
+    (height, txhash, transaction) of every transaction, as from
+    blockparse.next_transaction
+    '''
+    return iterate(blockparse.next_transaction(blockfiles, minblock,
+                                               maxblock, wait), executor)
+
+async def count(blockfiles):
+    '''
+    number of confirmed blocks and of their transactions
+    '''
+    heights, transactions = set(), 0
+    async for height, txhash, transaction in next_transaction(
+            blockfiles, wait=False):
+        heights.add(height)
+        transactions += 1
+    return len(heights), transactions
+
+if __name__ == '__main__':
+    print('%d blocks, %d transactions' % asyncio.run(
+        count(sys.argv[1:] or None)))
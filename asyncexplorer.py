@@ -0,0 +1,340 @@
+#!/usr/bin/python3 -OO
+'''
+the explorer served by asyncio, with only the standard library
+
+explorer.py answers each request in a thread, and so needs one thread
+per open connection, idle or not. here one event loop holds all the
+connections, kept alive between requests, while the answers are
+computed by explorer.application in a small pool of threads, and the
+blocks are indexed by an asyncblocks.nextblock task, or, with --shared,
+by chainindex.py. a long poll,
+
+    GET /tip?after=HEIGHT
+
+is answered as /tip as soon as the tip is above HEIGHT, or after
+LONGPOLL seconds if it is not, and
+
+    GET /events?after=SEQ
+
+as in explorer.py, once there is an event after SEQ. with an Accept of
+text/event-stream, /events streams every tip change as a Server-Sent
+Event, starting after the Last-Event-ID, if any, or the `after` SEQ.
+waiting costs a future, not a thread: the thread recording an event to
+explorer.EVENTS resolves the one future all waiters share, so thousands
+of clients can wait at once, and hear of a change within milliseconds.
+
+    python3 -OO asyncexplorer.py [--port 2424] [--blockfile FILE]...
+    python3 -OO asyncexplorer.py --shared
+'''
+from __future__ import division, print_function
+import sys, os, io, time, json, logging, argparse, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, parse_qs
+import explorer
+from asyncblocks import nextblock
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+THREADS = 8  # computing answers
+IDLE = 300  # seconds a kept-alive connection may wait for its next request
+LONGPOLL = 30  # seconds a /tip?after= request may wait
+KEEPALIVE = 15  # seconds between comments on an idle event stream
+MAX_HEADERS = 100
+MAX_BODY = 8 << 20  # bytes of a request body, such as a /txs list
+
+class Tip(object):
+    '''
+    the number of the last tip event, and a future, shared by all
+    waiters, for the next
+
+    >>> async def change():
+    ...     tip = Tip()
+    ...     waiting = asyncio.ensure_future(tip.wait(1))
+    ...     await asyncio.sleep(0)
+    ...     tip.update(1)
+    ...     return await waiting, await tip.wait(.01)
+    >>> asyncio.run(change())
+    (True, False)
+    '''
+    def __init__(self):
+        self.last = None
+        self.changed = None
+
+    def update(self, last):
+        if last != self.last:
+            self.last = last
+            if self.changed is not None and not self.changed.done():
+                self.changed.set_result(last)
+            self.changed = None
+
+    async def wait(self, timeout):
+        '''
+        whether the tip changed within `timeout` seconds
+        '''
+        if self.changed is None:
+            self.changed = asyncio.get_event_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.changed), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+TIP = Tip()
+
+def listen(loop, tip=TIP):
+    '''
+    have each event recorded to explorer.EVENTS, in whatever thread,
+    update `tip` in the event loop
+    '''
+    explorer.EVENTS.listeners.append(
+        lambda event: loop.call_soon_threadsafe(tip.update, event['seq']))
+
+async def index(blockfiles, executor=None):
+    '''
+    the asyncio version of `serve`: index blocks as they are confirmed
+    '''
+    transactions = explorer.txindex()
+    loop = asyncio.get_event_loop()
+    async for block in nextblock(blockfiles, executor=executor,
+                                 events=explorer.EVENTS,
+                                 snapshot=explorer.SNAPSHOT):
+        await loop.run_in_executor(executor, transactions.add_block, block)
+        explorer.EVENTS.confirmed(block)
+    logging.info('indexed all blocks')
+
+def indexed(task, server):
+    '''
+    if indexing failed, log why and stop serving a tip that will never
+    move again
+    '''
+    if not task.cancelled() and task.exception() is not None:
+        logging.error('indexing failed', exc_info=task.exception())
+        server.close()
+
+async def longpoll(query, tip=TIP):
+    '''
+    wait, up to LONGPOLL seconds, for the tip to pass the height `after`
+    '''
+    try:
+        after = int(parse_qs(query)['after'][0])
+    except (KeyError, ValueError):
+        return
+    deadline = time.time() + LONGPOLL
+    while tip_height() <= after:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        await tip.wait(remaining)
+
+def tip_height():
+    try:
+        return len(explorer.chain()) - 1
+    except explorer.Unavailable:
+        return -1
+
+async def next_event(query, tip=TIP):
+    '''
+    wait, up to LONGPOLL seconds, for an event after the number `after`
+    '''
+    try:
+        after = int(parse_qs(query)['after'][0])
+    except (KeyError, ValueError):
+        return
+    deadline = time.time() + LONGPOLL
+    while explorer.EVENTS.sequence == after:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        await tip.wait(remaining)
+
+async def stream(environ, query, writer, tip=TIP):
+    '''
+    send tip events as Server-Sent Events, until the client goes away
+    '''
+    try:
+        last = int(environ.get('HTTP_LAST_EVENT_ID') or
+                   parse_qs(query)['after'][0])
+    except (KeyError, ValueError):
+        last = explorer.EVENTS.sequence
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                 b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+    while True:
+        found = explorer.EVENTS.since(last)
+        if found['missed']:
+            writer.write(b'event: missed\ndata: {}\n\n')
+        for event in found['events']:
+            writer.write(('id: %d\nevent: %s\ndata: %s\n\n' % (
+                event['seq'], event['event'], json.dumps(
+                    event, separators=(',', ':')))).encode('utf8'))
+        last = found['last']
+        await writer.drain()
+        if explorer.EVENTS.sequence == last and not await tip.wait(KEEPALIVE):
+            writer.write(b': keep-alive\n\n')
+
+def respond(environ):
+    '''
+    status line, headers, first chunk and iterator of the rest of the
+    body of explorer.application's answer; the rest, as of /txs, may be
+    produced only as `next_chunk` asks for it
+    '''
+    answer = {}
+    def start_response(status, headers):
+        answer.update(status=status, headers=headers)
+    try:
+        chunks = iter(explorer.application(environ, start_response))
+        first = next(chunks, b'')
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('error answering %s', environ['PATH_INFO'])
+        return ('500 Internal Server Error', [('Content-Length', '0')],
+                b'', iter(()))
+    return answer['status'], answer['headers'], first, chunks
+
+def next_chunk(chunks):
+    '''
+    the next chunk of a body, or None at its end
+    '''
+    return next(chunks, None)
+
+async def handle(reader, writer, executor=None):
+    '''
+    answer the requests of one connection until it closes or idles
+    '''
+    loop = asyncio.get_event_loop()
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), IDLE)
+            except asyncio.TimeoutError:
+                break
+            if not line.strip():
+                break
+            try:
+                method, target, version = line.decode('latin1').split()
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\n'
+                             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            environ = await read_headers(reader)
+            if environ is None:
+                break
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                if length < 0:
+                    raise ValueError('negative Content-Length')
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\n'
+                             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            if length > MAX_BODY:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\n'
+                             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            environ['wsgi.input'] = io.BytesIO(
+                await reader.readexactly(length) if length else b'')
+            connection = environ.get('HTTP_CONNECTION', '').lower()
+            keepalive = connection == 'keep-alive' or (
+                version == 'HTTP/1.1' and connection != 'close')
+            path, query = (target.split('?', 1) + [''])[:2]
+            environ.update({
+                'REQUEST_METHOD': method, 'PATH_INFO': unquote(path),
+                'QUERY_STRING': query, 'SERVER_PROTOCOL': version,
+                'wsgi.url_scheme': 'http'})
+            if path == '/events' and 'text/event-stream' in environ.get(
+                    'HTTP_ACCEPT', ''):
+                await stream(environ, query, writer)
+                break
+            if path == '/tip' and query:
+                await longpoll(query)
+            elif path == '/events' and query:
+                await next_event(query)
+                environ['explorer.wait'] = 0  # waited here, not in a thread
+            status, headers, chunk, chunks = await loop.run_in_executor(
+                executor, respond, environ)
+            bodiless = method == 'HEAD' or status[:3] in ('204', '304')
+            chunked = not bodiless and not any(
+                name == 'Content-Length' for name, value in headers)
+            if chunked and version != 'HTTP/1.1':
+                # only closing the connection can end the body
+                chunked = keepalive = False
+            elif chunked:
+                headers = headers + [('Transfer-Encoding', 'chunked')]
+            writer.write(('HTTP/1.1 %s\r\n%sConnection: %s\r\n\r\n' % (
+                status, ''.join('%s: %s\r\n' % header for header in headers),
+                'keep-alive' if keepalive else 'close')).encode('latin1'))
+            if bodiless:
+                chunk = None
+            try:
+                while chunk is not None:
+                    if chunk and chunked:
+                        writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    elif chunk:
+                        writer.write(chunk)
+                    await writer.drain()
+                    chunk = await loop.run_in_executor(
+                        executor, next_chunk, chunks)
+            except ConnectionError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                # the status is sent: all that is left is to cut it short
+                logging.exception('error streaming %s', path)
+                break
+            finally:
+                getattr(chunks, 'close', lambda: None)()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            if not keepalive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def read_headers(reader):
+    '''
+    the request headers as a WSGI environ, or None if there are too many
+    '''
+    environ = {}
+    for count in range(MAX_HEADERS):
+        line = (await reader.readline()).decode('latin1').strip()
+        if not line:
+            return environ
+        name, colon, value = line.partition(':')
+        name = name.strip().upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = value.strip()
+    return None
+
+async def main(options):
+    executor = ThreadPoolExecutor(THREADS)
+    listen(asyncio.get_event_loop())
+    server = await asyncio.start_server(
+        lambda reader, writer: handle(reader, writer, executor),
+        None, options.port, backlog=1024)
+    indexer = None
+    if options.shared:
+        explorer.SHARED.append(True)
+        explorer.start_follower()
+    else:
+        indexer = asyncio.ensure_future(index(options.blockfiles))
+        indexer.add_done_callback(lambda task: indexed(task, server))
+    logging.info('explorer listening on port %d', options.port)
+    async with server:
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            if indexer is None or not indexer.done():
+                raise
+            sys.exit(1)  # closed by `indexed`, which logged why
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(prog=COMMAND, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--blockfile', action='append', dest='blockfiles')
+    PARSER.add_argument('--port', type=int, default=explorer.PORT)
+    PARSER.add_argument('--shared', action='store_true',
+                        help='read the index of a running chainindex.py')
+    asyncio.run(main(PARSER.parse_args()))
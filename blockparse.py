@@ -100,10 +100,14 @@ def nextprefix(openfile):
     blocktype = MAGIC.get(prefix[:4], 'unknown')
     return prefix, blocktype, blocksize, offset
 
-def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
+def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True,
+              start=None):
     '''
     generator that fetches and returns raw blocks out of blockfiles
 
+    `start`, if given, is the (index into blockfiles, offset, raw height)
+    to begin at, instead of the start of the first file, as from a snapshot
+
     with defaults, waits forever until terminated by signal
     NOTE: block "height" here refers only to relative position in files
 
@@ -121,6 +125,10 @@ def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
     offset = None  # into current blockfile
     currentfile = None
     done = False
+    if start is not None:
+        fileindex, offset, height = start
+        currentfile = open(blockfiles[fileindex], 'rb')
+        currentfile.seek(offset)
     while height <= maxheight:
         if currentfile is None or currentfile.closed:
             currentfile = open(blockfiles[fileindex], 'rb')
@@ -153,7 +161,7 @@ def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
                 currentfile.seek(offset)
                 continue
             if done:
-                raise StopIteration('No more blocks at this time')
+                return  # no more blocks at this time
         elif not any(bytes(prefix)):  # all zeroes
             STATE['phase'] = 'serving'
             if not wait:
@@ -170,7 +178,7 @@ def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
                 currentfile.seek(offset)
                 continue
             if done:
-                raise StopIteration('No more blocks at this time')
+                return  # no more blocks at this time
         else:
             logging.debug('block of size 0x%x at height %d', blocksize, height)
             if minheight <= height <= maxheight:
@@ -185,26 +193,57 @@ def nextchunk(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
                     'currency': blocktype,
                 }
             elif height > maxheight:
-                raise StopIteration('Returned all requested blocks')
+                return  # returned all requested blocks
             else:
                 logging.debug('discarding block at height %d', height)
                 currentfile.seek(blocksize, os.SEEK_CUR)
             height += 1
 
-def nextblock(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
+def nextblock(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True,
+              events=None, provisional=False, snapshot=None):
     '''
     return confirmed blocks in blockchain order
 
-    uses globals BLOCKCHAIN and CHAINS
+    uses globals BLOCKCHAIN and CHAINS; every change of the tip of BLOCKS,
+    including reorgs, is recorded to `events`, a tipevents.TipEvents
+
+    with `provisional`, yields (event, height, block) instead, so as not
+    to wait CONFIRMATIONS blocks to hear of one: a block is yielded as
+    'provisional' as soon as it is on the main chain, as 'rollback',
+    tip first, if a reorg takes it off again, and as 'confirmed', with
+    its 'height' set, as it would be yielded without `provisional`. a
+    block that is already confirmed when it joins the main chain is only
+    yielded as 'confirmed'.
+
+    given a `snapshot` filename, and no `minblock`, the globals are loaded
+    from it, if it exists and is of these blockfiles, and reading goes on
+    from where it was taken. a new one is taken every snapshot.INTERVAL
+    seconds, when the caller asks for the next block, and at the end; the
+    blocks yielded since then, if the caller stopped, are yielded again on
+    resuming.
     '''
     blockfiles = blockfiles or DEFAULT
-    chunks = nextchunk(blockfiles, minblock, maxblock, wait)
     previous_hash = show_hash(NULLBLOCK)
     last = -1  # last block returned
-    # initialize BLOCKCHAIN and CHAINS globals
-    BLOCKCHAIN[previous_hash] = {'children': [], 'hash': previous_hash}
-    CHAINS.update(BLOCKCHAIN)  # all chains including main chain
+    start = None
+    if snapshot is not None and minblock:
+        # a chain missing its first blocks is no use to a later run
+        logging.warning('not using snapshot %s, starting at block %s',
+                        snapshot, minblock)
+        snapshot = None
+    if snapshot is not None:
+        import snapshot as snapshots
+        saved = time.time()
+        if os.path.exists(snapshot):
+            last, start = resume(snapshot, blockfiles) or (last, None)
+    if start is None:
+        # initialize BLOCKCHAIN and CHAINS globals
+        BLOCKCHAIN[previous_hash] = {'children': [], 'hash': previous_hash}
+        CHAINS.update(BLOCKCHAIN)  # all chains including main chain
+    chunks = nextchunk(blockfiles, minblock, maxblock, wait, start)
+    after = start  # position after the last chunk
     blocks = []  # main chain, in order
+    pending = []  # blocks yielded as provisional, from height last + 1
     for chunk in chunks:
         rawblock = chunk.pop('rawblock')[PREFIX_LENGTH:]
         block = blockheader(rawblock)
@@ -231,13 +270,69 @@ def nextblock(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
                 changed = True
         logging.debug('chains after consolidation: %d', len(CHAINS))
         if changed:
+            oldtip, oldlength = BLOCKS[-1] if BLOCKS else None, len(BLOCKS)
             BLOCKS[:] = listchain(CHAINS[show_hash(NULLBLOCK)], BLOCKCHAIN)
             logging.debug('main chain length: %s', len(BLOCKS))
+            if events is not None:
+                events.tip(BLOCKS, oldtip, oldlength, BLOCKCHAIN)
             # when chain has 7 blocks, block 0 has 6 confirmations
             available = len(BLOCKS) - CONFIRMATIONS - 1
+            if provisional:
+                kept = 0
+                while kept < len(pending) and \
+                        last + 1 + kept < len(BLOCKS) and \
+                        BLOCKS[last + 1 + kept] is pending[kept]:
+                    kept += 1
+                while len(pending) > kept:
+                    yield 'rollback', last + len(pending), pending.pop()
             while available >= 0 and last < available:
                 last += 1
-                yield BLOCKS[last]
+                BLOCKS[last]['height'] = last
+                if not provisional:
+                    yield BLOCKS[last]
+                    continue
+                if pending:
+                    pending.pop(0)
+                yield 'confirmed', last, BLOCKS[last]
+            if provisional:
+                for height in range(last + 1 + len(pending), len(BLOCKS)):
+                    pending.append(BLOCKS[height])
+                    yield 'provisional', height, BLOCKS[height]
+        # the caller has done with all blocks yielded so far
+        after = position(blockfiles, chunk)
+        if snapshot is not None and \
+                time.time() - saved >= snapshots.INTERVAL:
+            snapshots.save(snapshot, BLOCKCHAIN, last, blockfiles, after)
+            saved, start = time.time(), after
+    if snapshot is not None and after != start:
+        snapshots.save(snapshot, BLOCKCHAIN, last, blockfiles, after)
+
+def position(blockfiles, chunk):
+    '''
+    (index into blockfiles, offset, raw height) of what follows `chunk`
+    '''
+    return (blockfiles.index(chunk['file']),
+            chunk['offset'] + chunk['length'], chunk['rawheight'] + 1)
+
+def resume(snapshot, blockfiles):
+    '''
+    load the globals from a snapshot, if it is of `blockfiles`; returns
+    the last block yielded and where to go on from
+    '''
+    from snapshot import load
+    blockchain, chains = {}, {}
+    blocks, last, files, start = load(snapshot, blockchain, chains)
+    if files[:len(blockfiles)] != blockfiles[:len(files)]:
+        logging.warning('snapshot %s is of %s, not %s, ignoring it',
+                        snapshot, files, blockfiles)
+        return None
+    BLOCKCHAIN.clear()
+    BLOCKCHAIN.update(blockchain)
+    CHAINS.clear()
+    CHAINS.update(chains)
+    BLOCKS[:] = blocks
+    blockfiles[len(blockfiles):] = files[len(blockfiles):]
+    return last, start
 
 def listchain(root, blockchain):
     '''
@@ -269,24 +364,39 @@ def connect(block, blocks):
                         previous['children'][0],
                         previous['children'][1])
 
-def serve(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True):
+def serve(blockfiles=None, minblock=0, maxblock=sys.maxsize, wait=True,
+          txindex=None, events=None, snapshot=None):
     '''
     first index all blocks, then run as a server, returning requested data
+
+    blocks go to the globals as `nextblock` confirms them, and, given a
+    `txindex.TxIndex`, their transactions to it, so that the explorer
+    can find them by txid. given a `tipevents.TipEvents`, changes of the
+    tip, and then each block confirmed and indexed, are recorded to it.
+    given a `snapshot` filename, indexing starts from where the last
+    snapshot was taken, as `nextblock` does
     '''
     blockfiles = blockfiles or DEFAULT
     logging.debug('serve: blockfiles: %s', blockfiles)
-    blocks = nextblock(blockfiles, minblock, maxblock, wait)
+    blocks = nextblock(blockfiles, minblock, maxblock, wait, events,
+                       snapshot=snapshot)
     previous_hash = show_hash(NULLBLOCK)
     STATE['phase'] = 'indexing'
     for block in blocks:
         logging.info('block: %s', block)
+        if txindex is not None:
+            txindex.add_block(block)
+        if events is not None:
+            events.confirmed(block)
 
 def explorer(environ, start_response):
     '''
     implement a uWSGI block explorer
+
+    routed by explorer.py, now the wsgi-file of blockexplorer.ini
     '''
-    start_response('200 gotcha', [('Content-type', 'text/plain')])
-    return [('BLOCKS length now: %s' % len(BLOCKS)).encode('utf8')]
+    from explorer import application
+    return application(environ, start_response)
 
 def nextfile(filename):
     '''
@@ -409,6 +519,7 @@ def blockheader(block):
     header['previous'] = show_hash(block[4:36])  # hash of previous block
     header['merkle_root'] = show_hash(block[36:68])
     header['unix_time'] = timestamp(block[68:72])
+    header['time'] = to_long(block[68:72])
     header['nbits'] = to_hex(block[72:76])
     header['nonce'] = to_hex(block[76:80])
     header['hash'] = show_hash(get_hash(block[:80]))
@@ -479,6 +590,42 @@ def get_hash(bytestring, repeat=2):
         bytestring = hashlib.sha256(bytestring).digest()
     return bytestring
 
+def hash160(bytestring):
+    '''
+    return ripemd160 of sha256 of bytestring, as used for addresses
+    '''
+    ripemd160 = hashlib.new('ripemd160')
+    ripemd160.update(hashlib.sha256(bytestring).digest())
+    return ripemd160.digest()
+
+def solve_output_script(script):
+    r'''
+    return script type and hash160 of the address an output pays to
+
+    same types as solveOutputScript in util.cpp: 0 for pay-to-pubkey-hash,
+    1 and 2 for uncompressed and compressed pay-to-pubkey, 3 for
+    pay-to-script-hash; -2 for the broken p2pool scripts and -1 for
+    anything else, both with None for the hash.
+
+    >>> solve_output_script(b'\xa9\x14' + b'\x01' * 20 + b'\x87')[0]
+    3
+    >>> solve_output_script(b'\x6a\x04test')
+    (-1, None)
+    '''
+    size = len(script)
+    if size == 25 and script[:3] == b'\x76\xa9\x14' and \
+            script[23:] == b'\x88\xac':
+        return 0, script[3:23]
+    elif size == 67 and script[:1] == b'\x41' and script[66:] == b'\xac':
+        return 1, hash160(script[1:66])
+    elif size == 35 and script[:1] == b'\x21' and script[34:] == b'\xac':
+        return 2, hash160(script[1:34])
+    elif size == 23 and script[:2] == b'\xa9\x14' and script[22:] == b'\x87':
+        return 3, script[2:22]
+    elif script[:6] == b'\x73\x63\x72\x69\x70\x74':
+        return -2, None
+    return -1, None
+
 def show_hash(bytestring):
     '''
     return a sha256 hash, or any other bytestring, reversed and hexlified
@@ -676,16 +823,6 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logging.error('KeyboardInterrupt, please wait for globals()...')
         pprint.pprint(globals(), stream=sys.stderr)
-elif sys.argv and sys.argv[0] == 'uwsgi':
-    logging.warning('args: %r', sys.argv)
-    import uwsgi, threading
-    logging.debug('uwsgi.opt: %s' % repr(uwsgi.opt))
-    SERVER = threading.Thread(
-        target=serve,
-        name='server',
-        args=(BLOCKFILES,) + tuple(*sys.argv[2:]))
-    SERVER.daemon = True
-    SERVER.start()
 else:
     logging.error('nothing more for %s to do on import, args: %r',
                   __name__, sys.argv)
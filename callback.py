@@ -0,0 +1,347 @@
+#!/usr/bin/python3 -OO
+'''
+Python counterpart of callback.h: derive from Callback to add a new command
+
+all registered callbacks are driven from a single parse loop, so that
+running several analyses costs one scan of the blockfiles plus the work
+done in the callbacks themselves, instead of one scan per analysis.
+
+usage: callback.py [--blockfile FILE]... [--minblock N] [--maxblock N]
+        [--wait] COMMAND [ARGS...] [+ COMMAND [ARGS...]]...
+'''
+from __future__ import division, print_function
+import sys, os, logging, argparse
+from blockparse import nextblock, get_transactions, get_count, \
+    parse_transaction, get_hash, to_long
+from outpoints import OutpointMap, COINBASE
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+# modules implementing the Python versions of the cb/*.cpp commands,
+# imported only when one of their commands is requested
+COMMANDS = {
+    'simpleStats': 'simplestats',
+    'stats': 'simplestats',
+    'allBalances': 'allbalances',
+    'balances': 'allbalances',
+    'closure': 'closure',
+    'cluster': 'closure',
+    'wallet': 'closure',
+    'taint': 'taint',
+    'trace': 'taint',
+    'csvdump': 'csvdump',
+    'csv': 'csvdump',
+    'localdb': 'localdb',
+    'sqlite': 'localdb',
+    'rollups': 'rollups',
+    'daily': 'rollups',
+    'columns': 'columns',
+    'columnar': 'columns',
+    'addressindex': 'addressindex',
+    'transactions': 'addressindex',
+    'txs': 'addressindex',
+    'book': 'addressindex',
+    'tally': 'addressindex',
+    'watchlist': 'watchlist',
+    'watch': 'watchlist',
+    'rewards': 'rewards',
+    'pristine': 'pristine',
+}
+
+# the deep-parse events of callback.h, in the order the parser emits them.
+# the first, shallow pass over all blocks (startMap, endMap, and the raw
+# startBlock/endBlock) happens inside `nextblock` and has no Python event.
+EVENTS = (
+    'start', 'startBlock', 'startTX', 'startInputs', 'startInput', 'edge',
+    'endInput', 'endInputs', 'startOutputs', 'startOutput', 'endOutput',
+    'endOutputs', 'endTX', 'endBlock', 'wrapup',
+)
+INPUT_EVENTS = ('startInput', 'edge', 'endInput')
+OUTPUT_EVENTS = ('startOutput', 'endOutput')
+
+class Callback(object):
+    '''
+    base class for Python commands, with the same event set as callback.h
+
+    subclasses set `name` (and optionally `aliases`) and override only the
+    events they need; events nobody overrides are never dispatched.
+    '''
+    name = None  # main name for callback
+    aliases = ()  # alternate names for callback
+    needTXHash = False  # set if you need the parser to compute TX hashes
+    done = False  # set once no more blocks are needed, to end the pass early
+
+    def init(self, args):
+        '''
+        called after construction, with the command's own arguments
+
+        returns nonzero if the callback cannot run
+        '''
+        return 0
+
+    def optionParser(self):
+        '''
+        option parser object for callback
+        '''
+        return argparse.ArgumentParser(prog=self.name,
+                                       description=self.__doc__)
+
+    def start(self):
+        '''
+        called when the parse of the chain starts
+        '''
+
+    def startBlock(self, block):
+        '''
+        called when a new block is encountered
+
+        `block` is the dict yielded by `nextblock`, with 'height' set
+        '''
+
+    def endBlock(self, block):
+        '''
+        called when an end of block is encountered
+        '''
+
+    def startTX(self, transaction, txhash):
+        '''
+        called when a new TX is encountered
+
+        `txhash` is None unless some callback sets `needTXHash`
+        '''
+
+    def endTX(self, transaction):
+        '''
+        called when an end of TX is encountered
+        '''
+
+    def startInputs(self, transaction):
+        '''
+        called when the start of a TX's input array is encountered
+        '''
+
+    def endInputs(self, transaction):
+        '''
+        called when the end of a TX's input array is encountered
+        '''
+
+    def startInput(self, txin):
+        '''
+        called when a TX input is encountered
+        '''
+
+    def endInput(self, txin):
+        '''
+        called when at the end of a TX input
+        '''
+
+    def startOutputs(self, transaction):
+        '''
+        called when the start of a TX's output array is encountered
+        '''
+
+    def endOutputs(self, transaction):
+        '''
+        called when the end of a TX's output array is encountered
+        '''
+
+    def startOutput(self, txout):
+        '''
+        called when a TX output is encountered
+        '''
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        '''
+        called when an output has been fully parsed
+        '''
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        '''
+        called exactly like startInput, but with a much richer context
+        '''
+
+    def wrapup(self):
+        '''
+        called when the whole chain has been parsed
+        '''
+
+def overrides(callback, event):
+    '''
+    True if `callback` has its own handler for `event`
+
+    >>> class Counter(Callback):
+    ...     def endTX(self, transaction): pass
+    >>> overrides(Counter(), 'endTX'), overrides(Counter(), 'startTX')
+    (True, False)
+    '''
+    method = getattr(type(callback), event)
+    method = getattr(method, '__func__', method)
+    default = getattr(Callback, event)
+    return method is not getattr(default, '__func__', default)
+
+def dispatch(callbacks):
+    '''
+    map each event to the bound handlers of the callbacks that override it
+    '''
+    return dict((event, [getattr(callback, event) for callback in callbacks
+                         if overrides(callback, event)])
+                for event in EVENTS)
+
+def process(callbacks, blockfiles=None, minblock=0, maxblock=sys.maxsize,
+            wait=False, outpoints=None):
+    '''
+    run all `callbacks` over the main chain in a single pass
+
+    each block is read and each transaction parsed once, no matter how
+    many callbacks are registered.
+
+    if any callback handles `edge`, every input is joined with the output
+    it spends through an OutpointMap (pass your own `outpoints` to choose
+    its file or memory bound). as in parser.cpp, inputs whose spent output
+    was never seen, e.g. when starting past `minblock` 0, get no edge.
+
+    the pass ends at the tip, or after the first block at which every
+    callback has set `done`.
+    '''
+    handlers = dispatch(callbacks)
+    edges = bool(handlers['edge'])
+    needhash = edges or any(callback.needTXHash for callback in callbacks)
+    inputs = any(handlers[event] for event in INPUT_EVENTS)
+    outputs = any(handlers[event] for event in OUTPUT_EVENTS)
+    temporary = edges and outpoints is None
+    if temporary:
+        outpoints = OutpointMap()
+    missing = 0
+    for handler in handlers['start']:
+        handler()
+    for block in nextblock(blockfiles, minblock, maxblock, wait):
+        for handler in handlers['startBlock']:
+            handler(block)
+        rawcount, count, data = get_count(get_transactions(block))
+        transactions = []
+        for index in range(count):
+            raw_transaction, transaction, data = parse_transaction(data)
+            txhash = get_hash(raw_transaction) if needhash else None
+            transactions.append((transaction, txhash))
+        spent = outpoints.resolve(transactions) if edges else {}
+        for transaction, txhash in transactions:
+            for handler in handlers['startTX']:
+                handler(transaction, txhash)
+            for handler in handlers['startInputs']:
+                handler(transaction)
+            if inputs:
+                for inputindex, txin in enumerate(transaction[2]):
+                    for handler in handlers['startInput']:
+                        handler(txin)
+                    if edges and txin[0] != COINBASE:
+                        found = spent.get(txin[0] + txin[1])
+                        if found is None:
+                            missing += 1
+                        else:
+                            for handler in handlers['edge']:
+                                handler(found[0], txin[0], to_long(txin[1]),
+                                        found[1], txhash, inputindex,
+                                        txin[3])
+                    for handler in handlers['endInput']:
+                        handler(txin)
+            for handler in handlers['endInputs']:
+                handler(transaction)
+            for handler in handlers['startOutputs']:
+                handler(transaction)
+            if outputs:
+                for outputindex, txout in enumerate(transaction[4]):
+                    for handler in handlers['startOutput']:
+                        handler(txout)
+                    if handlers['endOutput']:
+                        value = to_long(txout[0])
+                        for handler in handlers['endOutput']:
+                            handler(txout, value, txhash, outputindex,
+                                    txout[2])
+            for handler in handlers['endOutputs']:
+                handler(transaction)
+            for handler in handlers['endTX']:
+                handler(transaction)
+        for handler in handlers['endBlock']:
+            handler(block)
+        if all(callback.done for callback in callbacks):
+            break
+    if missing:
+        logging.warning('%d inputs spent outputs not seen, no edge sent',
+                        missing)
+    if temporary:
+        outpoints.close()
+    for handler in handlers['wrapup']:
+        handler()
+
+def find(name):
+    '''
+    return the Callback subclass registered under `name` or an alias
+
+    the class is looked up by name rather than by subclass, because under
+    `python3 callback.py` this module is `__main__`, while the command
+    modules derive from the separately imported `callback.Callback`.
+    '''
+    candidates = list(Callback.__subclasses__())
+    if name in COMMANDS:
+        candidates.extend(vars(__import__(COMMANDS[name])).values())
+    for candidate in candidates:
+        if not isinstance(candidate, type):
+            continue
+        if name == getattr(candidate, 'name', None) or \
+                name in getattr(candidate, 'aliases', ()):
+            return candidate
+    raise ValueError('Unknown command %r, choose from %s' %
+                     (name, sorted(COMMANDS)))
+
+def option_parser():
+    '''
+    parser for the global options, those of `process`
+    '''
+    parser = argparse.ArgumentParser(prog=COMMAND)
+    parser.add_argument('--blockfile', action='append', dest='blockfiles',
+                        help='blockfile to start from; may be repeated')
+    parser.add_argument('--minblock', type=int, default=0)
+    parser.add_argument('--maxblock', type=int, default=sys.maxsize)
+    parser.add_argument('--wait', action='store_true')
+    return parser
+
+def main(args=None, command=None):
+    '''
+    parse command line, construct the requested callbacks, and run them
+
+    when called from a command module's `__main__`, `command` names it and
+    all arguments not recognized as global options are passed to it.
+    '''
+    args = sys.argv[1:] if args is None else args
+    parser = option_parser()
+    if command is not None:
+        options, rest = parser.parse_known_args(args)
+        commands = [[command] + rest]
+    else:
+        start = [index for index in range(len(args))
+                 if args[index] in COMMANDS]
+        if not start:
+            raise ValueError('No command given, choose from %s' %
+                             sorted(COMMANDS))
+        options = parser.parse_args(args[:start[0]])
+        commands = [[]]
+        for arg in args[start[0]:]:
+            if arg == '+':
+                commands.append([])
+            else:
+                commands[-1].append(arg)
+    callbacks = []
+    for command in filter(None, commands):
+        callback = find(command[0])()
+        logging.info('starting command "%s"', callback.name)
+        if callback.init(command[1:]):
+            raise SystemExit('init of %s failed' % callback.name)
+        callbacks.append(callback)
+    process(callbacks, options.blockfiles, options.minblock,
+            options.maxblock, options.wait)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/python3 -OO
+'''
+chain index in shared memory-mapped files, one writer, many readers
+
+under uWSGI each worker process importing blockparse used to start its
+own `serve` thread, so N workers each scanned the whole chain and held
+their own BLOCKCHAIN. instead, one indexer process per host,
+`python3 chainindex.py`, appends every confirmed block to:
+
+ * chain.headers: per height, the block hash and 80-byte header, and
+   the block's length
+ * chain.offsets: per height, its blockfile number << 40 | offset
+ * chain.tip: the number of heights written so far
+ * blockindex: a txindex.TxIndex table of block hash to height
+ * txindex: the TxIndex of transactions, as `serve` keeps it
+
+and the workers map the same files read-only, so the memory and the
+startup scan are paid once per host. a height's entries are written
+before chain.tip counts it, so readers never see a partial entry, and
+they remap a file when the writer has grown it past their mapping.
+
+only confirmed blocks are written, so a block already in the index is
+never rewritten; the tip of the index is CONFIRMATIONS blocks behind
+that of the chain.
+
+    python3 -OO chainindex.py [--blockfile FILE]... [--directory DIR]
+'''
+from __future__ import division, print_function
+import sys, os, struct, logging, argparse
+from binascii import a2b_hex
+from blockparse import nextblock, blockheader
+from mapped import MappedArray
+from txindex import TxIndex, OFFSET_BITS
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+RECORD = struct.Struct('<32s80sLL')  # hash, header, length, unused
+TIME = struct.Struct('<L')  # at TIME_OFFSET in a RECORD
+TIME_OFFSET = 32 + 68
+DIRECTORY = 'explorer.index'
+
+class ChainIndex(object):
+    '''
+    the main chain's headers and block locations by height, and heights
+    by block hash
+
+    >>> import tempfile, shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> header = bytes(80)
+    >>> block = blockheader(header)
+    >>> block.update({'height': 0, 'file': 'blk0001.dat', 'offset': 8,
+    ...               'length': 88})
+    >>> ChainIndex(directory).append(block)
+    >>> reader = ChainIndex(directory, readonly=True)
+    >>> len(reader), reader.find(block['hash'])
+    (1, 0)
+    >>> found = reader.block(0)
+    >>> found['hash'] == block['hash'], found['offset'], found['length']
+    (True, 8, 88)
+    >>> reader.times(0, 2) == [block['time']]
+    True
+    >>> shutil.rmtree(directory)
+    '''
+    def __init__(self, directory=DIRECTORY, readonly=False):
+        self.readonly = readonly
+        if not readonly and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.headers, self.offsets, self.counter = (
+            MappedArray(os.path.join(directory, name), typecode, readonly)
+            for name, typecode in (('chain.headers', 'B'),
+                                   ('chain.offsets', 'q'),
+                                   ('chain.tip', 'q')))
+        if not readonly and not len(self.counter):
+            self.counter.append(0)
+        self.hashes = TxIndex(directory, readonly, name='blockindex')
+
+    def __len__(self):
+        if not mapped(self.counter, 1):
+            return 0
+        return self.counter[0]
+
+    def confirmed(self, height):
+        '''
+        whether the block at `height` can no longer change; all indexed
+        blocks are confirmed
+        '''
+        return 0 <= height < len(self)
+
+    def block(self, height):
+        '''
+        block dict, as `nextblock` yields it, of a height, or None
+        '''
+        if not 0 <= height < len(self):
+            return None
+        mapped(self.headers, (height + 1) * RECORD.size)
+        mapped(self.offsets, height + 1)
+        blockhash, header, length, unused = RECORD.unpack(
+            self.headers.view[height * RECORD.size:
+                              (height + 1) * RECORD.size])
+        location = self.offsets[height]
+        block = blockheader(header)
+        block.update({
+            'height': height, 'length': length,
+            'file': self.hashes.filename_of(location >> OFFSET_BITS),
+            'offset': location & ((1 << OFFSET_BITS) - 1)})
+        return block
+
+    def times(self, start, stop):
+        '''
+        block times of the heights from `start` to before `stop`, straight
+        from the mapped headers
+        '''
+        stop = min(stop, len(self))
+        if start >= stop or not mapped(self.headers, stop * RECORD.size):
+            return []
+        return [TIME.unpack_from(self.headers.view,
+                                 height * RECORD.size + TIME_OFFSET)[0]
+                for height in range(start, stop)]
+
+    def find(self, blockhash):
+        '''
+        height of the block with the displayed hash `blockhash`, or None
+        '''
+        key = a2b_hex(blockhash)[::-1]
+        for filename, offset, height, size in self.hashes.locate(key):
+            if height < len(self):
+                mapped(self.headers, (height + 1) * RECORD.size)
+                start = height * RECORD.size
+                if self.headers.view[start:start + 32] == key:
+                    return height
+        return None
+
+    def append(self, block):
+        '''
+        add the next confirmed block; the single writer's only operation
+
+        blocks already indexed, by an earlier run, are skipped.
+        '''
+        height = block['height']
+        blockhash = a2b_hex(block['hash'])[::-1]
+        if height < len(self):
+            start = height * RECORD.size
+            if self.headers.view[start:start + 32] != blockhash:
+                raise ValueError('index disagrees with the chain at height'
+                                 ' %d' % height)
+            return
+        elif height > len(self):
+            raise ValueError('block %d is past the end of the index at %d'
+                             % (height, len(self)))
+        self.hashes.add(blockhash, block['file'], block['offset'], height,
+                        block['length'])
+        self.headers.resize((height + 1) * RECORD.size)
+        start = height * RECORD.size
+        self.headers.view[start:start + RECORD.size] = RECORD.pack(
+            blockhash, raw_header(block), block['length'], 0)
+        self.offsets.append(self.hashes.number_of(block['file'])
+                            << OFFSET_BITS | block['offset'])
+        self.counter[0] = height + 1  # the entries are complete
+
+    def close(self):
+        for array in self.headers, self.offsets, self.counter:
+            array.close()
+        self.hashes.close()
+
+def mapped(array, items):
+    '''
+    make sure a read-only MappedArray maps at least `items`, remapping it
+    if the writer has grown its file
+    '''
+    if array.view is None or len(array.view) < items:
+        array.remap(items)
+    return array.view is not None and len(array.view) >= items
+
+def raw_header(block):
+    '''
+    the 80-byte header of a block dict from `blockheader`
+
+    >>> header = bytes(range(80))
+    >>> raw_header(blockheader(header)) == header
+    True
+    '''
+    return (a2b_hex(block['version']) +
+            a2b_hex(block['previous'])[::-1] +
+            a2b_hex(block['merkle_root'])[::-1] +
+            struct.pack('<L', block['time']) +
+            a2b_hex(block['nbits']) + a2b_hex(block['nonce']))
+
+def index(blockfiles=None, directory=DIRECTORY, wait=True):
+    '''
+    the indexer: append every confirmed block, and its transactions
+    '''
+    chain = ChainIndex(directory)
+    transactions = TxIndex(directory)
+    logging.info('chain index in %s has %d blocks', directory, len(chain))
+    snapshot = os.path.join(directory, 'chain.snapshot')
+    for block in nextblock(blockfiles, wait=wait, snapshot=snapshot):
+        chain.append(block)
+        transactions.add_block(block)
+        if not block['height'] % 1000:
+            logging.info('indexed block %d', block['height'])
+    chain.close()
+    transactions.close()
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(prog=COMMAND, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--blockfile', action='append', dest='blockfiles')
+    PARSER.add_argument('-d', '--directory', default=DIRECTORY)
+    PARSER.add_argument('--nowait', dest='wait', action='store_false',
+                        help='stop at the end of the blockfiles')
+    OPTIONS = PARSER.parse_args()
+    index(OPTIONS.blockfiles, OPTIONS.directory, OPTIONS.wait)
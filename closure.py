@@ -0,0 +1,231 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/closure.cpp: addresses provably controlled by one party
+
+all inputs of a transaction are assumed to be signed by the same owner, so
+the addresses they spend from are merged into one cluster. instead of
+building a graph and running connected components for one address, as the
+C++ version does, this runs a union-find (union by rank, path halving)
+over every multi-input transaction in the single pass, with parent and rank
+in memory-mapped arrays indexed by addresses.AddressTable id. afterwards
+the cluster of any address is one `find`, and the whole table of clusters
+can be exported, without another scan of the chain.
+'''
+from __future__ import division, print_function
+import sys, os, logging, time
+from array import array
+from blockparse import solve_output_script, to_hex
+from addresses import AddressTable, to_hash160
+from mapped import MappedArray
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+DICE = '1dice8EMZmqKvrGE4Qc9bUFf9PX3xaYDp'  # default seed, as in closure.cpp
+
+class UnionFind(object):
+    '''
+    disjoint sets over dense ids, stored in `prefix`.parent and .rank
+
+    >>> import tempfile
+    >>> prefix = tempfile.mktemp()
+    >>> sets = UnionFind(prefix)
+    >>> sets.resize(6)
+    >>> sets.union(0, 1); sets.union(2, 3); sets.union(1, 3)
+    >>> sets.find(2) == sets.find(0), sets.find(4) == sets.find(0)
+    (True, False)
+    >>> sets.close(); sets = UnionFind(prefix)
+    >>> sets.find(3) == sets.find(1), len(sets)
+    (True, 6)
+    >>> sets.close(); os.remove(prefix + '.parent'); os.remove(prefix + '.rank')
+    '''
+    def __init__(self, prefix, readonly=False):
+        self.parent = MappedArray(prefix + '.parent', 'I', readonly)
+        self.rank = MappedArray(prefix + '.rank', 'B', readonly)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def resize(self, length):
+        '''
+        add singleton sets up to `length` ids
+        '''
+        for identifier in range(len(self.parent), length):
+            self.parent.append(identifier)
+            self.rank.append(0)
+
+    def find(self, identifier):
+        '''
+        return the root of identifier's set, halving the path on the way
+
+        with union by rank this is O(alpha(n)) amortized.
+        '''
+        parent = self.parent
+        while parent[identifier] != identifier:
+            if not self.parent.readonly:
+                parent[identifier] = parent[parent[identifier]]
+            identifier = parent[identifier]
+        return identifier
+
+    def union(self, first, second):
+        '''
+        merge the sets containing `first` and `second`
+        '''
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self.rank[first] < self.rank[second]:
+            first, second = second, first
+        self.parent[second] = first
+        if self.rank[first] == self.rank[second]:
+            self.rank[first] += 1
+
+    def close(self):
+        self.parent.close()
+        self.rank.close()
+
+class Closure(Callback):
+    '''
+    builds a list of addresses provably controlled by the same party
+    '''
+    name = 'closure'
+    aliases = ('cluster', 'wallet')
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-p', '--prefix', default='closure',
+                            help='files to hold address table and sets'
+                            ' (default: %(default)s.*)')
+        parser.add_argument('-e', '--export',
+                            help='also write every address and its cluster'
+                            ' to this CSV file')
+        parser.add_argument('addresses', nargs='*',
+                            help='base58 addresses or hex hash160s to'
+                            ' show the closure of')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.prefix = options.prefix
+        self.export = options.export
+        if not options.addresses:
+            logging.warning('no addresses specified, using satoshi\'s'
+                            ' dice address %s', DICE)
+        self.rootHashes = [to_hash160(address)
+                           for address in options.addresses or [DICE]]
+        self.addresses = AddressTable()
+        for suffix in ('.parent', '.rank'):
+            if os.path.exists(self.prefix + suffix):
+                os.remove(self.prefix + suffix)
+        self.sets = UnionFind(self.prefix)
+        self.vertices = []
+        logging.info('Building address equivalence sets ...')
+        self.startTime = time.time()
+        return 0
+
+    def startTX(self, transaction, txhash):
+        self.vertices = []
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        kind, hash160 = solve_output_script(outputscript)
+        if kind < 0:
+            return
+        identifier = self.addresses.add(hash160, kind)
+        if identifier == len(self.sets):
+            self.sets.resize(identifier + 1)
+        self.vertices.append(identifier)
+
+    def endTX(self, transaction):
+        for index in range(1, len(self.vertices)):
+            self.sets.union(self.vertices[index - 1], self.vertices[index])
+
+    def wrapup(self):
+        logging.info('done, %.2f secs, found %d address(es)',
+                     time.time() - self.startTime, len(self.addresses))
+        self.addresses.save(self.prefix)
+        self.sets.parent.flush()
+        self.sets.rank.flush()
+        clusters = Clusters(self.addresses, self.sets)
+        logging.info('found %d clusters', clusters.count)
+        for hash160 in self.rootHashes:
+            logging.info('Address cluster for address %s:', to_hex(hash160))
+            members = clusters.cluster(hash160)
+            if not members:
+                logging.warning('specified key was never used to spend coins')
+                members = [hash160]
+            for member in members:
+                print(to_hex(member))
+            print()
+            logging.info('%d addresse(s)', len(members))
+        if self.export:
+            clusters.export(self.export)
+        self.sets.close()
+
+class Clusters(object):
+    '''
+    queries over the finished sets: cluster of an address, and export
+
+    members are grouped once by root (a counting sort into `order`, with
+    `start` offsets per root), so listing a cluster costs its size.
+    '''
+    def __init__(self, addresses, sets):
+        self.addresses, self.sets = addresses, sets
+        count = len(sets)
+        roots = array('I', (sets.find(identifier)
+                            for identifier in range(count)))
+        self.start = array('I', [0]) * (count + 1)
+        for root in roots:
+            self.start[root + 1] += 1
+        self.count = sum(1 for index in range(count)
+                         if self.start[index + 1])
+        for index in range(count):
+            self.start[index + 1] += self.start[index]
+        position = array('I', self.start[:count])
+        self.order = array('I', [0]) * count
+        for identifier, root in enumerate(roots):
+            self.order[position[root]] = identifier
+            position[root] += 1
+
+    @classmethod
+    def load(cls, prefix='closure'):
+        '''
+        open the files left by a closure run, for queries in any process
+        '''
+        return cls(AddressTable.load(prefix),
+                   UnionFind(prefix, readonly=True))
+
+    def root(self, hash160):
+        '''
+        return the cluster id (root address id) of hash160, or -1
+        '''
+        identifier = self.addresses.lookup(hash160)
+        return -1 if identifier < 0 else self.sets.find(identifier)
+
+    def cluster(self, hash160):
+        '''
+        return the hash160s of all addresses in the cluster of hash160
+        '''
+        root = self.root(hash160)
+        if root < 0:
+            return []
+        return [self.addresses.hash160(identifier) for identifier in
+                self.order[self.start[root]:self.start[root + 1]]]
+
+    def export(self, filename):
+        '''
+        write Hash160,Cluster,Size for every address, grouped by cluster
+        '''
+        logging.info('exporting clusters to %s', filename)
+        with open(filename, 'w') as outfile:
+            outfile.write('Hash160,Cluster,Size\n')
+            for identifier in self.order:
+                root = self.sets.find(identifier)
+                outfile.write('%s,%d,%d\n' % (
+                    to_hex(self.addresses.hash160(identifier)), root,
+                    self.start[root + 1] - self.start[root]))
+
+if __name__ == '__main__':
+    main(command='closure')
@@ -0,0 +1,264 @@
+#!/usr/bin/python3 -OO
+'''
+columnar store of the chain: one memory-mappable file per field
+
+built once by the parser, so that later analyses read only the fields
+they need, as NumPy arrays over `numpy.memmap`, instead of parsing the
+blk files again. transactions, outputs and inputs are numbered in chain
+order, and each column is a flat file of fixed-size items indexed by
+those numbers. rows of a height or a transaction are found through
+offset columns of count + 1 items, as in CSR: the outputs of
+transaction t are output.*[tx.output[t]:tx.output[t + 1]].
+
+scripts, of variable length, are concatenated in output.scripts, with
+their offsets in output.script. an input points to the number of the
+output it spends, so unspent outputs are those no input points to.
+
+    python3 -OO columns.py --directory chain.columns
+    python3 -OO columns.py --directory chain.columns --values
+'''
+from __future__ import division, print_function
+import sys, os, logging
+from array import array
+import numpy
+from blockparse import solve_output_script, show_hash
+from outpoints import OutpointMap, COINBASE, OP_RETURN, outpoint
+from addresses import AddressTable
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+# column file name and array typecode, or item size for raw bytes
+COLUMNS = (
+    ('block.tx', 'q'),  # first transaction of each height, then the count
+    ('tx.height', 'i'),
+    ('tx.txid', 32),  # in internal byte order
+    ('tx.output', 'q'),  # first output of each transaction, then the count
+    ('tx.input', 'q'),  # first input of each transaction, then the count
+    ('output.value', 'q'),
+    ('output.kind', 'b'),  # script type from solve_output_script
+    ('output.address', 'i'),  # id in the AddressTable `address`, or -1
+    ('output.script', 'q'),  # offset in output.scripts, then the size
+    ('output.scripts', 1),
+    ('input.prevout', 'q'),  # number of the output spent, -1 for coinbase
+)
+BUFFER = 1 << 20  # bytes buffered per column before writing
+
+class Column(object):
+    '''
+    append-only column file, written in buffered chunks
+
+    >>> import tempfile
+    >>> filename = tempfile.mktemp()
+    >>> column = Column(filename, 'q')
+    >>> column.append(5); column.extend([7, 9]); len(column)
+    3
+    >>> column.close()
+    >>> load_column(filename, 'q').tolist()
+    [5, 7, 9]
+    >>> os.remove(filename)
+    '''
+    def __init__(self, filename, typecode):
+        self.file = open(filename, 'wb')
+        self.typecode = typecode
+        self.raw = isinstance(typecode, int)  # items are bytes of that size
+        self.itemsize = typecode if self.raw else array(typecode).itemsize
+        self.written = 0  # bytes
+        self.clear()
+
+    def clear(self):
+        self.buffer = bytearray() if self.raw else array(self.typecode)
+
+    def size(self):
+        '''
+        bytes in the buffer
+        '''
+        return len(self.buffer) * (1 if self.raw else self.itemsize)
+
+    def __len__(self):
+        return (self.written + self.size()) // self.itemsize
+
+    def append(self, item):
+        if self.raw:
+            self.buffer += item
+        else:
+            self.buffer.append(item)
+        if self.size() >= BUFFER:
+            self.flush()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def flush(self):
+        self.written += self.size()
+        self.file.write(self.buffer)
+        self.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class Columns(Callback):
+    '''
+    write the columnar store of the blockchain
+    '''
+    name = 'columns'
+    aliases = ('columnar',)
+    needTXHash = True
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-d', '--directory', default='columns',
+                            help='directory of the column files'
+                            ' (default: %(default)s)')
+        parser.add_argument('-v', '--values', action='store_true',
+                            help='with `python3 columns.py`, print the'
+                            ' total output value per height from the store'
+                            ' instead of scanning')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.directory = options.directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.columns = dict(
+            (name, Column(os.path.join(self.directory, name), typecode))
+            for name, typecode in COLUMNS)
+        for name in ('block.tx', 'tx.output', 'tx.input', 'output.script'):
+            self.columns[name].append(0)
+        self.addresses = AddressTable()
+        # spendable outputs, to their output number
+        self.pending = OutpointMap()
+        self.created, self.wanted = [], []
+        self.transactions = self.outputs = self.inputs = self.scripts = 0
+        return 0
+
+    def startBlock(self, block):
+        self.height = block['height']
+
+    def startTX(self, transaction, txhash):
+        self.columns['tx.height'].append(self.height)
+        self.columns['tx.txid'].append(txhash)
+        self.transactions += 1
+
+    def startInput(self, txin):
+        self.wanted.append(None if txin[0] == COINBASE else txin[0] + txin[1])
+        self.inputs += 1
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        kind, hash160 = solve_output_script(outputscript)
+        self.columns['output.value'].append(value)
+        self.columns['output.kind'].append(kind)
+        self.columns['output.address'].append(
+            self.addresses.add(hash160, kind) if kind >= 0 else -1)
+        self.columns['output.scripts'].append(outputscript)
+        self.scripts += len(outputscript)
+        self.columns['output.script'].append(self.scripts)
+        if outputscript[:1] != OP_RETURN:
+            self.created.append((outpoint(txhash, outputindex),
+                                 (self.outputs, b'')))
+        self.outputs += 1
+
+    def endTX(self, transaction):
+        self.columns['tx.output'].append(self.outputs)
+        self.columns['tx.input'].append(self.inputs)
+
+    def endBlock(self, block):
+        self.pending.update(self.created)
+        found = self.pending.pop_many([key for key in self.wanted if key])
+        self.columns['input.prevout'].extend(
+            found[key][0] if key in found else -1 for key in self.wanted)
+        self.columns['block.tx'].append(self.transactions)
+        del self.created[:], self.wanted[:]
+
+    def wrapup(self):
+        self.pending.close()
+        for column in self.columns.values():
+            column.close()
+        self.addresses.save(os.path.join(self.directory, 'address'))
+        logging.info('stored %d transactions, %d outputs and %d inputs in %s',
+                     self.transactions, self.outputs, self.inputs,
+                     self.directory)
+
+class ChainStore(object):
+    '''
+    read-only NumPy views of the column files in `directory`
+
+    columns are attributes named as their files, with _ for the dot:
+    store.output_value, store.tx_txid and so on.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        for name, typecode in COLUMNS:
+            setattr(self, name.replace('.', '_'),
+                    load_column(os.path.join(directory, name), typecode))
+
+    def __len__(self):
+        return len(self.block_tx) - 1
+
+    def output_height(self):
+        '''
+        height of each output
+        '''
+        return numpy.repeat(self.tx_height,
+                            numpy.diff(self.tx_output)).astype(numpy.int32)
+
+    def value_by_height(self):
+        '''
+        total output value, coinbase included, of each height
+
+        the same as the f_outputvalue column of t_block.
+        '''
+        starts = self.tx_output[self.block_tx]
+        totals = numpy.add.reduceat(self.output_value, starts[:-1]) \
+            if len(self.output_value) else numpy.zeros(len(self), numpy.int64)
+        totals[starts[:-1] == starts[1:]] = 0  # heights with no outputs
+        return totals
+
+    def unspent(self):
+        '''
+        boolean mask of the outputs no input spends
+        '''
+        unspent = numpy.ones(len(self.output_value), dtype=bool)
+        prevout = self.input_prevout
+        unspent[prevout[prevout >= 0]] = False
+        return unspent
+
+    def script(self, output):
+        '''
+        script of output number `output`, as bytes
+        '''
+        return self.output_scripts[
+            self.output_script[output]:self.output_script[output + 1]
+        ].tobytes()
+
+    def txid(self, transaction):
+        '''
+        hash of transaction number `transaction`, as displayed
+        '''
+        return show_hash(self.tx_txid[transaction].tobytes())
+
+def load_column(filename, typecode):
+    '''
+    memory-map a column file as a NumPy array, read-only
+    '''
+    if isinstance(typecode, int):
+        dtype = numpy.dtype('u1' if typecode == 1 else 'V%d' % typecode)
+    else:
+        dtype = numpy.dtype(typecode)
+    if not os.path.getsize(filename):  # mmap refuses empty files
+        return numpy.zeros(0, dtype)
+    return numpy.memmap(filename, dtype=dtype, mode='r')
+
+if __name__ == '__main__':
+    OPTIONS = Columns().optionParser().parse_known_args()[0]
+    if OPTIONS.values:
+        for HEIGHT, VALUE in enumerate(
+                ChainStore(OPTIONS.directory).value_by_height().tolist()):
+            print('%d %.8f' % (HEIGHT, VALUE / 1e8))
+    else:
+        main(command='columns')
@@ -0,0 +1,572 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/csv.cpp: CSV dump of the blockchain for db/*.sh
+
+writes blocks.csv, transactions.csv, outputs.csv and inputs.csv, with the
+columns of t_block, t_transaction, t_output and t_input in
+db/blockchain.schema, in a single pass. fees need the value of every
+output spent, so the pass always starts from the genesis block and
+--firstBlock only sets where writing starts; IDs, which are chain heights
+and transaction serial numbers, are the same as in a full dump.
+
+--since and --until, unix times or UTC dates, narrow the heights written
+to those a timeindex.TimeIndex bounds them to: from the first block
+dated --since or later, to where the median time past reaches --until,
+after which no block can be dated before it, and the pass stops there.
+
+with --jobs N (as `csvdump.py`, not through callback.py), the heights from
+--firstBlock to --lastBlock are split into N shards, each dumped by its own
+process to headerless TABLE.csv.N part files, concatenated afterwards
+under one header. every process still follows the outputs of the blocks
+before its shard, but the formatting and writing of rows, the bulk of the
+work, is shared out.
+
+outputs are written pre-linked: rather than leave f_inputtxhash and
+f_inputtxindex NULL for the link_txs trigger of db/blockchain.schema to
+fill in, row by row, as t_input is loaded, each output row is held back,
+in an outpoints.OutpointMap spilling to disk, until the input spending it
+is seen, and written with its link; the still unspent are written at the
+end. db/prelinked.schema loads the result with plain COPY. outputs made
+before --firstBlock and spent from it on, which an earlier dump wrote
+with no link, go to spends.csv instead, for db/update.sh to apply in one
+joined UPDATE.
+
+shard processes write the held back outputs left at their end, and the
+spends of outputs made before their shard, to keyed UNSPENT.csv.N and
+SPENDS.csv.N part files. joining those, in shard order, is the same
+streaming join, over far fewer rows, and is done while concatenating.
+
+unlike csv.cpp, scripts are written in script order rather than byte
+reversed, and P2SH receiving addresses get their own version byte.
+'''
+from __future__ import division, print_function
+import sys, os, struct, logging, time, shutil, itertools, multiprocessing
+from binascii import a2b_hex, b2a_hex
+from functools import lru_cache
+from blockparse import nextblock, solve_output_script, show_hash, to_long, \
+    PREFIX_LENGTH
+from outpoints import OutpointMap, COINBASE, OP_RETURN, outpoint
+from allbalances import ADDRESS_PREFIX
+from callback import Callback, main, process, option_parser
+from timeindex import TimeIndex, parse_time
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+# table files and their CSV header lines, as written by csv.cpp
+TABLES = (
+    ('blocks', 'ID,Hash,Version,Timestamp,Nonce,Difficulty,Merkle,'
+     'NumTransactions,OutputValue,FeesValue,Size'),
+    ('transactions', 'ID,Hash,Version,BlockId,NumInputs,NumOutputs,'
+     'OutputValue,FeesValue,LockTime,Size'),
+    ('outputs', 'TransactionId,Index,Value,Script,ReceivingAddress,'
+     'InputTxHash,InputTxIndex'),
+    ('inputs', 'TransactionId,Index,Script,OutputTxHash,OutputTxIndex'),
+    # links for outputs dumped before --firstBlock, to UPDATE t_output with
+    ('spends', 'TransactionId,Index,InputTxHash,InputTxIndex'),
+)
+BUFFER = 1 << 20  # write buffer per table file
+ADDRESS_CACHE = 1 << 16  # recently seen scripts whose address is kept
+RECORDS = 10000  # part file records joined at a time
+RECORD = struct.Struct('<36sLL')  # part file record: key, row and link size
+# binary COPY file header: signature, flags and header extension length
+PGCOPY = b'PGCOPY\n\xff\r\n\0' + struct.pack('>ii', 0, 0)
+POSTGRES_EPOCH = 946684800  # 2000-01-01, as a unix time
+
+class CSVFormat(object):
+    '''
+    rows as csv.cpp writes them, for COPY ... WITH (FORMAT CSV, HEADER)
+
+    hashes come in internal byte order, scripts as bytes; an output row
+    is split in its columns up to the link, and the link.
+    '''
+    extension = 'csv'
+    trailer = b''
+    unlinked = b',\n'
+
+    def header(self, table):
+        return (dict(TABLES)[table] + '\n').encode()
+
+    def block(self, height, blockhash, version, blocktime, nonce,
+              difficulty, merkle, count, output, fees, size):
+        return ('%d,"%s",%d,"%s",%d,%f,"%s",%d,%d,%d,%d\n' % (
+            height, show_hash(blockhash), version,
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(blocktime)),
+            nonce, difficulty, show_hash(merkle), count, output, fees,
+            size)).encode()
+
+    def transaction(self, txID, txhash, version, height, inputs, outputs,
+                    value, fees, locktime, size):
+        return ('%d,"%s",%d,%d,%d,%d,%d,%d,%d,%d\n' % (
+            txID, show_hash(txhash), version, height, inputs, outputs,
+            value, fees, locktime, size)).encode()
+
+    def output(self, txID, index, value, script, address):
+        return ('%d,%d,%d,"%s","%s",' % (
+            txID, index, value, b2a_hex(script).decode(), address)).encode()
+
+    def link(self, txhash, index):
+        return ('"%s",%d\n' % (show_hash(txhash), index)).encode()
+
+    def input(self, txID, index, script, txhash, outputindex):
+        return ('%d,%d,"%s","%s",%d\n' % (
+            txID, index, b2a_hex(script).decode(), show_hash(txhash),
+            outputindex)).encode()
+
+    def spend(self, txID, index, link):
+        return ('%d,%d,' % (txID, index)).encode() + link
+
+class BinaryFormat(CSVFormat):
+    r'''
+    rows in PostgreSQL's binary COPY format, for db/binary.schema
+
+    every field is its length, as a big-endian int32, then its bytes:
+    int8 for counts, values and IDs, int4 for indexes, bytea for hashes,
+    in displayed order, and for scripts, float8 for the difficulty, and
+    int8 microseconds since 2000 for the timestamp.
+
+    >>> from blockparse import to_hex
+    >>> rows = BinaryFormat()
+    >>> data = (rows.header('inputs') +
+    ...         rows.input(7, 1, b'\x51', b'\xab' + b'\0' * 31, 2) +
+    ...         rows.trailer)
+    >>> [[to_hex(field)[-4:] for field in row] for row in pgcopy_rows(data)]
+    [['0007', '0001', '51', '00ab', '0002']]
+    '''
+    extension = 'bin'
+    trailer = struct.pack('>h', -1)
+    unlinked = struct.pack('>ii', -1, -1)  # two NULLs
+    BLOCK = struct.Struct('>hiqi32siqiqiqidi32siqiqiqiq')
+    TRANSACTION = struct.Struct('>hiqi32siqiqiqiqiqiqiqiq')
+    OUTPUT = struct.Struct('>hiqiiiqi')  # then script, address
+    LINK = struct.Struct('>i32sii')
+    INPUT = struct.Struct('>hiqiii')  # then script, hash, output index
+    SPEND = struct.Struct('>hiqii')  # then link
+
+    def header(self, table):
+        return PGCOPY
+
+    def block(self, height, blockhash, version, blocktime, nonce,
+              difficulty, merkle, count, output, fees, size):
+        return self.BLOCK.pack(
+            11, 8, height, 32, blockhash[::-1], 8, version,
+            8, (blocktime - POSTGRES_EPOCH) * 1000000, 8, nonce,
+            8, difficulty, 32, merkle[::-1], 8, count, 8, output, 8, fees,
+            8, size)
+
+    def transaction(self, txID, txhash, version, height, inputs, outputs,
+                    value, fees, locktime, size):
+        return self.TRANSACTION.pack(
+            10, 8, txID, 32, txhash[::-1], 8, version, 8, height, 8, inputs,
+            8, outputs, 8, value, 8, fees, 8, locktime, 8, size)
+
+    def output(self, txID, index, value, script, address):
+        address = address.encode()
+        return b''.join((
+            self.OUTPUT.pack(7, 8, txID, 4, index, 8, value, len(script)),
+            script, struct.pack('>i', len(address)), address))
+
+    def link(self, txhash, index):
+        return self.LINK.pack(32, txhash[::-1], 4, index)
+
+    def input(self, txID, index, script, txhash, outputindex):
+        return b''.join((
+            self.INPUT.pack(5, 8, txID, 4, index, len(script)), script,
+            self.LINK.pack(32, txhash[::-1], 4, outputindex)))
+
+    def spend(self, txID, index, link):
+        return self.SPEND.pack(4, 8, txID, 4, index) + link
+
+FORMATS = {'csv': CSVFormat, 'binary': BinaryFormat}
+
+class CSVDump(Callback):
+    '''
+    create an CSV dump of the blockchain
+    '''
+    name = 'csvdump'
+    aliases = ('csv',)
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-f', '--firstBlock', type=int, default=0,
+                            help='first block to dump (default: 0)')
+        parser.add_argument('-l', '--lastBlock', type=int, default=-1,
+                            help='last block to dump (default: last block)')
+        parser.add_argument('--since', type=parse_time,
+                            help='first block time to dump, unix time or'
+                            ' UTC date')
+        parser.add_argument('--until', type=parse_time,
+                            help='block time to dump up to')
+        parser.add_argument('-d', '--directory', default='.',
+                            help='where to write the table files'
+                            ' (default: current directory)')
+        parser.add_argument('-F', '--format', choices=sorted(FORMATS),
+                            default='csv', help='CSV, or PostgreSQL binary'
+                            ' COPY files TABLE.bin (default: %(default)s)')
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='with `python3 csvdump.py`, number of'
+                            ' processes dumping height shards in parallel')
+        parser.add_argument('--part', type=int, default=-1,
+                            help='write headerless TABLE.EXT.PART files'
+                            ' for --jobs to concatenate')
+        return parser
+
+    def init(self, args):
+        # base58 needs script.py, and through it python-bitcoinlib
+        from script import hash_to_addr
+        options = self.optionParser().parse_args(args)
+        self.firstBlock = options.firstBlock
+        self.lastBlock = options.lastBlock
+        self.time_range(options.since, options.until)
+        self.rows = FORMATS[options.format]()
+        self.part, self.directory = options.part, options.directory
+        self.files = {}
+        for table, header in TABLES:
+            self.files[table] = open(self.filename(table), 'wb', BUFFER)
+            if self.part < 0:
+                self.files[table].write(self.rows.header(table))
+        # unspent outputs: key to (transaction ID, row up to the link);
+        # the row is empty for outputs made before --firstBlock
+        self.pending = OutpointMap()
+        self.created, self.spent = [], []
+        self.address = lru_cache(ADDRESS_CACHE)(
+            lambda script: receiving_address(script, hash_to_addr))
+        self.txID = 0
+        self.active = False
+        logging.info('Dumping the blockchain...')
+        return 0
+
+    def time_range(self, since=None, until=None):
+        '''
+        dump only the heights that may hold blocks from `since` to before
+        `until`, as the TimeIndex of the pass bounds them
+        '''
+        self.since, self.until = since, until
+        self.times = TimeIndex()
+
+    def filename(self, table):
+        '''
+        file for `table`, or for this process's part of it
+        '''
+        filename = os.path.join(self.directory,
+                                '%s.%s' % (table, self.rows.extension))
+        if self.part >= 0:
+            filename += '.%d' % self.part
+        return filename
+
+    def startBlock(self, block):
+        self.blockHeight = block['height']
+        self.times.append(block['time'])
+        self.active = self.blockHeight >= self.firstBlock and (
+            self.since is None or self.times.latest[-1] >= self.since) and (
+            self.until is None or len(self.times) < 2 or
+            self.times.mtp[-2] < self.until)
+        self.blockTXs = self.blockOutput = self.blockFees = 0
+
+    def startTX(self, transaction, txhash):
+        if self.active:
+            self.coinbase = transaction[2][0][0] == COINBASE
+            self.txInputs = self.txOutputs = 0
+            self.txInput = self.txOutput = 0
+            self.txHash = txhash
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        row = b''
+        if self.active:
+            self.txOutputs += 1
+            self.txOutput += value
+            row = self.rows.output(self.txID, outputindex, value,
+                                   outputscript, self.address(outputscript))
+        if outputscript[:1] == OP_RETURN:  # never spent, no need to wait
+            if row:
+                self.files['outputs'].write(row + self.rows.unlinked)
+        else:
+            self.created.append((outpoint(txhash, outputindex),
+                                 (self.txID, row)))
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        self.spent.append((outpoint(uptxhash, outputindex), downtxhash,
+                           inputindex))
+        if self.active:
+            self.txInputs += 1
+            self.txInput += value
+            self.files['inputs'].write(self.rows.input(
+                self.txID, inputindex, inputscript, uptxhash, outputindex))
+
+    def endTX(self, transaction):
+        if self.active:
+            fees = 0 if self.coinbase else self.txInput - self.txOutput
+            self.blockTXs += 1
+            self.blockOutput += self.txOutput
+            self.blockFees += fees
+            self.files['transactions'].write(self.rows.transaction(
+                self.txID, self.txHash, to_long(transaction[0]),
+                self.blockHeight, self.txInputs, self.txOutputs,
+                self.txOutput, fees, to_long(transaction[5]),
+                transaction_size(transaction)))
+        self.txID += 1
+
+    def endBlock(self, block):
+        self.link()
+        if self.active:
+            self.files['blocks'].write(self.rows.block(
+                block['height'], a2b_hex(block['hash'])[::-1],
+                header_long(block, 'version'), block['time'],
+                header_long(block, 'nonce'),
+                difficulty(header_long(block, 'nbits')),
+                a2b_hex(block['merkle_root'])[::-1], self.blockTXs,
+                self.blockOutput, self.blockFees,
+                block['length'] - PREFIX_LENGTH))
+        if 0 <= self.lastBlock <= block['height'] or (
+                self.until is not None and self.times.mtp[-1] >= self.until):
+            self.done = True
+
+    def link(self):
+        '''
+        join the outputs spent in this block with their spending inputs
+
+        outputs made in the block are added first, as they may be spent
+        in it too.
+        '''
+        self.pending.update(self.created)
+        found = self.pending.pop_many([key for key, txhash, index
+                                       in self.spent])
+        if self.active:
+            for key, txhash, index in self.spent:
+                upTxID, row = found[key]
+                link = self.rows.link(txhash, index)
+                if row:
+                    self.files['outputs'].write(row + link)
+                else:
+                    spend = self.rows.spend(upTxID, to_long(key[32:]), link)
+                    if self.part >= 0:  # may be in an earlier shard's part
+                        write_record(self.files['spends'], key, spend, link)
+                    else:
+                        self.files['spends'].write(spend)
+        del self.created[:], self.spent[:]
+
+    def wrapup(self):
+        if self.part >= 0:
+            with open(os.path.join(self.directory, 'unspent.%s.%d' % (
+                    self.rows.extension, self.part)), 'wb') as outfile:
+                for key, (upTxID, row) in self.pending.items():
+                    if row:
+                        write_record(outfile, key, row, b'')
+        else:
+            for key, (upTxID, row) in self.pending.items():
+                if row:
+                    self.files['outputs'].write(row + self.rows.unlinked)
+        self.pending.close()
+        for table, header in TABLES:
+            if self.part < 0:
+                self.files[table].write(self.rows.trailer)
+            self.files[table].close()
+        logging.info('Done')
+
+def header_long(block, key):
+    '''
+    number from a 32-bit header field kept as hex by `blockheader`
+    '''
+    return to_long(a2b_hex(block[key]))
+
+def receiving_address(script, hash_to_addr):
+    '''
+    base58 address paid by an output script, or 'X' if not solved
+    '''
+    kind, hash160 = solve_output_script(script)
+    if kind < 0:
+        return 'X'
+    return hash_to_addr(hash160, ADDRESS_PREFIX.get(kind, b'\0'))
+
+def transaction_size(transaction):
+    r'''
+    size in bytes of a transaction as split by `parse_transaction`
+
+    >>> from blockparse import parse_transaction
+    >>> raw = (b'\1\0\0\0' + b'\1' + b'\0' * 36 + b'\2ab' + b'\xff' * 4 +
+    ...        b'\1' + b'\0' * 8 + b'\1c' + b'\0' * 4)
+    >>> transaction_size(parse_transaction(raw)[1]) == len(raw)
+    True
+    '''
+    version, raw_in_count, inputs, raw_out_count, outputs, lock_time = \
+        transaction
+    return (len(version) + len(raw_in_count) + len(raw_out_count) +
+            len(lock_time) +
+            sum(len(field) for txin in inputs for field in txin) +
+            sum(len(field) for txout in outputs for field in txout))
+
+def difficulty(bits):
+    '''
+    difficulty from the compact target in the block header, as in util.cpp
+
+    >>> difficulty(0x1d00ffff)
+    1.0
+    >>> '%f' % difficulty(0x1b0404cb)
+    '16307.420939'
+    '''
+    shift = (bits >> 24) & 0xff
+    result = 0x0000ffff / (bits & 0x00ffffff)
+    while shift < 29:
+        result *= 256.0
+        shift += 1
+    while shift > 29:
+        result /= 256.0
+        shift -= 1
+    return result
+
+def write_record(outfile, key, row, link):
+    '''
+    write a keyed record to a part file for `join_parts`
+    '''
+    outfile.write(RECORD.pack(key, len(row), len(link)) + row + link)
+
+def read_records(filename):
+    '''
+    iterate over the (key, row, link) records of a part file
+    '''
+    with open(filename, 'rb', BUFFER) as infile:
+        while True:
+            header = infile.read(RECORD.size)
+            if not header:
+                break
+            key, rowlength, linklength = RECORD.unpack(header)
+            yield key, infile.read(rowlength), infile.read(linklength)
+
+def pgcopy_rows(data):
+    '''
+    check binary COPY data, returning its rows as lists of field bytes
+
+    NULL fields are None. meant for tests, holding all rows in memory.
+    '''
+    if data[:len(PGCOPY)] != PGCOPY:
+        raise ValueError('Not binary COPY data')
+    offset, rows = len(PGCOPY), []
+    while True:
+        count = struct.unpack('>h', data[offset:offset + 2])[0]
+        offset += 2
+        if count == -1:
+            if offset != len(data):
+                raise ValueError('Data after binary COPY trailer')
+            return rows
+        row = []
+        for field in range(count):
+            length = struct.unpack('>i', data[offset:offset + 4])[0]
+            offset += 4
+            if length < 0:
+                row.append(None)
+            else:
+                row.append(data[offset:offset + length])
+                offset += length
+        rows.append(row)
+
+def dump_part(arguments):
+    '''
+    dump one height shard, in its own process
+    '''
+    blockfiles, args = arguments
+    dumper = CSVDump()
+    dumper.init(args)
+    process([dumper], blockfiles)
+
+def export(options, blockfiles=None):
+    '''
+    dump --firstBlock to --lastBlock in `options.jobs` parallel shards
+    '''
+    first, last = options.firstBlock, options.lastBlock
+    if last < 0 or options.since is not None or options.until is not None:
+        logging.info('finding the blocks to split the dump into shards')
+        times = TimeIndex()
+        # nextchunk appends to the list of blockfiles as it finds new ones
+        for block in nextblock(blockfiles and list(blockfiles), wait=False):
+            times.append(block['time'])
+            if options.until is not None and \
+                    times.mtp[-1] >= options.until:
+                break  # no later block is dated before --until
+        heights = times.blocks_between(
+            options.since or 0, options.until or 1 << 32)
+        first = max(first, heights.start)
+        last = heights.stop - 1 if last < 0 else min(last, heights.stop - 1)
+    shard = max(1, -(-(last - first + 1) // options.jobs))  # rounded up
+    arguments = []
+    for part in range(options.jobs):
+        start = first + part * shard
+        if start > last:
+            break
+        arguments.append((blockfiles, [
+            '-f', str(start), '-l', str(min(start + shard - 1, last)),
+            '-d', options.directory, '-F', options.format,
+            '--part', str(part)]))
+    logging.info('dumping blocks %d to %d in %d shards', first, last,
+                 len(arguments))
+    if arguments:
+        # spawned, not forked, so as not to inherit the chain state above,
+        # and one task per process, so as not to inherit an earlier task's
+        pool = multiprocessing.get_context('spawn').Pool(
+            len(arguments), maxtasksperchild=1)
+        pool.map(dump_part, arguments)
+        pool.close()
+        pool.join()
+    rows = FORMATS[options.format]()
+    for table, header in TABLES:
+        if table == 'spends':  # written by join_parts
+            continue
+        filename = os.path.join(options.directory,
+                                '%s.%s' % (table, rows.extension))
+        with open(filename, 'wb') as outfile:
+            outfile.write(rows.header(table))
+            for part in range(len(arguments)):
+                partname = '%s.%d' % (filename, part)
+                with open(partname, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, BUFFER)
+                os.remove(partname)
+            if table != 'outputs':  # join_parts adds more
+                outfile.write(rows.trailer)
+    join_parts(options.directory, len(arguments), rows)
+
+def join_parts(directory, count, rows):
+    '''
+    link outputs left unspent at the end of one shard with later spends
+
+    appends to the outputs file, and writes the spends file with the links
+    to outputs made before the first shard.
+    '''
+    pending = OutpointMap()
+    prefix = os.path.join(directory, '%s.' + rows.extension)
+    with open(prefix % 'outputs', 'ab', BUFFER) as outputs, \
+            open(prefix % 'spends', 'wb', BUFFER) as spends:
+        spends.write(rows.header('spends'))
+        for part in range(count):
+            records = read_records('%s.%d' % (prefix % 'spends', part))
+            while True:
+                batch = list(itertools.islice(records, RECORDS))
+                if not batch:
+                    break
+                found = pending.pop_many(key for key, row, link in batch)
+                for key, spend, link in batch:
+                    if key in found:
+                        outputs.write(found[key][1] + link)
+                    else:
+                        spends.write(spend)
+            records = read_records('%s.%d' % (prefix % 'unspent', part))
+            while True:
+                batch = list(itertools.islice(records, RECORDS))
+                if not batch:
+                    break
+                pending.update((key, (0, row)) for key, row, link in batch)
+            for name in ('spends', 'unspent'):
+                os.remove('%s.%d' % (prefix % name, part))
+        for key, (zero, row) in pending.items():
+            outputs.write(row + rows.unlinked)
+        outputs.write(rows.trailer)
+        spends.write(rows.trailer)
+    pending.close()
+
+if __name__ == '__main__':
+    GLOBALS, ARGS = option_parser().parse_known_args()
+    OPTIONS = CSVDump().optionParser().parse_args(ARGS)
+    if OPTIONS.jobs > 1:
+        export(OPTIONS, GLOBALS.blockfiles)
+    else:
+        main(command='csvdump')
@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Compare load times of the CSV and binary COPY dumps of the same blocks.
+# Run from an empty directory; arguments are passed to csvdump.py, e.g.
+# loadtime.sh --lastBlock 200000 --jobs 4
+set -e
+python3 -OO ~/blockparser/csvdump.py "$@"
+python3 -OO ~/blockparser/csvdump.py --format binary "$@"
+ls -l *.csv *.bin
+for SCHEMA in prelinked binary; do
+ dropdb --if-exists -h localhost -U blockchain loadtime_$SCHEMA
+ createdb -E UTF-8 -h localhost -U blockchain loadtime_$SCHEMA
+ echo "load with $SCHEMA.schema (COPY, then keys and indexes):"
+ time psql -q -h localhost -U blockchain loadtime_$SCHEMA \
+  -f ~/blockparser/db/$SCHEMA.schema >/dev/null
+done
@@ -2,4 +2,7 @@
 
 dropdb -h localhost -U blockchain blockchain
 createdb -E UTF-8 -h localhost -U blockchain blockchain
-time psql -a -h localhost -U blockchain blockchain <~/blockparser/db/blockchain.schema
+# blockchain.schema, or prelinked.schema for csvdump.py output
+SCHEMA=${1:-blockchain}
+time psql -a -h localhost -U blockchain blockchain \
+ -f ~/blockparser/db/$SCHEMA.schema
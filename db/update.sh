@@ -12,25 +12,32 @@ EOPSQL
 }
 FIRSTBLOCK=`nextblock`
 
-~/blockparser/parser csvdump -f $FIRSTBLOCK
+python3 -OO ~/blockparser/csvdump.py -f $FIRSTBLOCK --jobs 4
 
 time psql -q -a -h localhost -U blockchain blockchain <<EOPSQL
 \copy t_block from 'blocks.csv' WITH (FORMAT CSV, HEADER);
 \copy t_transaction from 'transactions.csv' WITH (FORMAT CSV, HEADER);
 \copy t_output from 'outputs.csv' WITH (FORMAT CSV, HEADER);
 \copy t_input from 'inputs.csv' WITH (FORMAT CSV, HEADER);
+CREATE TEMPORARY TABLE t_spend (
+  f_transactionid    BIGINT NOT NULL
+ ,f_index            INT NOT NULL
+ ,f_inputtxhash      TEXT NOT NULL
+ ,f_inputtxindex     INT NOT NULL
+);
+\copy t_spend from 'spends.csv' WITH (FORMAT CSV, HEADER);
+UPDATE t_output
+SET f_inputtxhash = t_spend.f_inputtxhash
+   ,f_inputtxindex = t_spend.f_inputtxindex
+FROM t_spend
+WHERE t_output.f_transactionid = t_spend.f_transactionid
+  AND t_output.f_index = t_spend.f_index;
 EOPSQL
 
-# Update resultant stats
-function nextstats()
-{
-psql -q -t -h localhost -U blockchain <<-EOPSQL
-SELECT (max(f_date) + interval '1 day')::date FROM t_daily
-EOPSQL
-}
-FIRSTSTATS=`nextstats`
-
-~/blockparser/db/dates.py $FIRSTSTATS | psql -q -t -h localhost -U blockchain
+# Update resultant stats: append the days, weeks and months finished since
+# the last run to rollups/daily.csv, weekly.csv and monthly.csv
+mkdir -p rollups
+python3 -OO ~/blockparser/rollups.py --directory rollups
 
 ~/blockparser/db/dumpstats.sh
 
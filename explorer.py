@@ -0,0 +1,675 @@
+#!/usr/bin/python3 -OO
+'''
+routed WSGI block explorer, for uWSGI (see blockexplorer.ini) or alone
+
+    GET /tip                      height, hash and time of the chain tip
+    GET /block/HEIGHT             block header, from the header table
+    GET /block/HASH
+    GET /block/HEIGHT/txs         txids of a block, with one read of it
+    GET /blocks?from=TIME&to=TIME blocks with a time in a range, of at
+                                  most MAX_BLOCKS heights
+    GET /tx/TXID                  transaction, with one read of its bytes
+    POST /txs                     transactions of TXIDs, and outputs of
+                                  TXID:INDEX outpoints, one per line
+    GET /address/ADDRESS          outputs paid to an address, and spends
+    GET /events?after=SEQ         tip changes after number SEQ, long-polled
+
+all answers are JSON. headers come from the in-memory tables filled by
+`serve` (BLOCKS, BLOCKCHAIN); a transaction is found through the
+txindex.TxIndex that `serve` adds every confirmed block to, and read
+with a single `pread`; address histories come from the index built by
+addressindex.py, memory-mapped. nothing scans the chain, so requests
+are answered in well under a millisecond while the indexing thread goes
+on appending, and that thread only ever adds to what they read. blocks
+by time are found by bisecting a timeindex.TimeIndex of the confirmed
+heights, and only the few heights it returns are looked at.
+
+/txs takes up to MAX_BATCH txids and outpoints, as a posted JSON list
+or separated by white space or commas, or as `id` query parameters, and
+streams back one JSON object per line, in the order asked for. they are
+read with TxIndex.read_many, sorted by blockfile and offset, so a long
+list is read in a sweep through the files instead of a seek per item.
+
+with --shared, and always under uWSGI, there is no indexing thread:
+headers and transactions are read from the files that the one
+chainindex.py process of the host writes, mapped read-only, so the
+workers share one copy of the index and none of them scans the chain.
+the shared index holds confirmed blocks only.
+
+a block or transaction deeper than CONFIRMATIONS never changes, so its
+answer is rendered once, kept in a ResponseCache bounded in bytes, and
+sent with a strong ETag and a year's Cache-Control. answers nearer the
+tip are cached too, but dropped when the tip changes, by a new block or
+a reorg. no answer gives confirmations, which would change with every
+block: they are the height of /tip less that of the block, plus one.
+
+rather than polling /tip, a client can wait on /events for the next
+change of the tip, recorded by `serve`, reorgs included, in a
+tipevents.TipEvents; with --shared, the blocks chainindex.py adds are
+recorded as they appear. each wait holds a thread here, so for many
+subscribers use asyncexplorer.py, which also streams them as
+Server-Sent Events.
+
+    python3 -OO explorer.py [--port 2424] [--blockfile FILE]...
+    python3 -OO chainindex.py & python3 -OO explorer.py --shared
+'''
+from __future__ import division, print_function
+import sys, os, re, json, time, hashlib, logging, threading, argparse
+from collections import OrderedDict
+from binascii import a2b_hex
+from wsgiref.simple_server import make_server, WSGIServer, \
+    WSGIRequestHandler
+try:
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:  # python2
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+import blockparse
+from blockparse import serve, parse_transaction, get_count, get_hash, \
+    show_hash, to_hex, to_long, solve_output_script, PREFIX_LENGTH, \
+    HEADER_LENGTH
+from txindex import TxIndex
+from chainindex import ChainIndex
+from tipevents import TipEvents
+from timeindex import TimeIndex, parse_time
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+INDEX = os.getenv('EXPLORER_INDEX', 'explorer.index')  # TxIndex directory
+SNAPSHOT = os.path.join(INDEX, 'chain.snapshot')  # see snapshot.py
+ADDRESSES = os.getenv('EXPLORER_ADDRESSES', 'index')  # addressindex.py's
+HASH = '[0-9a-fA-F]{64}'
+PORT = 2424
+MAX_BLOCKS = 2016  # heights /blocks looks at, about two weeks' worth
+MAX_BATCH = 65536  # txids and outpoints looked up by one /txs request
+SHARED = []  # set to read the indexes chainindex.py writes
+SOURCES = {}  # the chain and TxIndex, once opened
+POSTINGS = {}  # the addressindex Postings, once opened
+CACHE_BYTES = int(os.getenv('EXPLORER_CACHE', 64 << 20))  # rendered bodies
+IMMUTABLE = 'public, max-age=31536000, immutable'
+LONGPOLL = 30  # seconds an /events request may wait
+POLL = .1  # seconds between looks at a shared index for new blocks
+EVENTS = TipEvents()  # recorded by `serve`, or by `follow` when shared
+
+class Unavailable(Exception):
+    '''
+    raised when an index the request needs is not there yet
+    '''
+
+class MemoryChain(object):
+    '''
+    the header tables that `serve` fills in this process
+
+    the same methods as chainindex.ChainIndex, which the explorer reads
+    instead when another process does the indexing.
+    '''
+    def __len__(self):
+        return len(blockparse.BLOCKS)
+
+    def block(self, height):
+        try:
+            return blockparse.BLOCKS[height] if height >= 0 else None
+        except IndexError:
+            return None
+
+    def find(self, blockhash):
+        block = blockparse.BLOCKCHAIN.get(blockhash)
+        if block is None or 'previous' not in block:  # not the null block
+            return None
+        return main_height(block)
+
+    def confirmed(self, height):
+        return 0 <= height < len(self) - blockparse.CONFIRMATIONS
+
+    def times(self, start, stop):
+        return [block['time'] for block in blockparse.BLOCKS[start:stop]]
+
+def tip(environ):
+    '''
+    the last block of the main chain
+    '''
+    blocks = chain()
+    height = len(blocks) - 1
+    block = blocks.block(height)
+    if block is None:
+        return '503 Service Unavailable', {'error': 'no blocks yet'}
+    return '200 OK', {'height': height, 'hash': block['hash'],
+                      'time': block['time']}
+
+def block_by_height(environ, height):
+    height = int(height)
+    block = chain().block(height)
+    if block is None:
+        return not_found('block %d' % height)
+    return '200 OK', show_block(block, height)
+
+def block_by_hash(environ, blockhash):
+    blocks = chain()
+    height = blocks.find(blockhash.lower())
+    if height is None:
+        return not_found('block %s' % blockhash)
+    return '200 OK', show_block(blocks.block(height), height)
+
+def block_transactions(environ, height):
+    height = int(height)
+    block = chain().block(height)
+    if block is None:
+        return not_found('block %d' % height)
+    data = txindex().pread(
+        block['file'], block['offset'] + PREFIX_LENGTH + HEADER_LENGTH,
+        block['length'] - PREFIX_LENGTH - HEADER_LENGTH)
+    rawcount, count, data = get_count(data)
+    txids = []
+    for index in range(count):
+        raw_transaction, transaction, data = parse_transaction(data)
+        txids.append(show_hash(get_hash(raw_transaction)))
+    return '200 OK', {'height': height, 'hash': block['hash'], 'tx': txids}
+
+def blocks_by_time(environ):
+    '''
+    the blocks with a time from `from` to before `to`, unix times or UTC
+    dates, in height order
+    '''
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    try:
+        start, end = (parse_time(query[key][0]) for key in ('from', 'to'))
+    except (KeyError, ValueError):
+        return '400 Bad Request', {'error': 'from and to times needed'}
+    blocks, index = chain(), times()
+    index.update(blocks)
+    heights = index.blocks_between(start, end)
+    if heights.stop == len(index):  # the unconfirmed blocks may be too
+        heights = range(heights.start, len(blocks))
+    if len(heights) > MAX_BLOCKS:
+        return '400 Bad Request', {
+            'error': 'more than %d blocks in that time' % MAX_BLOCKS}
+    found = []
+    for height in heights:
+        block = blocks.block(height)
+        if block is not None and start <= block['time'] < end:
+            found.append({'height': height, 'hash': block['hash'],
+                          'time': block['time']})
+    return '200 OK', {'from': start, 'to': end, 'blocks': found}
+
+def transaction(environ, txid):
+    found = txindex().read(a2b_hex(txid)[::-1])
+    if found is None:
+        return not_found('transaction %s' % txid)
+    height, raw = found
+    return '200 OK', show_transaction(raw, height)
+
+def address(environ, address):
+    from addresses import to_hash160
+    postings = address_postings()
+    if postings is None:
+        return '503 Service Unavailable', {
+            'error': 'no address index in %s' % ADDRESSES}
+    try:
+        hash160 = to_hash160(address)
+    except (ValueError, TypeError):
+        return '400 Bad Request', {'error': 'bad address %s' % address}
+    except ImportError:  # script.py, for all but hex hash160s
+        return '400 Bad Request', {
+            'error': 'only hex hash160s are supported without'
+                     ' python-bitcoinlib'}
+    found = postings.lookup(hash160)
+    history = []
+    for row in zip(*(found[key].tolist() for key in (
+            'height', 'tx', 'index', 'value', 'spendheight', 'spendtx',
+            'spendindex'))):
+        height, tx, index, value, spendheight, spendtx, spendindex = row
+        history.append({
+            'height': height, 'txid': postings.txid(tx), 'index': index,
+            'value': value, 'spent': None if spendtx < 0 else {
+                'height': spendheight, 'txid': postings.txid(spendtx),
+                'index': spendindex}})
+    return '200 OK', {'hash160': to_hex(hash160),
+                      'indexed': len(postings.block_tx) - 2,
+                      'history': history}
+
+def events(environ):
+    '''
+    the tip changes after number `after`, waiting for one if there are
+    none yet; see tipevents.py
+    '''
+    try:
+        after = int(parse_qs(environ.get('QUERY_STRING', ''))['after'][0])
+    except KeyError:
+        return '200 OK', EVENTS.since(0)
+    except ValueError:
+        return '400 Bad Request', {'error': 'bad event number'}
+    return '200 OK', EVENTS.wait(after, environ.get('explorer.wait',
+                                                    LONGPOLL))
+
+# a response at a height never changes once `settled` blocks after it are
+# confirmed too (a block's header shows the hash of the next); None: never
+ROUTES = tuple((re.compile('^%s$' % pattern), handler, settled)
+               for pattern, handler, settled in (
+                   ('/tip', tip, None),
+                   ('/block/(?P<height>[0-9]+)', block_by_height, 1),
+                   ('/block/(?P<blockhash>%s)' % HASH, block_by_hash, 1),
+                   ('/block/(?P<height>[0-9]+)/txs', block_transactions, 0),
+                   ('/blocks', blocks_by_time, None),
+                   ('/tx/(?P<txid>%s)' % HASH, transaction, 0),
+                   ('/address/(?P<address>[0-9a-zA-Z]+)', address, None),
+                   ('/events', events, None)))
+
+class ResponseCache(object):
+    '''
+    rendered bodies and their ETags by path, the least recently used
+    dropped past `limit` bytes
+
+    an entry is immutable, or was rendered at a tip, and is dropped as
+    soon as the tip is seen to change, whether by a new block or a reorg.
+
+    >>> cache = ResponseCache(limit=12)
+    >>> cache.settle('a')
+    >>> cache.put('/0', b'12345', True)
+    '"8cb2237d0679ca88db6464eac60da96345513964"'
+    >>> etag = cache.put('/9', b'12345', False, 'a')
+    >>> cache.get('/0')[2], cache.get('/9')[2], cache.size
+    (True, False, 10)
+    >>> cache.settle('b'); cache.get('/9'), cache.size
+    (None, 5)
+    >>> etag = cache.put('/1', b'12345678', True)
+    >>> cache.get('/0'), cache.size
+    (None, 8)
+    '''
+    def __init__(self, limit=None):
+        self.limit = CACHE_BYTES if limit is None else limit
+        self.entries = OrderedDict()  # path: (body, etag, immutable)
+        self.mutable = set()  # paths of entries rendered at self.tip
+        self.tip = None
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.entries[path] = entry  # now the most recently used
+            return entry and entry[:2] + (path not in self.mutable,)
+
+    def put(self, path, body, immutable, tip=None):
+        '''
+        cache a body, rendered at `tip` unless immutable; its ETag
+        '''
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        with self.lock:
+            if not immutable and tip != self.tip:
+                return etag  # the tip moved while it was rendered
+            self.discard(path)
+            self.entries[path] = (body, etag)
+            self.size += len(body)
+            if not immutable:
+                self.mutable.add(path)
+            while self.size > self.limit:
+                self.discard(next(iter(self.entries)))
+        return etag
+
+    def settle(self, tip):
+        '''
+        drop the entries rendered at a tip other than `tip`
+        '''
+        with self.lock:
+            if tip != self.tip:
+                for path in list(self.mutable):
+                    self.discard(path)
+                self.tip = tip
+
+    def discard(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+            self.mutable.discard(path)
+
+CACHE = ResponseCache()
+
+def application(environ, start_response):
+    '''
+    the WSGI callable: route the request and send the JSON answer
+
+    confirmed blocks and transactions are answered from CACHE, with a
+    strong ETag and a year's Cache-Control, and with 304 Not Modified to
+    an If-None-Match of that ETag. /txs is answered by `batch`, uncached.
+    '''
+    path = environ.get('PATH_INFO', '') or '/'
+    if path == '/txs':
+        return batch(environ, start_response)
+    cached = CACHE.get(path)
+    if cached is None or not cached[2]:
+        try:
+            tip = chain_tip()
+        except Unavailable:
+            tip = None
+        CACHE.settle(tip)
+        cached = CACHE.get(path)
+    if cached is None:
+        status, data, settled = route(environ)
+        body = json.dumps(data, separators=(',', ':')).encode('utf8')
+        if settled is None:
+            start_response(status, [('Content-Type', 'application/json'),
+                                    ('Content-Length', str(len(body)))])
+            return [] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
+        immutable = chain().confirmed(data['height'] + settled)
+        cached = (body, CACHE.put(path, body, immutable, tip), immutable)
+    body, etag, immutable = cached
+    headers = [('ETag', etag),
+               ('Cache-Control', IMMUTABLE if immutable else 'no-cache')]
+    if not_modified(environ, etag):
+        start_response('304 Not Modified', headers)
+        return []
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(body)))] + headers)
+    return [] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
+
+def batch(environ, start_response):
+    '''
+    the WSGI answer to /txs: `lookup` of the items asked for, streamed
+    as JSON lines
+    '''
+    method = environ['REQUEST_METHOD']
+    if method not in ('GET', 'HEAD', 'POST'):
+        return answer(start_response, '405 Method Not Allowed',
+                      {'error': 'only GET and POST are supported'})
+    items = parse_qs(environ.get('QUERY_STRING', '')).get('id', [])
+    if method == 'POST':
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length).decode('utf8', 'replace')
+        try:
+            items.extend(json.loads(body) if body.lstrip().startswith('[')
+                         else re.split(r'[\s,]+', body.strip()))
+        except ValueError:
+            return answer(start_response, '400 Bad Request',
+                          {'error': 'bad JSON list'})
+    items = [item for item in items if item]
+    if len(items) > MAX_BATCH:
+        return answer(start_response, '413 Payload Too Large',
+                      {'error': 'more than %d items' % MAX_BATCH})
+    try:
+        found = lookup(items, txindex())
+    except Unavailable as missing:
+        return answer(start_response, '503 Service Unavailable',
+                      {'error': str(missing)})
+    start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+    if method == 'HEAD':
+        return []
+    return ((json.dumps(result, separators=(',', ':')) + '\n').encode('utf8')
+            for result in found)
+
+def lookup(items, transactions):
+    '''
+    JSON-ready transaction of each txid, and output of each TXID:INDEX
+    outpoint, of `items`, in order, read from the TxIndex `transactions`
+    with `read_many`
+    '''
+    items, wanted = list(items), []
+    for item in items:
+        txid, colon, index = str(item).partition(':')
+        if not re.match('^%s$' % HASH, txid) or colon and not index.isdigit():
+            wanted.append(None)
+        else:
+            wanted.append((a2b_hex(txid)[::-1], int(index) if colon else None))
+    found = transactions.read_many(want[0] for want in wanted if want)
+    for item, want in zip(items, wanted):
+        if want is None:
+            yield {'item': item, 'error': 'bad txid or outpoint'}
+            continue
+        result = next(found)
+        if result is None:
+            yield {'item': item, 'error': 'not found'}
+            continue
+        height, raw = result
+        shown = show_transaction(raw, height)
+        if want[1] is None:
+            yield shown
+        elif want[1] < len(shown['outputs']):
+            yield dict(shown['outputs'][want[1]], txid=shown['txid'],
+                       index=want[1], height=height)
+        else:
+            yield {'item': item, 'error': 'no output %d' % want[1]}
+
+def answer(start_response, status, data):
+    '''
+    send `data` as JSON, uncached
+    '''
+    body = json.dumps(data, separators=(',', ':')).encode('utf8')
+    start_response(status, [('Content-Type', 'application/json'),
+                            ('Content-Length', str(len(body)))])
+    return [body]
+
+def not_modified(environ, etag):
+    '''
+    whether the If-None-Match header of the request names `etag`
+
+    >>> not_modified({'HTTP_IF_NONE_MATCH': 'W/"ab", "cd"'}, '"cd"')
+    True
+    >>> not_modified({}, '"cd"')
+    False
+    >>> not_modified({'HTTP_IF_NONE_MATCH': '*'}, '"cd"')
+    True
+    '''
+    tags = [tag.strip() for tag in
+            environ.get('HTTP_IF_NONE_MATCH', '').split(',')]
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag
+                                   for tag in tags)
+
+def route(environ):
+    '''
+    status and data of the handler matching the request path, and
+    the `settled` of its route if its answer may be cached, else None
+
+    >>> route({'REQUEST_METHOD': 'POST', 'PATH_INFO': '/tip'})[0]
+    '405 Method Not Allowed'
+    >>> route({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/block/0'})
+    ('404 Not Found', {'error': 'block 0 not found'}, None)
+    '''
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return ('405 Method Not Allowed',
+                {'error': 'only GET is supported'}, None)
+    path = environ.get('PATH_INFO', '') or '/'
+    for pattern, handler, settled in ROUTES:
+        match = pattern.match(path)
+        if match:
+            try:
+                status, data = handler(environ, **match.groupdict())
+            except Unavailable as missing:
+                return ('503 Service Unavailable', {'error': str(missing)},
+                        None)
+            return status, data, settled if status == '200 OK' else None
+    return not_found(path) + (None,)
+
+def not_found(what):
+    return '404 Not Found', {'error': '%s not found' % what}
+
+def main_height(block):
+    '''
+    height of a block of BLOCKCHAIN in the main chain, or None
+
+    confirmed blocks have their height set by `nextblock`; the few at the
+    tip are looked for at the end of BLOCKS.
+    '''
+    blocks = blockparse.BLOCKS
+    height = block.get('height')
+    if height is None:
+        for height in range(len(blocks) - 1,
+                            max(len(blocks) - blockparse.CONFIRMATIONS - 2,
+                                -1), -1):
+            if blocks[height]['hash'] == block['hash']:
+                return height
+        return None
+    try:
+        return height if blocks[height] is block else None
+    except IndexError:
+        return None
+
+def show_block(block, height):
+    '''
+    JSON-ready header of a main chain block dict
+    '''
+    blocks = chain()
+    following = blocks.block(height + 1)
+    return {
+        'height': height,
+        'hash': block['hash'],
+        'previous': block['previous'],
+        'next': following and following['hash'],
+        'merkle_root': block['merkle_root'],
+        'time': block['time'],
+        'version': to_long(a2b_hex(block['version'])),
+        'nbits': to_long(a2b_hex(block['nbits'])),
+        'nonce': to_long(a2b_hex(block['nonce'])),
+        'size': block['length'] - PREFIX_LENGTH,
+    }
+
+def show_transaction(raw, height):
+    '''
+    JSON-ready contents of a raw transaction
+    '''
+    raw_transaction, transaction, rest = parse_transaction(raw)
+    outputs = []
+    for txout in transaction[4]:
+        kind, hash160 = solve_output_script(txout[2])
+        outputs.append({'value': to_long(txout[0]),
+                        'script': to_hex(txout[2]), 'type': kind,
+                        'hash160': hash160 and to_hex(hash160)})
+    return {
+        'txid': show_hash(get_hash(raw)),
+        'height': height,
+        'size': len(raw),
+        'version': to_long(transaction[0]),
+        'locktime': to_long(transaction[5]),
+        'inputs': [{'txid': show_hash(txin[0]), 'index': to_long(txin[1]),
+                    'script': to_hex(txin[3]), 'sequence': to_long(txin[4])}
+                   for txin in transaction[2]],
+        'outputs': outputs,
+    }
+
+def chain_tip():
+    '''
+    hash of the last block of the chain, which changes on a new block or
+    a reorg
+    '''
+    blocks = chain()
+    block = blocks.block(len(blocks) - 1)
+    return block and block['hash']
+
+def chain():
+    '''
+    the header table: a read-only ChainIndex with --shared, or under
+    uWSGI, else the MemoryChain of this process's `serve` thread
+    '''
+    if 'chain' not in SOURCES:
+        if SHARED:
+            try:
+                SOURCES['chain'] = ChainIndex(INDEX, readonly=True)
+            except (IOError, OSError):
+                raise Unavailable('no chain index in %s yet' % INDEX)
+        else:
+            SOURCES['chain'] = MemoryChain()
+    return SOURCES['chain']
+
+def times():
+    '''
+    the TimeIndex of the chain's confirmed heights, brought up to date
+    by whoever uses it
+    '''
+    return SOURCES.setdefault('times', TimeIndex())
+
+def txindex():
+    '''
+    the TxIndex, opened on first use, read-only unless this process's
+    `serve` thread adds to it
+    '''
+    if 'txindex' not in SOURCES:
+        try:
+            SOURCES['txindex'] = TxIndex(INDEX, readonly=bool(SHARED))
+        except (IOError, OSError):
+            raise Unavailable('no transaction index in %s yet' % INDEX)
+    return SOURCES['txindex']
+
+def address_postings():
+    '''
+    the address index, if addressindex.py has built one
+    '''
+    if not POSTINGS and os.path.exists(os.path.join(ADDRESSES,
+                                                    'postings.offsets')):
+        from addressindex import Postings
+        POSTINGS['postings'] = Postings(ADDRESSES)
+    return POSTINGS.get('postings')
+
+def start_server(blockfiles, wait=True):
+    '''
+    run `serve`, adding to the TxIndex and EVENTS, in a daemon thread,
+    going on from the snapshot in INDEX, if any
+    '''
+    server = threading.Thread(target=serve, name='server',
+                              args=(blockfiles, 0, sys.maxsize, wait),
+                              kwargs={'txindex': txindex(),
+                                      'events': EVENTS,
+                                      'snapshot': SNAPSHOT})
+    server.daemon = True
+    server.start()
+    return server
+
+def follow(interval=POLL):
+    '''
+    record to EVENTS, as confirmed, each block chainindex.py adds to the
+    shared index, looking every `interval` seconds
+    '''
+    height = None
+    while True:
+        try:
+            blocks = chain()
+        except Unavailable:
+            time.sleep(interval)
+            continue
+        if height is None:
+            height = len(blocks)  # only blocks added from now on
+        while height < len(blocks):
+            EVENTS.confirmed(blocks.block(height))
+            height += 1
+        time.sleep(interval)
+
+def start_follower():
+    '''
+    run `follow` in a daemon thread
+    '''
+    follower = threading.Thread(target=follow, name='follower')
+    follower.daemon = True
+    follower.start()
+    return follower
+
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+    '''
+    wsgiref server answering each request in its own thread
+    '''
+    daemon_threads = True
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(prog=COMMAND, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--blockfile', action='append', dest='blockfiles')
+    PARSER.add_argument('--port', type=int, default=PORT)
+    PARSER.add_argument('--shared', action='store_true',
+                        help='read the index of a running chainindex.py')
+    OPTIONS = PARSER.parse_args()
+    if OPTIONS.shared:
+        SHARED.append(True)
+        start_follower()
+    else:
+        start_server(OPTIONS.blockfiles)
+    logging.info('explorer listening on port %d', OPTIONS.port)
+    make_server('', OPTIONS.port, application, ThreadingServer,
+                QuietHandler).serve_forever()
+elif sys.argv and sys.argv[0] == 'uwsgi':
+    # the attach-daemon of blockexplorer.ini runs chainindex.py
+    SHARED.append(True)
+    start_follower()
@@ -0,0 +1,353 @@
+#!/usr/bin/python3 -OO
+'''
+the db/blockchain.schema tables in a local SQLite file, for db/queries.sql
+
+a csvdump.py pass that inserts its rows into t_block, t_transaction,
+t_output and t_input of an SQLite database instead of writing files to
+COPY into PostgreSQL: same columns, hashes and scripts as hex text,
+times as 'YYYY-MM-DD HH:MM:SS' text. the file is in WAL mode, rows go in
+with `executemany` in batches, in one large transaction per checkpoint,
+and all indexes but the primary keys are only created at the end.
+
+every --checkpoint blocks, outputs still held back for their link are
+written with NULL f_inputtxhash, to be updated by primary key when spent,
+and the height reached is committed to t_checkpoint together with the
+rows, so an interrupted or later run carries on from the next height. as
+with csvdump.py, the pass itself still starts from the genesis block.
+
+    python3 -OO localdb.py --database chain.sqlite
+    python3 -OO localdb.py --database chain.sqlite --query db/queries.sql
+'''
+from __future__ import division, print_function
+import sys, os, re, logging, sqlite3, time
+from binascii import b2a_hex
+from functools import lru_cache
+from blockparse import show_hash, to_long
+from outpoints import OutpointMap
+from csvdump import CSVDump, CSVFormat, ADDRESS_CACHE, receiving_address
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+BATCH = 10000  # rows per executemany
+CHECKPOINT = 1000  # blocks per transaction
+CACHE = 1 << 18  # SQLite page cache, in KiB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS t_block (
+  f_id               INTEGER PRIMARY KEY
+ ,f_hash             TEXT NOT NULL
+ ,f_version          INTEGER NOT NULL
+ ,f_timestamp        TEXT NOT NULL
+ ,f_nonce            INTEGER NOT NULL
+ ,f_difficulty       REAL
+ ,f_merkle           TEXT NOT NULL
+ ,f_numtransactions  INTEGER NOT NULL
+ ,f_outputvalue      INTEGER NOT NULL
+ ,f_feesvalue        INTEGER NOT NULL
+ ,f_size             INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS t_transaction (
+  f_id               INTEGER PRIMARY KEY
+ ,f_hash             TEXT NOT NULL
+ ,f_version          INTEGER NOT NULL
+ ,f_blockid          INTEGER NOT NULL
+ ,f_numinputs        INTEGER NOT NULL
+ ,f_numoutputs       INTEGER NOT NULL
+ ,f_outputvalue      INTEGER NOT NULL
+ ,f_feesvalue        INTEGER NOT NULL
+ ,f_locktime         INTEGER NOT NULL
+ ,f_size             INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS t_output (
+  f_transactionid    INTEGER NOT NULL
+ ,f_index            INTEGER NOT NULL
+ ,f_value            INTEGER NOT NULL
+ ,f_script           TEXT NOT NULL
+ ,f_receivingaddress TEXT NOT NULL
+ ,f_inputtxhash      TEXT
+ ,f_inputtxindex     INTEGER
+ ,PRIMARY KEY (f_transactionid, f_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS t_input (
+  f_transactionid    INTEGER NOT NULL
+ ,f_index            INTEGER NOT NULL
+ ,f_script           TEXT NOT NULL
+ ,f_outputtxhash     TEXT NOT NULL
+ ,f_outputtxindex    INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS t_checkpoint (
+  f_height           INTEGER PRIMARY KEY
+ ,f_hash             TEXT NOT NULL
+ ,f_transactions     INTEGER NOT NULL
+ ,f_time             TEXT NOT NULL
+);
+'''
+
+# those of db/blockchain.schema, created once the bulk of rows is in
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS t_block_id_timestamp_idx
+ ON t_block(f_id, f_timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS t_transaction_hash_idx
+ ON t_transaction(f_hash);
+CREATE INDEX IF NOT EXISTS t_transaction_blockid_idx
+ ON t_transaction(f_blockid);
+CREATE INDEX IF NOT EXISTS t_input_output_idx
+ ON t_input(f_outputtxhash, f_outputtxindex);
+CREATE INDEX IF NOT EXISTS t_input_transactionid_idx
+ ON t_input(f_transactionid);
+CREATE INDEX IF NOT EXISTS t_output_input_null_idx
+ ON t_output(f_inputtxhash) WHERE f_inputtxhash IS NULL;
+CREATE INDEX IF NOT EXISTS t_output_input_notnull_idx
+ ON t_output(f_inputtxhash) WHERE f_inputtxhash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS t_output_receivingaddress_idx
+ ON t_output(f_receivingaddress);
+'''
+
+INSERTS = {
+    'blocks': 'INSERT INTO t_block VALUES (%s)' % ','.join('?' * 11),
+    'transactions': 'INSERT INTO t_transaction VALUES (%s)' %
+                    ','.join('?' * 10),
+    'outputs': 'INSERT INTO t_output VALUES (%s)' % ','.join('?' * 7),
+    'inputs': 'INSERT INTO t_input VALUES (%s)' % ','.join('?' * 5),
+    'spends': 'UPDATE t_output SET f_inputtxhash = ?3, f_inputtxindex = ?4'
+              ' WHERE f_transactionid = ?1 AND f_index = ?2',
+}
+
+class SQLiteFormat(CSVFormat):
+    r'''
+    rows as parameter tuples for the statements in INSERTS
+
+    >>> rows = SQLiteFormat()
+    >>> rows.output(3, 0, 50, b'\x51', 'X') + rows.link(b'\xab' * 32, 1)[1:]
+    (3, 0, 50, '51', 'X', 1)
+    '''
+    trailer = ()
+    unlinked = (None, None)
+
+    def block(self, height, blockhash, version, blocktime, nonce,
+              difficulty, merkle, count, output, fees, size):
+        return (height, show_hash(blockhash), version,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(blocktime)),
+                nonce, difficulty, show_hash(merkle), count, output, fees,
+                size)
+
+    def transaction(self, txID, txhash, version, height, inputs, outputs,
+                    value, fees, locktime, size):
+        return (txID, show_hash(txhash), version, height, inputs, outputs,
+                value, fees, locktime, size)
+
+    def output(self, txID, index, value, script, address):
+        return (txID, index, value, b2a_hex(script).decode(), address)
+
+    def link(self, txhash, index):
+        return (show_hash(txhash), index)
+
+    def input(self, txID, index, script, txhash, outputindex):
+        return (txID, index, b2a_hex(script).decode(), show_hash(txhash),
+                outputindex)
+
+    def spend(self, txID, index, link):
+        return (txID, index) + link
+
+class Table(object):
+    '''
+    rows for one statement of INSERTS, run with `executemany` in batches
+    '''
+    def __init__(self, database, statement):
+        self.database, self.statement = database, statement
+        self.rows = []
+
+    def write(self, row):
+        if row:  # skip empty rows, such as the format's trailer
+            self.rows.append(row)
+            if len(self.rows) >= BATCH:
+                self.flush()
+
+    def flush(self):
+        self.database.executemany(self.statement, self.rows)
+        del self.rows[:]
+
+class LocalDB(CSVDump):
+    '''
+    load the blockchain into the tables of an SQLite database
+
+    >>> import tempfile, shutil
+    >>> from blockparse import blockheader
+    >>> directory = tempfile.mkdtemp()
+    >>> filename = os.path.join(directory, 'test.sqlite')
+    >>> loader = LocalDB()
+    >>> loader.init(['--database', filename])
+    0
+    >>> block = blockheader(bytes(72) + bytes([255, 255, 0, 29]) + bytes(4))
+    >>> block.update({'height': 0, 'length': 88})
+    >>> loader.startBlock(block); loader.endBlock(block); loader.wrapup()
+    >>> connect(filename).execute('SELECT f_id FROM t_block').fetchall()
+    [(0,)]
+    >>> shutil.rmtree(directory)
+    '''
+    name = 'localdb'
+    aliases = ('sqlite',)
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-D', '--database', default='blockchain.sqlite',
+                            help='SQLite file to load (default: %(default)s)')
+        parser.add_argument('-l', '--lastBlock', type=int, default=-1,
+                            help='last block to load (default: last block)')
+        parser.add_argument('-c', '--checkpoint', type=int,
+                            default=CHECKPOINT, help='blocks per commit'
+                            ' (default: %(default)s)')
+        parser.add_argument('-q', '--query',
+                            help='with `python3 localdb.py`, run the'
+                            ' statements in this file instead of loading')
+        return parser
+
+    def init(self, args):
+        # base58 needs script.py, and through it python-bitcoinlib
+        from script import hash_to_addr
+        options = self.optionParser().parse_args(args)
+        self.lastBlock = options.lastBlock
+        self.time_range()
+        self.interval = options.checkpoint
+        self.database = connect(options.database)
+        self.database.executescript(SCHEMA)
+        self.resume = self.database.execute(
+            'SELECT f_height, f_hash, f_transactions FROM t_checkpoint'
+            ' ORDER BY f_height DESC LIMIT 1').fetchone()
+        self.firstBlock = self.resume[0] + 1 if self.resume else 0
+        logging.info('loading %s from block %d', options.database,
+                     self.firstBlock)
+        self.rows = SQLiteFormat()
+        self.files = dict((table, Table(self.database, statement))
+                          for table, statement in INSERTS.items())
+        # every output, to its transaction ID, until spent; the output
+        # rows not yet written are held in `held` until the checkpoint
+        self.pending = OutpointMap()
+        self.held = {}
+        self.created, self.spent = [], []
+        self.address = lru_cache(ADDRESS_CACHE)(
+            lambda script: receiving_address(script, hash_to_addr))
+        self.txID = 0
+        self.active = False
+        self.loaded = 0  # blocks since the last checkpoint
+        self.database.execute('BEGIN')
+        return 0
+
+    def startBlock(self, block):
+        CSVDump.startBlock(self, block)
+        self.lastLoaded = block
+
+    def endBlock(self, block):
+        CSVDump.endBlock(self, block)
+        if self.resume and block['height'] == self.resume[0] and \
+                (block['hash'], self.txID) != self.resume[1:]:
+            raise ValueError('block %d differs from the one in the database,'
+                             ' rebuild it' % block['height'])
+        if self.active:
+            self.loaded += 1
+            if self.loaded >= self.interval or self.done:
+                self.checkpoint(block)
+
+    def link(self):
+        '''
+        join the outputs spent in this block with their spending inputs
+
+        an output spent since the last checkpoint is written with its
+        link; one written unlinked at a checkpoint gets it by UPDATE.
+        '''
+        for key, (txID, row) in self.created:
+            if row:
+                self.held[key] = row
+        self.pending.update((key, (txID, b''))
+                            for key, (txID, row) in self.created)
+        found = self.pending.pop_many([key for key, txhash, index
+                                       in self.spent])
+        if self.active:
+            for key, txhash, index in self.spent:
+                link = self.rows.link(txhash, index)
+                row = self.held.pop(key, None)
+                if row:
+                    self.files['outputs'].write(row + link)
+                else:
+                    self.files['spends'].write(self.rows.spend(
+                        found[key][0], to_long(key[32:]), link))
+        del self.created[:], self.spent[:]
+
+    def checkpoint(self, block):
+        '''
+        write held outputs unlinked, and commit all up to `block`
+        '''
+        for row in self.held.values():
+            self.files['outputs'].write(row + self.rows.unlinked)
+        self.held.clear()
+        for table in self.files.values():
+            table.flush()
+        self.database.execute(
+            'INSERT INTO t_checkpoint VALUES (?, ?, ?, ?)',
+            (block['height'], block['hash'], self.txID,
+             time.strftime('%Y-%m-%d %H:%M:%S')))
+        self.database.execute('COMMIT')
+        logging.info('committed blocks up to %d', block['height'])
+        self.loaded = 0
+        self.database.execute('BEGIN')
+
+    def wrapup(self):
+        if self.loaded:
+            self.checkpoint(self.lastLoaded)
+        self.database.execute('COMMIT')
+        self.pending.close()
+        logging.info('creating indexes')
+        self.database.executescript(INDEXES)
+        self.database.execute('PRAGMA optimize')
+        self.database.close()
+        logging.info('Done')
+
+def connect(filename):
+    '''
+    open the database for bulk loading, with transactions left to us
+    '''
+    database = sqlite3.connect(filename, isolation_level=None)
+    database.execute('PRAGMA journal_mode=WAL')
+    database.execute('PRAGMA synchronous=NORMAL')
+    database.execute('PRAGMA cache_size=-%d' % CACHE)
+    database.execute('PRAGMA temp_store=MEMORY')
+    return database
+
+def sqlite_query(statement):
+    '''
+    rewrite PostgreSQL-only syntax of db/queries.sql for SQLite
+
+    >>> sqlite_query('SELECT f_bucket, AVG(f_size)::BIGINT FROM d')
+    'SELECT f_bucket, CAST(ROUND(AVG(f_size)) AS INTEGER) FROM d'
+    '''
+    return re.sub(r'(\w+\([^()]*\))::BIGINT', r'CAST(ROUND(\1) AS INTEGER)',
+                  statement)
+
+def run_queries(database, filename):
+    '''
+    run each statement in `filename`, printing it, its rows and its time
+    '''
+    database = connect(database)
+    with open(filename) as infile:
+        statement = ''
+        for line in infile:
+            statement += line
+            if not sqlite3.complete_statement(statement):
+                continue
+            print(statement.strip())
+            start = time.time()
+            for row in database.execute(sqlite_query(statement)):
+                print(' | '.join(map(str, row)))
+            print('-- %.3f secs\n' % (time.time() - start))
+            statement = ''
+    database.close()
+
+if __name__ == '__main__':
+    OPTIONS = LocalDB().optionParser().parse_known_args()[0]
+    if OPTIONS.query:
+        run_queries(OPTIONS.database, OPTIONS.query)
+    else:
+        main(command='localdb')
@@ -0,0 +1,113 @@
+#!/usr/bin/python3 -OO
+'''
+growable arrays of fixed-size integers in memory-mapped files
+
+used where per-address or per-transaction state is too big to keep in
+process memory, or must be shared with other processes: the OS pages
+the file in and out, and a second process can map the same file.
+'''
+from __future__ import division, print_function
+import sys, os, logging, mmap, struct
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+class MappedArray(object):
+    '''
+    array of `typecode` items (as for `array` and `struct`) in a file
+
+    the file keeps whole-page spare capacity while open and is truncated
+    to its logical length by `close`.
+
+    >>> import tempfile
+    >>> filename = tempfile.mktemp()
+    >>> numbers = MappedArray(filename, 'q')
+    >>> numbers.resize(3)
+    >>> numbers[2] = -5
+    >>> numbers.append(7)
+    >>> len(numbers), list(numbers[0:4])
+    (4, [0, 0, -5, 7])
+    >>> numbers.close()
+    >>> os.path.getsize(filename)
+    32
+    >>> MappedArray(filename, 'q', readonly=True)[3]
+    7
+    >>> os.remove(filename)
+    '''
+    def __init__(self, filename, typecode, readonly=False):
+        self.filename = filename
+        self.typecode = typecode
+        self.itemsize = struct.calcsize(typecode)
+        self.readonly = readonly
+        mode = 'rb' if readonly else 'a+b'
+        self.file = open(filename, mode)
+        self.length = os.path.getsize(filename) // self.itemsize
+        self.map = self.view = None
+        self.remap(self.length)
+
+    def remap(self, capacity):
+        '''
+        (re)map the file with room for at least `capacity` items
+        '''
+        if self.view is not None:
+            self.view.release()
+            self.map.close()
+        size = max(capacity * self.itemsize, mmap.PAGESIZE)
+        size += -size % mmap.PAGESIZE
+        if self.readonly:
+            size = os.path.getsize(self.filename)
+            if not size:
+                self.map = self.view = None
+                return
+            self.map = mmap.mmap(self.file.fileno(), size,
+                                 access=mmap.ACCESS_READ)
+        else:
+            if os.path.getsize(self.filename) < size:
+                self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        self.view = memoryview(self.map).cast(self.typecode)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def __setitem__(self, index, value):
+        self.view[index] = value
+
+    def resize(self, length):
+        '''
+        set logical length, growing the file by doubling if needed;
+        new items are zero
+        '''
+        if length > len(self.view):
+            self.remap(max(length, 2 * len(self.view)))
+        self.length = length
+
+    def append(self, value):
+        '''
+        add one item at the end
+        '''
+        self.resize(self.length + 1)
+        self.view[self.length - 1] = value
+
+    def flush(self):
+        '''
+        write dirty pages back to the file
+        '''
+        if self.map is not None and not self.readonly:
+            self.map.flush()
+
+    def close(self):
+        '''
+        unmap, and truncate the file to the logical length
+        '''
+        if self.view is not None:
+            self.view.release()
+            self.map.close()
+            self.view = self.map = None
+        if not self.readonly:
+            self.file.truncate(self.length * self.itemsize)
+        self.file.close()
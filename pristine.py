@@ -0,0 +1,153 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/pristine.cpp: blocks whose coinbase never moved
+
+a block is pristine while no input has spent any output of its coinbase
+transaction. the C++ version keeps every coinbase ever seen in a hash map;
+here a bitset indexed by height, one bit per block, says which blocks are
+still pristine, and only the coinbases still pristine stay in a map of
+txid to height, time and amount. since nearly all coinbases are spent
+sooner or later, that map stays small, and no general map of unspent
+outputs is needed: inputs are only looked up in it by their txid.
+
+    python3 -OO pristine.py
+    python3 -OO pristine.py --at 50000 --at 100000
+'''
+from __future__ import division, print_function
+import sys, os, logging
+import numpy
+from blockparse import show_hash
+from outpoints import COINBASE
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+class Bitset(object):
+    '''
+    growable set of heights, one bit each
+
+    >>> bits = Bitset()
+    >>> for height in (0, 3, 9): bits.add(height)
+    >>> bits.discard(3); 9 in bits, 3 in bits, 100 in bits
+    (True, False, False)
+    >>> bits.heights(), len(bits)
+    ([0, 9], 2)
+    '''
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, height):
+        if height >> 3 >= len(self.bits):
+            self.bits.extend(bytearray((height >> 3) + 1 - len(self.bits)))
+        self.bits[height >> 3] |= 1 << (height & 7)
+
+    def discard(self, height):
+        if height >> 3 < len(self.bits):
+            self.bits[height >> 3] &= ~(1 << (height & 7)) & 0xff
+
+    def __contains__(self, height):
+        return height >> 3 < len(self.bits) and \
+            bool(self.bits[height >> 3] & (1 << (height & 7)))
+
+    def heights(self, limit=None):
+        '''
+        heights in the set, in order, up to `limit` if given
+        '''
+        heights = numpy.flatnonzero(numpy.unpackbits(
+            numpy.frombuffer(bytes(self.bits), dtype=numpy.uint8),
+            bitorder='little'))
+        if limit is not None:
+            heights = heights[heights <= limit]
+        return heights.tolist()
+
+    def __len__(self):
+        return len(self.heights())
+
+class Pristine(Callback):
+    '''
+    find all pristine blocks in the blockchain
+    '''
+    name = 'pristine'
+    needTXHash = True
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-a', '--at', type=int, action='append',
+                            default=[],
+                            help='also report the pristine blocks as of'
+                            ' this height; may be repeated')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.reports = set(options.at)
+        self.pristine = Bitset()
+        # coinbases of pristine blocks, to their height, time and amount
+        self.coinbases = {}
+        logging.info('Finding all pristine blocks in blockchain')
+        return 0
+
+    def startBlock(self, block):
+        self.currBlock = block['height']
+        self.currTime = block['time']
+
+    def startTX(self, transaction, txhash):
+        self.currTXHash = txhash
+        self.hasGenInput = transaction[2][0][0] == COINBASE
+        self.amount = 0
+
+    def startInput(self, txin):
+        found = self.coinbases.pop(txin[0], None)
+        if found is not None:
+            self.pristine.discard(found[0])
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        if self.hasGenInput:
+            self.amount += value
+
+    def endTX(self, transaction):
+        if self.hasGenInput:
+            # a duplicate coinbase txid, as at heights 91842 and 91880,
+            # makes the outputs of the earlier one unspendable
+            found = self.coinbases.get(self.currTXHash)
+            if found is not None:
+                self.pristine.discard(found[0])
+            self.coinbases[self.currTXHash] = (self.currBlock, self.currTime,
+                                               self.amount)
+            self.pristine.add(self.currBlock)
+
+    def endBlock(self, block):
+        if self.currBlock in self.reports:
+            self.report()
+            self.reports.discard(self.currBlock)
+
+    def report(self):
+        '''
+        print the blocks pristine so far, in height order
+        '''
+        byheight = dict((height, (txhash, blocktime, amount))
+                        for txhash, (height, blocktime, amount)
+                        in self.coinbases.items())
+        heights = self.pristine.heights()
+        logging.info('Found %d pristine blocks as of height %d',
+                     len(heights), self.currBlock)
+        print('Block #  Time       TX hash' + ' ' * 58 + 'Amount')
+        print('=' * 107)
+        total = 0
+        for height in heights:
+            txhash, blocktime, amount = byheight[height]
+            total += amount
+            print(' %7d %10d %s %16.8f' % (height, blocktime,
+                                           show_hash(txhash), amount * 1e-8))
+        logging.info('unspent coinbase amount = %.8f', total * 1e-8)
+
+    def wrapup(self):
+        if self.reports:
+            logging.warning('chain ended before height(s) %s',
+                            sorted(self.reports))
+        self.report()
+
+if __name__ == '__main__':
+    main(command='pristine')
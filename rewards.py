@@ -0,0 +1,122 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/rewards.cpp: block subsidy, fees and coinbase totals
+
+the C++ version only sees the coinbase outputs, and counts as fees
+whatever they claim above the subsidy. here the value of every input
+comes with its `edge` event, through the streaming OutpointMap of
+callback.py, so the fees are those actually paid, the inputs less the
+outputs of each transaction, and a coinbase claiming less than the
+subsidy and fees shows as unclaimed. memory is that of the OutpointMap,
+bounded whatever the length of the chain.
+
+    python3 -OO rewards.py
+    python3 -OO rewards.py --csv rewards.csv
+'''
+from __future__ import division, print_function
+import sys, os, csv, logging
+from blockparse import solve_output_script, show_hash, to_hex
+from outpoints import COINBASE
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+COIN = 100000000
+HALVING = 210000  # blocks between halvings of the subsidy
+HEADER = ('height', 'time', 'subsidy', 'fees', 'reward', 'unclaimed',
+          'total_subsidy', 'total_fees', 'total_reward')
+
+class Rewards(Callback):
+    '''
+    dump all block rewards
+    '''
+    name = 'rewards'
+    needTXHash = True
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-f', '--full', action='store_true',
+                            help='dump fee transaction details')
+        parser.add_argument('-c', '--csv',
+                            help='write a CSV row per block, with running'
+                            ' totals, to this file instead of the summaries')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.fullDump = options.full
+        self.outfile = open(options.csv, 'w') if options.csv else None
+        if self.outfile:
+            self.writer = csv.writer(self.outfile)
+            self.writer.writerow(HEADER)
+        self.totals = [0, 0, 0]  # subsidy, fees and reward
+        logging.info('Dumping all block rewards in blockchain')
+        return 0
+
+    def startBlock(self, block):
+        self.currBlock = block['height']
+        self.reward = self.fees = 0
+
+    def startTX(self, transaction, txhash):
+        self.currTXHash = txhash
+        self.hasGenInput = transaction[2][0][0] == COINBASE
+        self.txInput = self.txOutput = 0
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        self.txInput += value
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        self.txOutput += value
+        if not self.hasGenInput:
+            return
+        self.reward += value
+        if self.fullDump:
+            kind, hash160 = solve_output_script(outputscript)
+            print('%7d %s %16.8f %s %2d' % (
+                self.currBlock, show_hash(self.currTXHash), value * 1e-8,
+                '#' * 40 if hash160 is None else to_hex(hash160), kind))
+
+    def endTX(self, transaction):
+        if not self.hasGenInput:
+            self.fees += self.txInput - self.txOutput
+
+    def endBlock(self, block):
+        baseReward = subsidy(self.currBlock)
+        for index, value in enumerate((baseReward, self.fees, self.reward)):
+            self.totals[index] += value
+        if self.outfile:
+            self.writer.writerow([
+                self.currBlock, block['time'], baseReward, self.fees,
+                self.reward, baseReward + self.fees - self.reward] +
+                self.totals)
+        else:
+            print('Summary for block %7d : baseReward=%16.8f fees=%16.8f'
+                  ' total=%16.8f' % (self.currBlock, 1e-8 * baseReward,
+                                     1e-8 * self.fees, 1e-8 * self.reward))
+
+    def wrapup(self):
+        if self.outfile:
+            self.outfile.close()
+        logging.info('subsidy = %17.08f', self.totals[0] * 1e-8)
+        logging.info('fees    = %17.08f', self.totals[1] * 1e-8)
+        logging.info('rewards = %17.08f', self.totals[2] * 1e-8)
+        logging.info('unclaimed = %15.08f',
+                     (self.totals[0] + self.totals[1] - self.totals[2])
+                     * 1e-8)
+
+def subsidy(height):
+    '''
+    new coins a block at `height` may claim, as getBaseReward in util.cpp
+
+    >>> subsidy(0), subsidy(209999), subsidy(210000), subsidy(630000)
+    (5000000000, 5000000000, 2500000000, 625000000)
+    >>> subsidy(64 * HALVING)
+    0
+    '''
+    return (50 * COIN) >> (height // HALVING)
+
+if __name__ == '__main__':
+    main(command='rewards')
@@ -0,0 +1,314 @@
+#!/usr/bin/python3 -OO
+'''
+daily, weekly and monthly statistics computed during the parse
+
+the same figures as the daily_stats, weekly_stats and monthly_stats
+functions of db/stats.schema, without rescanning t_block and t_output
+for each date: block, transaction, value and fee totals and averages,
+and for days the UTXO count and value distribution at the start of the
+day, as utxo_count and utxo_distribution give them, and the distribution
+of block sizes and of times between blocks.
+
+UTXO counts per value range are kept up to date output by output and
+spend by spend. a day is finished once the median time of the last 11
+blocks is past its end, since no later block may have an earlier time.
+finished days, weeks (Monday to Sunday) and months are appended to
+daily.csv, weekly.csv and monthly.csv, in the layout of t_daily,
+t_weekly and t_monthly, so a later run, which still parses from the
+genesis block, only adds the periods after the last one in each file.
+`python3 rollups.py --json DIR` then writes the JSON files of
+db/dumpstats.sh from them.
+'''
+from __future__ import division, print_function
+import sys, os, csv, json, logging, datetime, time, bisect
+from blockparse import PREFIX_LENGTH
+from outpoints import COINBASE
+from timeindex import TimeIndex
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+# lower bounds, in satoshis, of the utxo_distribution value ranges
+UTXO_RANGES = (0, 100, 100000, 100000000, 100000000000, 100000000000000)
+BLOCKSIZE_RANGE = 102400  # bytes per bucket of blocksize_distribution
+BLOCKSIZE_BUCKETS = 10
+BLOCKTIME_RANGE = 240  # seconds per bucket of blocktime_distribution
+BLOCKTIME_BUCKETS = 15
+TOTALS = 'Date,NumBlocks,NumTxs,TotalValue,TotalFees,AvgTxsPerBlock,' \
+    'AvgFeesPerBlock,AvgBlockSize'
+PERIODS = (
+    ('daily', 'byday', TOTALS + ',NumUtxos,UtxoNumDistrib,'
+     'UtxoValueDistrib,BlockSizeDistrib,BlockTimeDistrib'),
+    ('weekly', 'byweek', TOTALS),
+    ('monthly', 'bymonth', TOTALS),
+)
+
+class Period(object):
+    '''
+    block totals for one day, week or month starting at `start`
+    '''
+    def __init__(self, start):
+        self.start = start
+        self.blocks = self.txs = self.value = self.fees = self.size = 0
+
+    def add(self, blocks, txs, value, fees, size):
+        self.blocks += blocks
+        self.txs += txs
+        self.value += value
+        self.fees += fees
+        self.size += size
+
+    def row(self):
+        '''
+        the t_weekly or t_monthly row, or the first columns of t_daily
+        '''
+        return [self.start.isoformat(), self.blocks, self.txs, self.value,
+                self.fees, rounded(self.txs, self.blocks),
+                rounded(self.fees, self.blocks),
+                rounded(self.size, self.blocks)]
+
+class Day(Period):
+    '''
+    totals of one day, with the UTXO state before its first block
+
+    >>> day = Day(datetime.date(2009, 1, 9), (1, [0] * 6, [0] * 6))
+    >>> day.block(1231469665, 215, 1, 5000000000, 0)
+    >>> day.block(1231470173, 215, 1, 5000000000, 0)
+    >>> day.row()[1:9]
+    [2, 2, 10000000000, 0, 1, 0, 215, 1]
+    >>> day.row()[-2:]
+    ['{2,0,0,0,0,0,0,0,0,0}', '{0,0,1,0,0,0,0,0,0,0,0,0,0,0,0}']
+    '''
+    def __init__(self, start, utxos):
+        Period.__init__(self, start)
+        self.utxos = utxos  # count, and counts and values per range
+        self.sizes = [0] * BLOCKSIZE_BUCKETS
+        self.times = []
+
+    def block(self, blocktime, size, txs, value, fees):
+        self.add(1, txs, value, fees, size)
+        if size // BLOCKSIZE_RANGE < BLOCKSIZE_BUCKETS:
+            self.sizes[size // BLOCKSIZE_RANGE] += 1
+        self.times.append(blocktime)
+
+    def row(self):
+        count, numbers, values = self.utxos
+        return Period.row(self) + [
+            count, pgarray(numbers), pgarray(values), pgarray(self.sizes),
+            pgarray(blocktimes(self.times))]
+
+class Rollups(Callback):
+    '''
+    daily, weekly and monthly statistics of the blockchain
+    '''
+    name = 'rollups'
+    aliases = ('daily',)
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-d', '--directory', default='.',
+                            help='where daily.csv, weekly.csv and'
+                            ' monthly.csv are (default: current directory)')
+        parser.add_argument('-j', '--json',
+                            help='with `python3 rollups.py`, write the JSON'
+                            ' files of db/dumpstats.sh to this directory'
+                            ' instead of scanning')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.files, self.last = {}, {}
+        for period, suffix, header in PERIODS:
+            filename = os.path.join(options.directory, period + '.csv')
+            rows = read_rows(filename)
+            self.last[period] = rows[-1][0] if rows else ''
+            new = not os.path.exists(filename)
+            self.files[period] = open(filename, 'a')
+            if new:
+                self.files[period].write(header + '\n')
+        logging.info('appending days after %s', self.last['daily'] or
+                     'the genesis block')
+        self.utxoCount = [0] * len(UTXO_RANGES)
+        self.utxoValue = [0] * len(UTXO_RANGES)
+        self.days, self.weeks, self.months = {}, {}, {}
+        self.frontier = None  # latest date reached by a block time
+        self.times = TimeIndex()
+        return 0
+
+    def startBlock(self, block):
+        self.date = utc_date(block['time'])
+        if self.frontier is None or self.date > self.frontier:
+            # the first block past the start of a day, so as of its start
+            utxos = (sum(self.utxoCount), list(self.utxoCount),
+                     list(self.utxoValue))
+            date = self.date if self.frontier is None else \
+                self.frontier + datetime.timedelta(1)
+            while date <= self.date:
+                self.days[date] = Day(date, utxos)
+                date += datetime.timedelta(1)
+            self.frontier = self.date
+        self.blockTXs = self.blockValue = self.blockFees = 0
+
+    def startTX(self, transaction, txhash):
+        self.coinbase = transaction[2][0][0] == COINBASE
+        self.txInput = self.txOutput = 0
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        self.txOutput += value
+        index = bisect.bisect(UTXO_RANGES, value) - 1
+        self.utxoCount[index] += 1
+        self.utxoValue[index] += value
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        self.txInput += value
+        index = bisect.bisect(UTXO_RANGES, value) - 1
+        self.utxoCount[index] -= 1
+        self.utxoValue[index] -= value
+
+    def endTX(self, transaction):
+        self.blockTXs += 1
+        self.blockValue += self.txOutput
+        if not self.coinbase:
+            self.blockFees += self.txInput - self.txOutput
+
+    def endBlock(self, block):
+        if self.date not in self.days:  # only on chains breaking the rule
+            logging.warning('block %d is dated in finished day %s, not'
+                            ' counted', block['height'], self.date)
+        else:
+            self.days[self.date].block(
+                block['time'], block['length'] - PREFIX_LENGTH,
+                self.blockTXs, self.blockValue, self.blockFees)
+        self.times.append(block['time'])
+        self.finish(utc_date(self.times.mtp[-1]))
+
+    def finish(self, bound):
+        '''
+        write all periods ending by `bound`, which no block can reach back to
+        '''
+        for date in sorted(date for date in self.days if date < bound):
+            day = self.days.pop(date)
+            if not day.blocks:
+                continue
+            self.write('daily', day)
+            for periods, start in ((self.weeks, week_start(date)),
+                                   (self.months, month_start(date))):
+                periods.setdefault(start, Period(start)).add(
+                    day.blocks, day.txs, day.value, day.fees, day.size)
+        for period, periods, end in (
+                ('weekly', self.weeks, lambda start: week_start(start, 1)),
+                ('monthly', self.months, lambda start: month_start(start, 1))):
+            for start in sorted(start for start in periods
+                                if end(start) <= bound):
+                self.write(period, periods.pop(start))
+
+    def write(self, period, rollup):
+        if rollup.start.isoformat() > self.last[period]:
+            csv.writer(self.files[period]).writerow(rollup.row())
+
+    def wrapup(self):
+        logging.info('%d days not finished yet, left for the next run',
+                     sum(1 for day in self.days.values() if day.blocks))
+        for outfile in self.files.values():
+            outfile.close()
+
+def rounded(numerator, denominator):
+    '''
+    quotient rounded half away from zero, as PostgreSQL's ::BIGINT does
+
+    >>> rounded(7, 2), rounded(7, 3), rounded(0, 0)
+    (4, 2, 0)
+    '''
+    if not denominator:
+        return 0
+    return (2 * numerator + denominator) // (2 * denominator)
+
+def blocktimes(times):
+    '''
+    counts of times between blocks, in time order, per BLOCKTIME_RANGE
+
+    as in blocktime_distribution, intervals of BLOCKTIME_BUCKETS ranges
+    or more are not counted.
+
+    >>> blocktimes([0, 600, 100, 5000])[:3]
+    [1, 0, 1]
+    '''
+    counts = [0] * BLOCKTIME_BUCKETS
+    times = sorted(times)
+    for index in range(1, len(times)):
+        bucket = rounded(times[index] - times[index - 1], BLOCKTIME_RANGE)
+        if bucket < BLOCKTIME_BUCKETS:
+            counts[bucket] += 1
+    return counts
+
+def utc_date(timestamp):
+    '''
+    the date of a block time, as f_timestamp::DATE
+    '''
+    return datetime.date(*time.gmtime(timestamp)[:3])
+
+def week_start(date, weeks=0):
+    '''
+    Monday of the week of `date`, or of one `weeks` later
+
+    >>> week_start(datetime.date(2009, 1, 9), 1)
+    datetime.date(2009, 1, 12)
+    '''
+    return date - datetime.timedelta(date.weekday() - 7 * weeks)
+
+def month_start(date, months=0):
+    '''
+    first day of the month of `date`, or of one `months` later
+
+    >>> month_start(datetime.date(2009, 12, 9), 1)
+    datetime.date(2010, 1, 1)
+    '''
+    month = date.year * 12 + date.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+def pgarray(numbers):
+    '''
+    PostgreSQL array literal, for COPY into the BIGINT[] columns
+    '''
+    return '{%s}' % ','.join(map(str, numbers))
+
+def read_rows(filename):
+    '''
+    the rows of a rollup file, without its header, if it exists
+    '''
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as infile:
+        return list(csv.reader(infile))[1:]
+
+def dump_json(directory, output):
+    '''
+    write the JSON files of db/dumpstats.sh from the rollup files
+
+    STATbyday.json etc. are lists of {"x": date, "y": value}, and the
+    distributions those of the last day.
+    '''
+    for period, suffix, header in PERIODS:
+        columns = [column.lower() for column in header.split(',')]
+        rows = read_rows(os.path.join(directory, period + '.csv'))
+        for index, column in enumerate(columns[1:], 1):
+            filename = os.path.join(output, column + suffix + '.json')
+            if column.endswith('distrib'):
+                filename = os.path.join(output, column + '.json')
+                data = [int(number) for number in
+                        rows[-1][index].strip('{}').split(',')] \
+                    if rows else None
+            else:
+                data = [{'x': row[0], 'y': int(row[index])} for row in rows]
+            with open(filename, 'w') as outfile:
+                json.dump(data, outfile, separators=(',', ':'))
+
+if __name__ == '__main__':
+    OPTIONS = Rollups().optionParser().parse_known_args()[0]
+    if OPTIONS.json:
+        dump_json(OPTIONS.directory, OPTIONS.json)
+    else:
+        main(command='rollups')
@@ -0,0 +1,60 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/simpleStats.cpp: gather simple stats about the blockchain
+'''
+from __future__ import division, print_function
+from callback import Callback, main
+
+class SimpleStats(Callback):
+    '''
+    gather simple stats about the blockchain
+    '''
+    name = 'simpleStats'
+    aliases = ('stats',)
+
+    def init(self, args):
+        self.optionParser().parse_args(args)
+        self.volume = 0
+        self.nbInputs = 0
+        self.nbOutputs = 0
+        self.nbValidBlocks = 0
+        self.nbTransactions = 0
+        return 0
+
+    def startBlock(self, block):
+        self.nbValidBlocks += 1
+
+    def startTX(self, transaction, txhash):
+        self.nbTransactions += 1
+
+    def startInput(self, txin):
+        self.nbInputs += 1
+
+    def startOutput(self, txout):
+        self.nbOutputs += 1
+
+    def endOutput(self, txout, value, txhash, outputindex, outputscript):
+        self.volume += value
+
+    def wrapup(self):
+        print()
+        print('    nbValidBlocks = %d' % self.nbValidBlocks)
+        print()
+        print('    nbInputs = %d' % self.nbInputs)
+        print('    nbOutputs = %d' % self.nbOutputs)
+        print('    nbTransactions = %d' % self.nbTransactions)
+        print('    volume = %.2f (%d satoshis)' % (self.volume * 1e-8,
+                                                  self.volume))
+        print()
+        print('    avg tx per block = %.2f' % (
+            self.nbTransactions / max(self.nbValidBlocks, 1)))
+        print('    avg inputs per tx = %.2f' % (
+            self.nbInputs / max(self.nbTransactions, 1)))
+        print('    avg outputs per tx = %.2f' % (
+            self.nbOutputs / max(self.nbTransactions, 1)))
+        print('    avg output value = %.2f' % (
+            self.volume / max(self.nbOutputs, 1) * 1e-8))
+        print()
+
+if __name__ == '__main__':
+    main(command='simpleStats')
@@ -0,0 +1,188 @@
+#!/usr/bin/python3 -OO
+'''
+snapshots of the chain state of blockparse, for restarting in seconds
+
+`nextblock`, given a snapshot filename, loads BLOCKCHAIN, CHAINS and
+BLOCKS from it, if it exists, and has `nextchunk` go on from the file and
+offset it was taken at, instead of reading every blockfile again; and it
+takes a new one every INTERVAL seconds, between blocks, writing it to a
+new file and renaming that over the old, so a crash leaves the old one
+whole.
+
+a snapshot is, after HEAD, the blockfile and currency names, a RECORD
+per block in the order they were read, with its 80-byte header, and the
+children of each block as indices of those records. consumers of
+`nextblock` can add their own state to it: a function registered in
+SECTIONS under a name returns bytes to store, and what was stored under
+that name is in RESTORED after a load.
+
+    python3 -OO snapshot.py SNAPSHOT
+'''
+from __future__ import division, print_function
+import sys, os, struct, logging
+from array import array
+from blockparse import blockheader, listchain, show_hash, NULLBLOCK
+from chainindex import raw_header
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+MAGIC = b'BPSNAP01'
+# magic, names, blocks, sections, children of the null block, last block
+# yielded, and the file number, offset and raw height to go on from
+HEAD = struct.Struct('<8sIIIIqIQQ')
+# header, file number, offset, length, raw height, height or -1,
+# currency number, number of children
+RECORD = struct.Struct('<80sIQLQiBxxxL')
+NAME = struct.Struct('<H')
+SECTION = struct.Struct('<Q')
+INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '300'))  # seconds
+SECTIONS = {}  # name: function returning the bytes to save
+RESTORED = {}  # name: bytes loaded
+
+def save(filename, blockchain, last, blockfiles, position):
+    '''
+    write a snapshot of `blockchain` (BLOCKCHAIN), the `last` block
+    yielded, the `blockfiles`, and (file number, offset, raw height)
+    `position` to go on from
+    '''
+    null = show_hash(NULLBLOCK)
+    blocks = [block for key, block in blockchain.items() if key != null]
+    numbers = dict((block['hash'], index)
+                   for index, block in enumerate(blocks))
+    names, namenumbers = [], {}
+    def number(name):
+        if name not in namenumbers:
+            namenumbers[name] = len(names)
+            names.append(name)
+        return namenumbers[name]
+    files = [number(name) for name in blockfiles]
+    children = array('I', (numbers[child] for child in
+                           blockchain[null]['children']))
+    records = []
+    for block in blocks:
+        records.append(RECORD.pack(
+            raw_header(block), number(block['file']), block['offset'],
+            block['length'], block['rawheight'], block.get('height', -1),
+            number(block['currency']), len(block['children'])))
+        children.extend(numbers[child] for child in block['children'])
+    sections = [(name, SECTIONS[name]()) for name in sorted(SECTIONS)]
+    newname = filename + '.new'
+    with open(newname, 'wb') as outfile:
+        outfile.write(HEAD.pack(
+            MAGIC, len(names), len(blocks), len(sections),
+            len(blockchain[null]['children']), last,
+            position[0], position[1], position[2]))
+        for name in names:
+            encoded = name.encode('utf8')
+            outfile.write(NAME.pack(len(encoded)) + encoded)
+        outfile.write(NAME.pack(len(files)))
+        outfile.write(array('I', files).tobytes())
+        outfile.write(b''.join(records))
+        outfile.write(children.tobytes())
+        for name, data in sections:
+            encoded = name.encode('utf8')
+            outfile.write(NAME.pack(len(encoded)) + encoded +
+                          SECTION.pack(len(data)) + data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(newname, filename)
+    logging.info('snapshot of %d blocks saved to %s', len(blocks), filename)
+
+def load(filename, blockchain, chains):
+    '''
+    fill `blockchain` and `chains`, BLOCKCHAIN and CHAINS, from a
+    snapshot; returns the main chain, the last block yielded, the
+    blockfiles, and (file number, offset, raw height) to go on from
+
+    >>> import tempfile, shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> filename = os.path.join(directory, 'chain.snapshot')
+    >>> null = show_hash(NULLBLOCK)
+    >>> genesis = blockheader(bytes(80))
+    >>> genesis.update({'rawheight': 0, 'file': 'blk0001.dat', 'offset': 8,
+    ...                 'length': 88, 'currency': 'bitcoin', 'height': 0,
+    ...                 'children': []})
+    >>> blockchain = {null: {'hash': null, 'children': [genesis['hash']]},
+    ...               genesis['hash']: genesis}
+    >>> save(filename, blockchain, 0, ['blk0001.dat'], (0, 96, 1))
+    >>> loaded, chains = {}, {}
+    >>> blocks, last, files, position = load(filename, loaded, chains)
+    >>> loaded == blockchain, len(blocks), last, files, position
+    (True, 1, 0, ['blk0001.dat'], (0, 96, 1))
+    >>> shutil.rmtree(directory)
+    '''
+    with open(filename, 'rb') as infile:
+        data = infile.read()
+    (magic, namecount, count, sectioncount, nullcount, last, fileindex,
+     offset, rawheight) = HEAD.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('%s is not a snapshot' % filename)
+    position = HEAD.size
+    names = []
+    for index in range(namecount):
+        length, = NAME.unpack_from(data, position)
+        position += NAME.size
+        names.append(data[position:position + length].decode('utf8'))
+        position += length
+    length, = NAME.unpack_from(data, position)
+    position += NAME.size
+    files = [names[index] for index in
+             array('I', data[position:position + 4 * length])]
+    position += 4 * length
+    records = list(RECORD.iter_unpack(
+        data[position:position + count * RECORD.size]))
+    position += count * RECORD.size
+    childcount = nullcount + sum(record[-1] for record in records)
+    children = array('I', data[position:position + 4 * childcount])
+    position += 4 * childcount
+    RESTORED.clear()
+    for index in range(sectioncount):
+        length, = NAME.unpack_from(data, position)
+        position += NAME.size
+        name = data[position:position + length].decode('utf8')
+        position += length
+        length, = SECTION.unpack_from(data, position)
+        position += SECTION.size
+        RESTORED[name] = data[position:position + length]
+        position += length
+    blocks = []
+    for (header, filenumber, blockoffset, length, blockraw, height,
+         currency, nchildren) in records:
+        block = blockheader(header)
+        block.update({'rawheight': blockraw, 'file': names[filenumber],
+                      'offset': blockoffset, 'length': length,
+                      'currency': names[currency]})
+        if height >= 0:
+            block['height'] = height
+        blocks.append(block)
+    hashes = [block['hash'] for block in blocks]
+    null = show_hash(NULLBLOCK)
+    blockchain.clear()
+    chains.clear()
+    blockchain[null] = {'children': hashes_of(children, 0, nullcount,
+                                              hashes), 'hash': null}
+    chains[null] = blockchain[null]
+    start = nullcount
+    for block, record in zip(blocks, records):
+        block['children'] = hashes_of(children, start, record[-1], hashes)
+        start += record[-1]
+        blockchain[block['hash']] = block
+    for block in blocks:
+        if block['previous'] not in blockchain:
+            chains[block['hash']] = block  # orphan
+    logging.info('snapshot of %d blocks loaded from %s', count, filename)
+    return (listchain(chains[null], blockchain), last, files,
+            (fileindex, offset, rawheight))
+
+def hashes_of(children, start, count, hashes):
+    return [hashes[index] for index in children[start:start + count]]
+
+if __name__ == '__main__':
+    BLOCKCHAIN, CHAINS = {}, {}
+    BLOCKS, LAST, FILES, POSITION = load(sys.argv[1], BLOCKCHAIN, CHAINS)
+    print('%d blocks, %d in the main chain, %d orphan chains; last yielded'
+          ' %d; going on from %s offset %d' % (
+              len(BLOCKCHAIN) - 1, len(BLOCKS), len(CHAINS) - 1, LAST,
+              FILES[POSITION[0]], POSITION[1]))
@@ -0,0 +1,287 @@
+#!/usr/bin/python3 -OO
+'''
+Python version of cb/taint.cpp: taint from source transactions to all others
+
+as in the C++ version, the taint of a transaction is the value-weighted
+average of the taint of the outputs its inputs spend:
+
+    taint = Sum(i, Vi * Ti) / Sum(i, Vi)
+
+and a source transaction has taint 1. rather than a hash map of taints
+updated edge by edge, the pass records a compact spend graph in CSR
+(compressed sparse row) form: one row per spending transaction, holding
+the indices of the transactions it spends from and the values spent.
+rows are ordered by step: one step per block, plus one per level of
+transactions spending others from the same block, so every row depends
+only on rows of earlier steps. propagation then handles a whole step with
+a few NumPy operations, and for many sources at once, as the columns of a
+(transactions x sources) matrix; 1,000 sources cost little more than one.
+
+that matrix is transactions * sources * 8 bytes (4 with --float32), so
+for large batches over the whole chain pass --matrix FILE to back it with
+a memory-mapped file.
+'''
+from __future__ import division, print_function
+import sys, os, logging
+from array import array
+from binascii import a2b_hex
+import numpy
+from blockparse import show_hash
+from addresses import AddressTable
+from callback import Callback, main
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+TXID_LENGTH = 32
+PIZZA = 'a1075db55d416d3ca199f55b6084e2115b9345e16c5cf302fc80e9d5fbf5d48d'
+GRAPH = ('rows', 'indptr', 'up', 'value', 'stepptr')  # saved arrays
+
+class SpendGraph(object):
+    '''
+    CSR graph of value-weighted spends, rows grouped in dependency steps
+
+    rows[r]: index of the spending transaction of row r
+    indptr[r]:indptr[r + 1]: its edges in `up` (spent transaction index)
+        and `value` (satoshis spent)
+    stepptr[s]:stepptr[s + 1]: the rows of step s
+
+    >>> graph = SpendGraph.build(4, up=[0, 0, 1, 2], down=[1, 2, 3, 3],
+    ...                          value=[10, 30, 10, 30], step=[0, 1, 1, 2])
+    >>> graph.rows.tolist(), graph.indptr.tolist(), graph.stepptr.tolist()
+    ([1, 2, 3], [0, 1, 2, 4], [0, 2, 3])
+    >>> taint = graph.propagate(numpy.array([0, 1]))
+    >>> taint.tolist()
+    [[1.0, 0.0], [1.0, 1.0], [1.0, 0.0], [1.0, 0.25]]
+    '''
+    def __init__(self, count, **arrays):
+        self.count = count  # number of transactions
+        for name in GRAPH:
+            setattr(self, name, arrays[name])
+        self.total = numpy.add.reduceat(self.value, self.indptr[:-1]) \
+            if len(self.rows) else numpy.zeros(0, numpy.int64)
+
+    @classmethod
+    def build(cls, count, up, down, value, step):
+        '''
+        build from edge lists in chain order, and each transaction's step
+        '''
+        up = numpy.asarray(up, dtype=numpy.int64)
+        down = numpy.asarray(down, dtype=numpy.int64)
+        value = numpy.asarray(value, dtype=numpy.int64)
+        step = numpy.asarray(step, dtype=numpy.int64)
+        order = numpy.lexsort((down, step[down]))
+        up, down, value = up[order], down[order], value[order]
+        starts = numpy.flatnonzero(numpy.diff(down, prepend=-1)) \
+            if len(down) else numpy.zeros(0, numpy.int64)
+        rows = down[starts]
+        indptr = numpy.append(starts, len(down))
+        rowstep = step[rows]
+        stepptr = numpy.append(
+            numpy.flatnonzero(numpy.diff(rowstep, prepend=-1)), len(rows))
+        return cls(count, rows=rows, indptr=indptr, up=up, value=value,
+                   stepptr=stepptr)
+
+    def save(self, prefix):
+        '''
+        write graph arrays to prefix.rows, prefix.indptr, etc.
+        '''
+        for name in GRAPH:
+            numpy.save('%s.%s.npy' % (prefix, name), getattr(self, name))
+
+    @classmethod
+    def load(cls, prefix, count):
+        '''
+        memory-map graph arrays written by `save`
+        '''
+        return cls(count, **dict(
+            (name, numpy.load('%s.%s.npy' % (prefix, name), mmap_mode='r'))
+            for name in GRAPH))
+
+    def propagate(self, sources, dtype=numpy.float64, matrix=None):
+        '''
+        return taint of every transaction from each of `sources`
+
+        `sources` holds transaction indices, one column of the result per
+        source. `matrix` names a file to memory-map the result in.
+        '''
+        sources = numpy.asarray(sources, dtype=numpy.int64)
+        shape = (self.count, len(sources))
+        if matrix:
+            taint = numpy.memmap(matrix, dtype=dtype, mode='w+', shape=shape)
+            taint[:] = 0
+        else:
+            taint = numpy.zeros(shape, dtype=dtype)
+        columns = numpy.arange(len(sources))
+        taint[sources, columns] = 1
+        # a source that spends its own inputs is reset to 1 after its step
+        position = numpy.full(self.count, -1, dtype=numpy.int64)
+        position[self.rows] = numpy.arange(len(self.rows))
+        sourcerow = position[sources]
+        sourcestep = numpy.searchsorted(self.stepptr, sourcerow,
+                                        side='right') - 1
+        for step in range(len(self.stepptr) - 1):
+            first, last = self.stepptr[step], self.stepptr[step + 1]
+            start, end = self.indptr[first], self.indptr[last]
+            contribution = taint[self.up[start:end]] * \
+                self.value[start:end, None]
+            bad = numpy.add.reduceat(contribution,
+                                     self.indptr[first:last] - start)
+            total = self.total[first:last, None]
+            taint[self.rows[first:last]] = numpy.divide(
+                bad, total, out=numpy.zeros_like(bad), where=total > 0)
+            reset = (sourcestep == step) & (sourcerow >= 0)
+            if reset.any():
+                taint[sources[reset], columns[reset]] = 1
+        return taint
+
+class Taint(Callback):
+    '''
+    compute the taint from list of specified transactions to *all*
+    existing transactions found in the blockchain
+
+    the step of each transaction is kept by its id, a repeated txid
+    keeping the one id of the first
+
+    >>> taint = Taint(); taint.init(['00' * 32])
+    0
+    >>> for block in [b'ab', b'ac']:
+    ...     taint.startBlock(None)
+    ...     for txhash in block:
+    ...         taint.startTX(None, bytes([txhash]) * 32)
+    ...         taint.endTX(None)
+    >>> len(taint.txids), taint.step.tolist()
+    (3, [1, 0, 1])
+    '''
+    name = 'taint'
+    aliases = ('trace',)
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-t', '--threshold', type=float, default=1e-20,
+                            help='only show taints above this'
+                            ' (default: %(default)s)')
+        parser.add_argument('-p', '--prefix',
+                            help='also save the spend graph and txid table'
+                            ' to prefix.* files')
+        parser.add_argument('-g', '--graph',
+                            help='with `python3 taint.py`, reuse the files'
+                            ' saved with --prefix instead of scanning')
+        parser.add_argument('-m', '--matrix',
+                            help='memory-map the taint matrix in this file')
+        parser.add_argument('--float32', action='store_true',
+                            help='halve the matrix size at less precision')
+        parser.add_argument('txhashes', nargs='*',
+                            help='source transaction hashes, or file:NAME'
+                            ' for a file of them, one per line')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        self.options = options
+        self.rootHashes = load_hashes(options.txhashes)
+        if options.txhashes:
+            logging.info('computing taint from %d source transactions',
+                         len(self.rootHashes))
+        else:
+            logging.warning('no TX hashes specified, using the infamous'
+                            ' 10K pizza TX')
+            self.rootHashes = load_hashes([PIZZA])
+        self.txids = AddressTable(keylength=TXID_LENGTH)
+        self.up, self.down, self.value = array('q'), array('q'), array('q')
+        self.step = array('q')
+        self.maxStep = self.blockStep = self.blockStart = -1
+        return 0
+
+    def startBlock(self, block):
+        self.blockStep = self.maxStep + 1
+        self.blockStart = len(self.txids)
+
+    def startTX(self, transaction, txhash):
+        self.current = self.txids.add(txhash)
+        self.txStep = self.blockStep
+
+    def edge(self, value, uptxhash, outputindex, outputscript,
+             downtxhash, inputindex, inputscript):
+        up = self.txids.lookup(uptxhash)
+        self.up.append(up)
+        self.down.append(self.current)
+        self.value.append(value)
+        if up >= self.blockStart:  # spends from same block, so a later step
+            self.txStep = max(self.txStep, self.step[up] + 1)
+
+    def endTX(self, transaction):
+        if self.current == len(self.step):
+            self.step.append(self.txStep)
+        else:  # a repeated txid, as the coinbases of blocks 91842 and 91880
+            self.step[self.current] = max(self.step[self.current], self.txStep)
+        self.maxStep = max(self.maxStep, self.txStep)
+
+    def wrapup(self):
+        logging.info('building spend graph of %d transactions, %d edges',
+                     len(self.txids), len(self.up))
+        frombuffer = lambda column: numpy.frombuffer(column, numpy.int64)
+        graph = SpendGraph.build(len(self.txids), frombuffer(self.up),
+                                 frombuffer(self.down), frombuffer(self.value),
+                                 frombuffer(self.step))
+        if self.options.prefix:
+            graph.save(self.options.prefix)
+            self.txids.save(self.options.prefix)
+        show(graph, self.txids, self.rootHashes, self.options)
+
+def show(graph, txids, rootHashes, options):
+    '''
+    propagate and print taints above threshold, in chain order
+
+    with one source the output is that of the C++ version: taint and
+    transaction hash; with several, the source hash follows.
+    '''
+    sources = [txids.lookup(txhash) for txhash in rootHashes]
+    for txhash, source in zip(rootHashes, sources):
+        if source < 0:
+            logging.warning('source transaction %s not found',
+                            show_hash(txhash))
+    found = [index for index in range(len(sources)) if sources[index] >= 0]
+    dtype = numpy.float32 if options.float32 else numpy.float64
+    taint = graph.propagate([sources[index] for index in found], dtype,
+                            options.matrix)
+    rows = numpy.flatnonzero((taint > options.threshold).any(axis=1))
+    for row in rows:
+        columns = numpy.flatnonzero(taint[row] > options.threshold)
+        txhash = show_hash(txids.key(row))
+        for column in columns:
+            if len(found) == 1:
+                print('%.32f %s' % (taint[row, column], txhash))
+            else:
+                print('%.32f %s %s' % (taint[row, column], txhash,
+                                       show_hash(rootHashes[found[column]])))
+    logging.info('found %d tainted transactions.', len(rows))
+
+def load_hashes(arguments):
+    '''
+    transaction hashes, as displayed, from arguments and file:NAME lists
+
+    returned in internal byte order, as used by the parser
+
+    >>> show_hash(load_hashes([PIZZA])[0]) == PIZZA
+    True
+    '''
+    hashes = []
+    for argument in arguments:
+        if argument.startswith('file:'):
+            with open(argument[len('file:'):]) as infile:
+                lines = [line.strip() for line in infile]
+        else:
+            lines = [argument]
+        hashes.extend(a2b_hex(line.encode())[::-1] for line in lines if line)
+    return hashes
+
+if __name__ == '__main__':
+    OPTIONS = Taint().optionParser().parse_known_args()[0]
+    if OPTIONS.graph:  # reuse a saved graph, no rescan
+        TXIDS = AddressTable.load(OPTIONS.graph, keylength=TXID_LENGTH)
+        show(SpendGraph.load(OPTIONS.graph, len(TXIDS)), TXIDS,
+             load_hashes(OPTIONS.txhashes or [PIZZA]), OPTIONS)
+    else:
+        main(command='taint')
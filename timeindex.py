@@ -0,0 +1,145 @@
+#!/usr/bin/python3 -OO
+'''
+block heights by time, found by bisection instead of a scan
+
+block times are not in height order: a block's time need only be later
+than the median of the 11 before it, its median time past, and not too
+far ahead of the clocks of the nodes relaying it. the median time past,
+though, never decreases, and neither does the latest time seen so far,
+so an array of each, by height, can be bisected:
+
+ * a block with a time before T1 is at most one block past the last
+   height whose median time past is before T1, by the rule above
+ * a block with a time from T0 on is at or past the first height whose
+   latest time is T0 or later, trivially
+
+which bound the heights of the blocks of any time range, and so the
+bytes to read, to a few blocks more than those in the range. that is
+what `blocks_between` returns; the block times themselves then say
+which of those are in it.
+
+    python3 -OO timeindex.py [--blockfile FILE]... FROM [TO]
+'''
+from __future__ import division, print_function
+import sys, os, time, logging, calendar, threading, argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+MEDIAN_SPAN = 11  # blocks in the median time past
+FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S',
+           '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+
+class TimeIndex(object):
+    '''
+    median time past and latest time of each height, from 0
+
+    >>> times = TimeIndex()
+    >>> times.extend([100, 300, 200, 400, 500, 450, 700])
+    >>> list(times.mtp)
+    [100, 300, 300, 300, 300, 400, 400]
+    >>> list(times.latest)
+    [100, 300, 300, 400, 500, 500, 700]
+    >>> times.height_at(350), times.height_at(50)
+    (4, -1)
+    >>> heights = times.blocks_between(420, 600); heights
+    range(4, 7)
+    >>> [height for height in heights if 420 <= times.times[height] < 600]
+    [4, 5]
+    '''
+    def __init__(self):
+        self.times = array('I')  # block time of each height
+        self.mtp = array('I')  # median time past, or the largest before
+        self.latest = array('I')  # the largest block time so far
+        self.recent = deque(maxlen=MEDIAN_SPAN)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, blocktime):
+        '''
+        add the time of the next height
+        '''
+        self.recent.append(blocktime)
+        median = sorted(self.recent)[len(self.recent) // 2]
+        self.times.append(blocktime)
+        # only a chain breaking the rule above can make it go down
+        self.mtp.append(max(median, self.mtp[-1]) if self.mtp else median)
+        self.latest.append(max(blocktime, self.latest[-1])
+                           if self.latest else blocktime)
+
+    def extend(self, blocktimes):
+        for blocktime in blocktimes:
+            self.append(blocktime)
+
+    def update(self, chain):
+        '''
+        add the confirmed heights of a ChainIndex or explorer.MemoryChain
+        not added yet
+        '''
+        with self.lock:
+            stop = len(chain)
+            while stop > len(self) and not chain.confirmed(stop - 1):
+                stop -= 1
+            if stop > len(self):
+                self.extend(chain.times(len(self), stop))
+
+    def height_at(self, when):
+        '''
+        the last height whose median time past is `when` or earlier, the
+        tip as of `when` by the clock of time locks; -1 if there is none
+        '''
+        return bisect_right(self.mtp, when) - 1
+
+    def blocks_between(self, start, end):
+        '''
+        range of heights holding every block with a time from `start` to
+        before `end`, and few others; it may end with the last height
+        indexed, in which case later heights may hold some too
+        '''
+        first = bisect_left(self.latest, start)
+        last = bisect_left(self.mtp, end)  # its block may be < end
+        return range(first, max(first, min(last + 1, len(self))))
+
+def parse_time(text):
+    '''
+    unix time of seconds, or of a UTC date, with or without a time
+
+    >>> parse_time('1231006505'), parse_time('2009-01-03T18:15:05')
+    (1231006505, 1231006505)
+    >>> parse_time('2009-01-03')
+    1230940800
+    '''
+    if text.isdigit():
+        return int(text)
+    for format in FORMATS:
+        try:
+            return calendar.timegm(time.strptime(text, format))
+        except ValueError:
+            pass
+    raise ValueError('%r is neither unix time nor a date' % text)
+
+if __name__ == '__main__':
+    from blockparse import nextblock
+    PARSER = argparse.ArgumentParser(prog=COMMAND, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--blockfile', action='append', dest='blockfiles')
+    PARSER.add_argument('start', type=parse_time)
+    PARSER.add_argument('end', type=parse_time, nargs='?')
+    OPTIONS = PARSER.parse_args()
+    END = OPTIONS.end or OPTIONS.start + 86400
+    TIMES = TimeIndex()
+    BLOCKS = []
+    for BLOCK in nextblock(OPTIONS.blockfiles, wait=False):
+        TIMES.append(BLOCK['time'])
+        BLOCKS.append(BLOCK)
+        if TIMES.mtp[-1] >= END:
+            break  # no later block can be in the range
+    for HEIGHT in TIMES.blocks_between(OPTIONS.start, END):
+        if OPTIONS.start <= BLOCKS[HEIGHT]['time'] < END:
+            print(HEIGHT, BLOCKS[HEIGHT]['hash'], BLOCKS[HEIGHT]['unix_time'])
@@ -0,0 +1,117 @@
+#!/usr/bin/python3 -OO
+'''
+ring buffer of changes of the chain tip, for pushing new blocks to clients
+
+`nextblock`, given a TipEvents, records an event whenever the tip of the
+main chain changes, and `serve` one when a block is confirmed and its
+transactions indexed:
+
+    {"seq": 7, "event": "tip", "height": 120, "hash": ..., "time": ...}
+    {"seq": 8, "event": "reorg", "height": 120, "hash": ..., "time": ...,
+     "fork": 119, "disconnected": [hash of the old 120, of the old 119]}
+    {"seq": 9, "event": "confirmed", "height": 114, "hash": ..., ...}
+
+only the last SIZE events are kept. a client asks for those after the
+last `seq` it saw, and learns from `missed` if some were dropped before
+it asked, in which case it should read /tip again. waiting clients are
+woken by a threading.Condition, and listeners, such as the event loop of
+asyncexplorer.py, are called by the writer thread itself, so a change
+reaches all of them at once.
+'''
+from __future__ import division, print_function
+import sys, os, logging, threading
+from collections import deque
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+SIZE = 1024  # events kept
+
+class TipEvents(object):
+    '''
+    the latest tip changes, numbered from 1
+
+    >>> events = TipEvents(size=2)
+    >>> blocks = [{'hash': 'a', 'time': 1},
+    ...           {'hash': 'b', 'time': 2, 'previous': 'a'}]
+    >>> blockchain = dict((block['hash'], block) for block in blocks)
+    >>> events.tip(blocks, None, 0, blockchain)
+    >>> side = {'hash': 'c', 'time': 3, 'previous': 'a'}
+    >>> events.tip(blocks[:1] + [side], blocks[1], 2, blockchain)
+    >>> events.since(1)['events'][0]['disconnected']
+    ['b']
+    >>> events.confirmed({'hash': 'a', 'time': 1, 'height': 0})
+    >>> [(event['seq'], event['event']) for event in events.since(0)['events']]
+    [(2, 'reorg'), (3, 'confirmed')]
+    >>> events.since(0)['missed'], events.since(1)['missed']
+    (True, False)
+    '''
+    def __init__(self, size=SIZE):
+        self.events = deque(maxlen=size)
+        self.sequence = 0  # of the last event
+        self.condition = threading.Condition()
+        self.listeners = []
+
+    def record(self, event):
+        with self.condition:
+            self.sequence += 1
+            event['seq'] = self.sequence
+            self.events.append(event)
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener(event)
+
+    def tip(self, blocks, oldtip, oldlength, blockchain):
+        '''
+        record a change of the main chain `blocks`, from `oldtip` at
+        height `oldlength` - 1, if its tip is another block; the blocks
+        dropped are found by hash in `blockchain`
+        '''
+        if not blocks or oldtip is blocks[-1]:
+            return
+        fork, disconnected = oldlength, []
+        block = oldtip
+        while fork > 0 and (fork > len(blocks) or
+                            blocks[fork - 1] is not block):
+            disconnected.append(block['hash'])
+            block = blockchain[block['previous']]
+            fork -= 1
+        event = {'event': 'reorg' if disconnected else 'tip',
+                 'height': len(blocks) - 1, 'hash': blocks[-1]['hash'],
+                 'time': blocks[-1]['time']}
+        if disconnected:
+            event.update(fork=fork, disconnected=disconnected)
+            logging.warning('reorg at height %d dropped %d block(s)',
+                            fork, len(disconnected))
+        self.record(event)
+
+    def confirmed(self, block):
+        '''
+        record a block confirmed, and its transactions indexed
+        '''
+        self.record({'event': 'confirmed', 'height': block['height'],
+                     'hash': block['hash'], 'time': block['time']})
+
+    def since(self, sequence):
+        '''
+        the events after number `sequence`, and whether any were dropped
+        '''
+        with self.condition:
+            events = [event for event in self.events
+                      if event['seq'] > sequence]
+            first = self.events[0]['seq'] if self.events else \
+                self.sequence + 1
+            return {'last': self.sequence, 'events': events,
+                    'missed': sequence + 1 < first or
+                              sequence > self.sequence}
+
+    def wait(self, sequence, timeout):
+        '''
+        `since`, once there are events after `sequence` or after `timeout`
+        seconds
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != sequence,
+                                    timeout)
+        return self.since(sequence)
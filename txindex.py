@@ -0,0 +1,313 @@
+#!/usr/bin/python3 -OO
+'''
+on-disk index of transaction locations, for single-read lookups by txid
+
+an open-addressing hash table in one memory-mapped file, each slot
+holding the first 8 bytes of a txid, its blockfile and offset, and its
+height and length, so that a lookup probes a slot or two in the page
+cache and then reads exactly the transaction's bytes with one `pread`.
+the 8-byte keys may collide; the txid of what was read is checked, and
+probing goes on if it does not match.
+
+there is one writer, the indexing thread of `serve`, adding transactions
+as their blocks are confirmed, while readers look them up, in other
+threads or, since the table is a shared mapping, in other processes. a
+slot's location is written before its key, so a reader never sees a key
+without its location. when the table is half full the writer builds one
+twice the size in a new file and renames it over the old one; readers
+holding the old mapping keep using it, and see the new one at their next
+lookup.
+
+many transactions at once are read by `read_many` in blockfile order,
+not in the order asked for: the reads are sorted by file and offset, and
+those close together done as one larger `pread`, so thousands of lookups
+cost a sweep or two through the files rather than a seek each.
+
+chainindex.py keeps a second table of the same kind, named blockindex,
+of block hashes.
+
+    python3 -OO txindex.py TXID [DIRECTORY]
+'''
+from __future__ import division, print_function
+import sys, os, struct, logging, mmap
+from binascii import a2b_hex
+from blockparse import get_transactions, get_count, parse_transaction, \
+    get_hash, show_hash, PREFIX_LENGTH, HEADER_LENGTH
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+CAPACITY = 1 << 16  # initial number of slots, a power of 2
+HEAD = struct.Struct('<QQq')  # slots, entries, last height indexed
+SLOT = struct.Struct('<QQQ')  # key, file << 40 | offset, height << 32 | size
+KEY = struct.Struct('<Q')
+LOCATION = struct.Struct('<QQ')
+OFFSET_BITS = 40
+GAP = 1 << 18  # bytes between two reads that are better read as one
+MAX_READ = 1 << 22  # bytes read at once, at most
+
+class TxIndex(object):
+    '''
+    txid to (blockfile, offset, height, size) of the raw transaction
+
+    >>> import tempfile, shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> index = TxIndex(directory, capacity=4)
+    >>> for number in range(5):
+    ...     index.add(bytes([number]) * 32, 'blk0001.dat', 100 * number,
+    ...               number, 50)
+    >>> index.slots, index.entries, index.locate(b'\\3' * 32)
+    (16, 5, [('blk0001.dat', 300, 3, 50)])
+    >>> TxIndex(directory, readonly=True).locate(b'\\7' * 32)
+    []
+    >>> shutil.rmtree(directory)
+    '''
+    def __init__(self, directory, readonly=False, capacity=CAPACITY,
+                 name='txindex'):
+        self.directory = directory
+        self.readonly = readonly
+        self.filename = os.path.join(directory, name)
+        self.namefile = os.path.join(directory, name + '.files')
+        if not readonly:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            if not os.path.exists(self.filename):
+                self.create(self.filename, capacity, 0, -1)
+            if not os.path.exists(self.namefile):
+                open(self.namefile, 'w').close()
+        self.files, self.numbers = [], {}
+        self.descriptors = {}
+        self.map = self.inode = None
+        self.refresh()
+
+    @staticmethod
+    def create(filename, slots, entries, height):
+        with open(filename, 'wb') as outfile:
+            outfile.write(HEAD.pack(slots, entries, height))
+            outfile.truncate(HEAD.size + slots * SLOT.size)
+
+    def refresh(self):
+        '''
+        map the table again if the writer has replaced it by a bigger one
+        '''
+        inode = os.stat(self.filename).st_ino
+        if inode != self.inode:
+            with open(self.filename, 'rb' if self.readonly else 'r+b') \
+                    as infile:
+                self.map = mmap.mmap(infile.fileno(), 0, access=(
+                    mmap.ACCESS_READ if self.readonly else
+                    mmap.ACCESS_WRITE))
+            self.inode = inode
+
+    @property
+    def slots(self):
+        return HEAD.unpack_from(self.map)[0]
+
+    @property
+    def entries(self):
+        return HEAD.unpack_from(self.map)[1]
+
+    @property
+    def height(self):
+        '''
+        height of the last block all transactions of which are indexed
+        '''
+        return HEAD.unpack_from(self.map)[2]
+
+    def reload_files(self):
+        with open(self.namefile) as infile:
+            self.files = infile.read().splitlines()
+        self.numbers = dict((name, number)
+                            for number, name in enumerate(self.files))
+
+    def filename_of(self, number):
+        if number >= len(self.files):
+            self.reload_files()
+        return self.files[number]
+
+    def number_of(self, filename):
+        if filename not in self.numbers:
+            self.reload_files()
+        if filename not in self.numbers:
+            with open(self.namefile, 'a') as outfile:
+                outfile.write(filename + '\n')
+            self.numbers[filename] = len(self.files)
+            self.files.append(filename)
+        return self.numbers[filename]
+
+    def locate(self, txid):
+        '''
+        candidate locations of `txid`, in internal byte order, as
+        (blockfile, offset, height, size); more than one only if the
+        first 8 bytes of txids collide
+        '''
+        if self.readonly:
+            self.refresh()
+        table = self.map  # the writer may replace self.map meanwhile
+        key = KEY.unpack_from(txid)[0] or 1  # 0 marks an empty slot
+        mask = HEAD.unpack_from(table)[0] - 1
+        index = key & mask
+        found = []
+        while True:
+            slot, location, size = SLOT.unpack_from(
+                table, HEAD.size + index * SLOT.size)
+            if not slot:
+                return found
+            if slot == key:
+                found.append((self.filename_of(location >> OFFSET_BITS),
+                              location & ((1 << OFFSET_BITS) - 1),
+                              size >> 32, size & 0xffffffff))
+            index = (index + 1) & mask
+
+    def read(self, txid):
+        '''
+        height and raw bytes of the transaction `txid`, or None
+        '''
+        for filename, offset, height, size in self.locate(txid):
+            raw = self.pread(filename, offset, size)
+            if get_hash(raw) == txid:
+                return height, raw
+        return None
+
+    def read_many(self, txids, gap=GAP, limit=MAX_READ):
+        '''
+        for each of `txids`, in order, its height and raw bytes, or None
+
+        the reads are sorted and coalesced by `coalesce`, and results
+        yielded as soon as they and all before them have been read.
+        '''
+        txids = list(txids)
+        reads = []  # (blockfile, offset, size, height, number in txids)
+        candidates = [0] * len(txids)
+        for number, txid in enumerate(txids):
+            for filename, offset, height, size in self.locate(txid):
+                reads.append((filename, offset, size, height, number))
+                candidates[number] += 1
+        found, done = {}, 0  # results not yielded yet, results yielded
+        for filename, start, end, run in coalesce(sorted(reads), gap, limit):
+            data = self.pread(filename, start, end - start)
+            for filename, offset, size, height, number in run:
+                candidates[number] -= 1
+                raw = data[offset - start:offset - start + size]
+                if number >= done and number not in found and \
+                        get_hash(raw) == txids[number]:
+                    found[number] = (height, raw)
+            while done < len(txids) and (done in found or
+                                         not candidates[done]):
+                yield found.pop(done, None)
+                done += 1
+        for number in range(done, len(txids)):
+            yield found.pop(number, None)
+
+    def pread(self, filename, offset, size):
+        '''
+        `size` bytes at `offset` in a blockfile, in one system call
+        '''
+        if filename not in self.descriptors:
+            self.descriptors[filename] = os.open(filename, os.O_RDONLY)
+        return os.pread(self.descriptors[filename], size, offset)
+
+    def add(self, txid, filename, offset, height, size):
+        '''
+        index a transaction; adding the same one again does nothing
+        '''
+        key = KEY.unpack_from(txid)[0] or 1
+        location = self.number_of(filename) << OFFSET_BITS | offset
+        slots, entries, indexed = HEAD.unpack_from(self.map)
+        index = key & (slots - 1)
+        while True:
+            start = HEAD.size + index * SLOT.size
+            slot, stored, stored_size = SLOT.unpack_from(self.map, start)
+            if not slot:
+                break
+            if slot == key and stored == location:
+                return
+            index = (index + 1) & (slots - 1)
+        LOCATION.pack_into(self.map, start + KEY.size, location,
+                           height << 32 | size)
+        KEY.pack_into(self.map, start, key)
+        HEAD.pack_into(self.map, 0, slots, entries + 1, indexed)
+        if 2 * (entries + 1) > slots:
+            self.grow()
+
+    def add_block(self, block):
+        '''
+        index all transactions of a block yielded by `nextblock`
+        '''
+        if block['height'] <= self.height:
+            return  # already indexed by an earlier run
+        data = get_transactions(block)
+        rawcount, count, rest = get_count(data)
+        offset = block['offset'] + PREFIX_LENGTH + HEADER_LENGTH + \
+            len(rawcount)
+        for number in range(count):
+            raw_transaction, transaction, rest = parse_transaction(rest)
+            self.add(get_hash(raw_transaction), block['file'], offset,
+                     block['height'], len(raw_transaction))
+            offset += len(raw_transaction)
+        slots, entries, indexed = HEAD.unpack_from(self.map)
+        HEAD.pack_into(self.map, 0, slots, entries, block['height'])
+
+    def grow(self):
+        '''
+        rebuild the table twice the size in a new file, and swap it in
+        '''
+        slots, entries, indexed = HEAD.unpack_from(self.map)
+        logging.debug('growing transaction index to %d slots', 2 * slots)
+        newname = self.filename + '.new'
+        self.create(newname, 2 * slots, entries, indexed)
+        mask = 2 * slots - 1
+        with open(newname, 'r+b') as outfile:
+            table = mmap.mmap(outfile.fileno(), 0)
+        for index in range(slots):
+            slot = SLOT.unpack_from(self.map, HEAD.size + index * SLOT.size)
+            if slot[0]:
+                newindex = slot[0] & mask
+                while KEY.unpack_from(table, HEAD.size +
+                                      newindex * SLOT.size)[0]:
+                    newindex = (newindex + 1) & mask
+                SLOT.pack_into(table, HEAD.size + newindex * SLOT.size,
+                               *slot)
+        table.flush()
+        os.replace(newname, self.filename)
+        self.map, self.inode = table, os.stat(self.filename).st_ino
+
+    def close(self):
+        for descriptor in self.descriptors.values():
+            os.close(descriptor)
+        self.descriptors.clear()
+
+def coalesce(reads, gap=GAP, limit=MAX_READ):
+    '''
+    group sorted (blockfile, offset, size, ...) `reads` into runs read
+    with one `pread` each, as (blockfile, start, end, reads)
+
+    >>> reads = [('a', 0, 10), ('a', 15, 5), ('a', 100, 10), ('b', 0, 10)]
+    >>> [run[:3] for run in coalesce(reads, gap=10)]
+    [('a', 0, 20), ('a', 100, 110), ('b', 0, 10)]
+    >>> [run[:3] for run in coalesce(reads, gap=100, limit=50)]
+    [('a', 0, 20), ('a', 100, 110), ('b', 0, 10)]
+    '''
+    run, start, end = [], 0, 0
+    for read in reads:
+        filename, offset, size = read[:3]
+        if run and (filename != run[0][0] or offset - end > gap or
+                    max(end, offset + size) - start > limit):
+            yield run[0][0], start, end, run
+            run = []
+        if not run:
+            start, end = offset, offset + size
+        run.append(read)
+        end = max(end, offset + size)
+    if run:
+        yield run[0][0], start, end, run
+
+if __name__ == '__main__':
+    INDEX = TxIndex(sys.argv[2] if len(sys.argv) > 2 else 'explorer.index',
+                    readonly=True)
+    FOUND = INDEX.read(a2b_hex(sys.argv[1])[::-1])
+    if FOUND is None:
+        logging.error('%s not in index', sys.argv[1])
+    else:
+        print(FOUND[0], show_hash(get_hash(FOUND[1])))
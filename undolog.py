@@ -0,0 +1,192 @@
+#!/usr/bin/python3 -OO
+'''
+undo logs, so that running totals can follow the tip through reorgs
+
+anything accumulated from `nextblock` or `next_transaction`, balances,
+unspent outputs, rollups, used to have to wait CONFIRMATIONS blocks, or
+be rebuilt from scratch when a reorg replaced blocks it had counted,
+since nothing recorded what each block changed. here each consumer keeps
+an UndoLog of per-block deltas: the keys of the outpoints the block
+created, and the outpoints it spent with their values and scripts, as
+OutpointMap.resolve reports them. disconnecting a block is then a
+matter of undoing its delta, in time proportional to the block's size,
+and only the deltas of the last `depth` blocks connected are kept, since
+blocks that deep below the tip are never disconnected.
+
+`follow` drives consumers from `nextblock` in provisional mode:
+connecting each block as soon as it is on the main chain, disconnecting
+it on rollback, and telling them as blocks are confirmed. Balances is
+such a consumer, the balance of every address at the tip.
+
+    python3 -OO undolog.py [--blockfile FILE]... [--depth N] ADDRESS...
+'''
+from __future__ import division, print_function
+import sys, os, logging, argparse
+from collections import OrderedDict, defaultdict
+from blockparse import nextblock, get_transactions, get_count, \
+    parse_transaction, get_hash, to_long, solve_output_script, \
+    CONFIRMATIONS
+from outpoints import OutpointMap, COINBASE
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+DEPTH = 2 * CONFIRMATIONS  # blocks from the tip whose deltas are kept
+KEY_LENGTH = 36  # of an outpoint key, txhash + packed output index
+
+class UndoLog(object):
+    '''
+    per-block deltas of the last `depth` blocks connected
+
+    >>> undo = UndoLog(depth=2)
+    >>> for height in range(3):
+    ...     undo.begin(height, 'hash%d' % height)
+    ...     undo.record([b'%d' % height * 36], {b'x' * 36: (height, b'')})
+    >>> len(undo), list(undo.deltas)
+    (2, ['hash1', 'hash2'])
+    >>> height, created, spent = undo.pop('hash2')
+    >>> height, [key[:2] for key in created], list(spent.values())
+    (2, [b'22'], [(2, b'')])
+    >>> undo.pop('hash0')
+    Traceback (most recent call last):
+    ...
+    ValueError: block hash0 is not the last block in the undo log
+    '''
+    def __init__(self, depth=DEPTH):
+        self.depth = depth
+        self.deltas = OrderedDict()  # block hash: [height, created, spent]
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def begin(self, height, blockhash):
+        '''
+        start the delta of a newly connected block, the new tip, and drop
+        those now `depth` or more below it
+        '''
+        self.prune(height)
+        self.deltas[blockhash] = [height, bytearray(), {}]
+
+    def record(self, created, spent):
+        '''
+        add outpoint keys `created` and outpoints `spent`, as a dict of
+        key to (value, script), to the delta of the last block begun
+        '''
+        delta = self.deltas[next(reversed(self.deltas))]
+        delta[1].extend(b''.join(created))  # KEY_LENGTH bytes each
+        delta[2].update(spent)
+
+    def pop(self, blockhash):
+        '''
+        remove and return (height, created keys, spent outpoints) of the
+        last block, which must be `blockhash`, to disconnect it
+        '''
+        if not self.deltas or next(reversed(self.deltas)) != blockhash:
+            raise ValueError('block %s is not the last block in the undo'
+                             ' log' % blockhash)
+        height, created, spent = self.deltas.popitem()[1]
+        return height, [bytes(created[index:index + KEY_LENGTH])
+                        for index in range(0, len(created), KEY_LENGTH)], \
+            spent
+
+    def prune(self, height):
+        '''
+        drop the deltas of blocks `depth` or more below `height`
+        '''
+        while self.deltas and \
+                next(iter(self.deltas.values()))[0] <= height - self.depth:
+            self.deltas.popitem(last=False)
+
+class Balances(object):
+    '''
+    balance of every hash160, at the tip of the main chain
+    '''
+    def __init__(self, depth=DEPTH):
+        self.outpoints = OutpointMap()
+        self.undo = UndoLog(depth)
+        self.balances = defaultdict(int)
+
+    def connect(self, height, block, transactions):
+        self.undo.begin(height, block['hash'])
+        spent = self.outpoints.resolve(transactions, self.undo)
+        for transaction, txhash in transactions:
+            for txin in transaction[2]:
+                if txin[0] != COINBASE and txin[0] + txin[1] in spent:
+                    self.credit(*spent[txin[0] + txin[1]], sign=-1)
+            for txout in transaction[4]:
+                self.credit(to_long(txout[0]), txout[2])
+
+    def disconnect(self, height, block):
+        height, created, spent = self.undo.pop(block['hash'])
+        for value, script in self.outpoints.revert(created, spent).values():
+            self.credit(value, script, sign=-1)
+        for value, script in spent.values():
+            self.credit(value, script)
+
+    def confirmed(self, height, block):
+        pass  # the undo log is pruned from the tip, on connecting
+
+    def credit(self, value, script, sign=1):
+        hash160 = solve_output_script(script)[1]
+        if hash160 is not None:
+            self.balances[hash160] += sign * value
+
+    def close(self):
+        self.outpoints.close()
+
+def block_transactions(block):
+    '''
+    (transaction, txhash) of each transaction of a block, in order
+    '''
+    rawcount, count, data = get_count(get_transactions(block))
+    transactions = []
+    for index in range(count):
+        raw_transaction, transaction, data = parse_transaction(data)
+        transactions.append((transaction, get_hash(raw_transaction)))
+    return transactions
+
+def follow(consumers, blockfiles=None, wait=True, changed=None):
+    '''
+    keep `consumers` at the tip: connect, disconnect and confirm blocks
+    as `nextblock` reports them, and call `changed` after each change
+    '''
+    connected = 0  # blocks connected, from height 0
+    for event, height, block in nextblock(blockfiles, wait=wait,
+                                          provisional=True):
+        if event == 'rollback':
+            for consumer in consumers:
+                consumer.disconnect(height, block)
+            connected = height
+        elif height >= connected:  # 'provisional', or confirmed at once
+            transactions = block_transactions(block)
+            for consumer in consumers:
+                consumer.connect(height, block, transactions)
+            connected = height + 1
+        if event == 'confirmed':
+            for consumer in consumers:
+                consumer.confirmed(height, block)
+        if changed is not None:
+            changed(event, height, block)
+
+if __name__ == '__main__':
+    from addresses import to_hash160
+    PARSER = argparse.ArgumentParser(prog=COMMAND, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--blockfile', action='append', dest='blockfiles')
+    PARSER.add_argument('-d', '--depth', type=int, default=DEPTH,
+                        help='deltas kept, back from the tip:'
+                        ' the deepest reorg followed')
+    PARSER.add_argument('--nowait', dest='wait', action='store_false',
+                        help='stop at the end of the blockfiles')
+    PARSER.add_argument('addresses', nargs='+')
+    OPTIONS = PARSER.parse_args()
+    WATCHED = [(address, to_hash160(address)) for address in
+               OPTIONS.addresses]
+    BALANCES = Balances(OPTIONS.depth)
+    def show(event, height, block):
+        print('%-11s %7d %s %s' % (event, height, block['hash'], ' '.join(
+            '%s=%.8f' % (address, BALANCES.balances.get(hash160, 0) * 1e-8)
+            for address, hash160 in WATCHED)))
+    follow([BALANCES], OPTIONS.blockfiles, OPTIONS.wait, show)
+    BALANCES.close()
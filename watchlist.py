@@ -0,0 +1,445 @@
+#!/usr/bin/python3 -OO
+'''
+every transaction touching a watch list of addresses, in one scan
+
+one scan per address, or a Python set tested against parsed script
+lists, is far too slow for lists of 100,000 addresses or more. here each
+output script goes through the template fast path of
+solve_output_script, which gives the hash160 of P2PKH, P2SH, and P2PK
+through the hash of its key. a block's hash160s are then tested all at
+once with NumPy against a Bloom filter, and only those it lets through
+are looked up in the exact set, a sorted array of the watched keys.
+outputs that match are kept, by outpoint, until an input spends them,
+so each is reported as received and, later, as spent.
+
+the filter and the exact set are files, memory-mapped read-only, so the
+processes of `python3 watchlist.py --jobs N` share one copy of them in
+the page cache. each of those scans a shard of heights, parsing only the
+blocks in it, and reports the outputs and spends it finds; outputs left
+unspent at the end of a shard go into a second filter, of outpoints,
+which a second parallel pass checks the inputs of the later shards
+against.
+
+rows are CSV, in chain order:
+
+    output,HEIGHT,TXID,OUTPUT_INDEX,HASH160,VALUE,,
+    spend,HEIGHT,TXID,INPUT_INDEX,HASH160,VALUE,SPENT_TXID,SPENT_INDEX
+
+    python3 -OO watchlist.py --watchlist addresses.txt --output watched.csv
+    python3 -OO watchlist.py --watchlist addresses.txt --jobs 8
+'''
+from __future__ import division, print_function
+import sys, os, csv, struct, logging, tempfile, shutil, heapq, \
+    multiprocessing
+import numpy
+from blockparse import nextblock, get_transactions, get_count, \
+    parse_transaction, get_hash, solve_output_script, show_hash, to_hex, \
+    to_long
+from outpoints import OutpointMap, COINBASE, outpoint
+from addresses import to_hash160
+from callback import Callback, main, option_parser
+
+COMMAND = os.path.splitext(os.path.split(sys.argv[0])[1])[0]
+LOGLEVEL = getattr(logging, os.getenv('LOGLEVEL', 'INFO'))
+logging.getLogger().level=logging.DEBUG if __debug__ else LOGLEVEL
+
+BITS_PER_KEY = 10  # about 1% false positives with HASHES
+HASHES = 7
+HEADER = struct.Struct('<QQQQ')  # bits, hashes, key and payload widths
+UNSPENT = struct.Struct('<36sq20s')  # outpoint, value, hash160
+KINDS = ('spend', 'output')  # inputs come before outputs in a transaction
+
+class WatchSet(object):
+    '''
+    Bloom filter and exact set of fixed-width keys, memory-mapped from
+    the files PREFIX.bloom, PREFIX.keys and PREFIX.data, as written by
+    `write_watchset`
+
+    PREFIX.data has the payload of each key, in the order of the keys.
+
+    >>> prefix = tempfile.mktemp()
+    >>> write_watchset(prefix, [b'b' * 20, b'a' * 20], [b'y', b'x'])
+    >>> watchset = WatchSet(prefix)
+    >>> watchset.find([b'b' * 20, b'c' * 20, b'a' * 20]).tolist()
+    [1, -1, 0]
+    >>> watchset.payload(1)
+    b'y'
+    >>> remove_watchset(prefix)
+    '''
+    def __init__(self, prefix):
+        with open(prefix + '.bloom', 'rb') as infile:
+            self.bits, self.hashes, self.width, self.payloads = \
+                HEADER.unpack(infile.read(HEADER.size))
+        self.filter = numpy.memmap(prefix + '.bloom', dtype=numpy.uint8,
+                                   mode='r', offset=HEADER.size)
+        self.keys = mapped(prefix + '.keys', 'S%d' % self.width)
+        self.data = mapped(prefix + '.data', numpy.uint8)
+        self.tested = self.passed = self.found = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, keys):
+        '''
+        index of each of `keys` in the set, or -1, as a NumPy array
+        '''
+        found = numpy.full(len(keys), -1, dtype=numpy.int64)
+        if not keys or not len(self.keys):
+            return found
+        positions = bloom_positions(keys, self.bits, self.hashes)
+        bits = (self.filter[positions >> 3] >> (positions & 7)) & 1
+        candidates = numpy.flatnonzero(bits.all(axis=1))
+        self.tested += len(keys)
+        self.passed += len(candidates)
+        if len(candidates):
+            wanted = numpy.array([keys[index] for index in candidates],
+                                 dtype=self.keys.dtype)
+            where = numpy.minimum(numpy.searchsorted(self.keys, wanted),
+                                  len(self.keys) - 1)
+            hit = self.keys[where] == wanted
+            found[candidates[hit]] = where[hit]
+            self.found += int(hit.sum())
+        return found
+
+    def payload(self, index):
+        '''
+        bytes stored with the key at `index`
+        '''
+        start = index * self.payloads
+        return self.data[start:start + self.payloads].tobytes()
+
+def mapped(filename, dtype):
+    '''
+    memory-map a file as a read-only NumPy array, even an empty one
+    '''
+    if not os.path.getsize(filename):  # mmap refuses empty files
+        return numpy.zeros(0, dtype)
+    return numpy.memmap(filename, dtype=dtype, mode='r')
+
+def bloom_positions(keys, bits, hashes):
+    '''
+    the `hashes` bit positions of each key, as rows of a NumPy array
+
+    the keys are hashes already, so the last 16 bytes of each serve as
+    the two 64-bit numbers of the Kirsch-Mitzenmacher double hashing.
+
+    >>> bloom_positions([b'\\1' * 8 + b'\\0' * 8], 1000, 3).tolist()
+    [[673, 674, 675]]
+    '''
+    tails = numpy.frombuffer(b''.join(key[-16:] for key in keys),
+                             dtype='<u8').reshape(-1, 2)
+    steps = numpy.arange(hashes, dtype=numpy.uint64)
+    # wraps around at 2**64, as intended
+    return (tails[:, :1] + steps * (tails[:, 1:] | 1)) % numpy.uint64(bits)
+
+def write_watchset(prefix, keys, payloads=None):
+    '''
+    write the files of a WatchSet of `keys`, all the same length
+
+    duplicate keys are kept once, with the payload of the last.
+    '''
+    pairs = sorted(dict(zip(keys, payloads or [b''] * len(keys))).items())
+    width = len(pairs[0][0]) if pairs else 20
+    payload = len(pairs[0][1]) if pairs else 0
+    bits = max(64, len(pairs) * BITS_PER_KEY)
+    bloom = numpy.zeros(-(-bits // 8), dtype=numpy.uint8)
+    if pairs:
+        positions = bloom_positions([key for key, data in pairs], bits,
+                                    HASHES).ravel()
+        numpy.bitwise_or.at(bloom, positions >> 3, numpy.left_shift(
+            1, positions & 7).astype(numpy.uint8))
+    with open(prefix + '.bloom', 'wb') as outfile:
+        outfile.write(HEADER.pack(bits, HASHES, width, payload))
+        outfile.write(bloom.tobytes())
+    with open(prefix + '.keys', 'wb') as outfile:
+        outfile.write(b''.join(key for key, data in pairs))
+    with open(prefix + '.data', 'wb') as outfile:
+        outfile.write(b''.join(data for key, data in pairs))
+
+def remove_watchset(prefix):
+    for suffix in ('.bloom', '.keys', '.data'):
+        os.remove(prefix + suffix)
+
+class Watcher(object):
+    '''
+    find the outputs paying watched addresses, and their spends, a block
+    at a time
+
+    `addresses` is a WatchSet of hash160s; `outpoints`, for the second
+    pass of --jobs, a WatchSet of outpoints matched earlier, with their
+    value and hash160 as payload.
+    '''
+    def __init__(self, addresses=None, outpoints=None):
+        self.addresses, self.outpoints = addresses, outpoints
+        # matched outputs not spent yet, to their (value, hash160)
+        self.matched = OutpointMap()
+        self.outputs = self.spends = 0
+
+    def block(self, height, transactions):
+        '''
+        rows for a block's list of (txhash, transaction), in chain order
+
+        a row is (height, position in block, kind, txhash, index,
+        hash160, value, spent txhash, spent index), kind 0 for a spend
+        and 1 for an output.
+        '''
+        rows = []
+        if self.addresses is not None:
+            keys, outputs = [], []
+            for position, (txhash, transaction) in enumerate(transactions):
+                for index, txout in enumerate(transaction[4]):
+                    hash160 = solve_output_script(txout[2])[1]
+                    if hash160 is not None:
+                        keys.append(hash160)
+                        outputs.append((position, txhash, index, txout[0]))
+            created = []
+            found = self.addresses.find(keys)
+            for number in numpy.flatnonzero(found >= 0).tolist():
+                position, txhash, index, amount = outputs[number]
+                value = to_long(amount)
+                rows.append((height, position, 1, txhash, index,
+                             keys[number], value, None, None))
+                created.append((outpoint(txhash, index),
+                                (value, keys[number])))
+            self.matched.update(created)
+            self.outputs += len(created)
+        inputs = [(txin[0] + txin[1], position, index)
+                  for position, (txhash, transaction)
+                  in enumerate(transactions)
+                  for index, txin in enumerate(transaction[2])
+                  if txin[0] != COINBASE]
+        spent = self.matched.pop_many([key for key, position, index
+                                       in inputs]) if len(self.matched) \
+            else {}
+        if self.outpoints is not None:
+            rest = [key for key, position, index in inputs
+                    if key not in spent]
+            found = self.outpoints.find(rest)
+            for number in numpy.flatnonzero(found >= 0).tolist():
+                key, value, hash160 = UNSPENT.unpack(
+                    self.outpoints.payload(found[number]))
+                spent[key] = (value, hash160)
+        for key, position, index in inputs:
+            if key in spent:
+                value, hash160 = spent[key]
+                rows.append((height, position, 0,
+                             transactions[position][0], index, hash160,
+                             value, key[:32], to_long(key[32:])))
+        self.spends += len(spent)
+        rows.sort(key=lambda row: row[1:3])
+        return rows
+
+    def unspent(self):
+        '''
+        matched outputs not spent yet, as UNSPENT records
+        '''
+        for key, (value, hash160) in self.matched.items():
+            yield UNSPENT.pack(key, value, hash160)
+
+    def close(self):
+        self.matched.close()
+
+def watch(transactions, watcher):
+    '''
+    watch-list rows for the (height, txhash, transaction) tuples of
+    `next_transaction` or `shard_transactions`
+    '''
+    height, block = None, []
+    for txheight, txhash, transaction in transactions:
+        if txheight != height and block:
+            for row in watcher.block(height, block):
+                yield row
+            block = []
+        height = txheight
+        block.append((txhash, transaction))
+    if block:
+        for row in watcher.block(height, block):
+            yield row
+
+def shard_transactions(blockfiles, first, last):
+    '''
+    like `next_transaction`, for heights `first` to `last`, parsing no
+    transactions of the blocks before them
+    '''
+    for block in nextblock(blockfiles and list(blockfiles), wait=False):
+        if block['height'] < first:
+            continue
+        elif 0 <= last < block['height']:
+            break
+        rawcount, count, data = get_count(get_transactions(block))
+        for index in range(count):
+            raw_transaction, transaction, data = parse_transaction(data)
+            yield block['height'], get_hash(raw_transaction), transaction
+
+def write_rows(writer, rows, position=False):
+    '''
+    write watcher rows as CSV, with their position in the block for parts
+    '''
+    for height, txpos, kind, txhash, index, hash160, value, uptxhash, \
+            upindex in rows:
+        writer.writerow([KINDS[kind], height] + ([txpos] if position else [])
+                        + [show_hash(txhash), index, to_hex(hash160), value,
+                           '' if uptxhash is None else show_hash(uptxhash),
+                           '' if upindex is None else upindex])
+
+def read_watchlist(addresses, filename=None):
+    '''
+    hash160s of `addresses` and of those in `filename`, one per line
+
+    empty lines, and anything after a #, are ignored.
+    '''
+    addresses = list(addresses)
+    if filename:
+        with open(filename) as infile:
+            addresses.extend(line.split('#')[0].strip() for line in infile)
+    return [to_hash160(address) for address in addresses if address]
+
+class WatchList(Callback):
+    '''
+    report the outputs paying a list of addresses, and their spends
+    '''
+    name = 'watchlist'
+    aliases = ('watch',)
+    needTXHash = True
+
+    def optionParser(self):
+        parser = Callback.optionParser(self)
+        parser.add_argument('-w', '--watchlist',
+                            help='file of addresses to watch, one per line')
+        parser.add_argument('-o', '--output', default='-',
+                            help='CSV file of the matches (default: stdout)')
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='with `python3 watchlist.py`, number of'
+                            ' processes scanning height shards in parallel')
+        parser.add_argument('addresses', nargs='*',
+                            help='base58 addresses, hex hash160s or hex'
+                            ' public keys to watch')
+        return parser
+
+    def init(self, args):
+        options = self.optionParser().parse_args(args)
+        keys = read_watchlist(options.addresses, options.watchlist)
+        if not keys:
+            logging.error('no addresses to watch')
+            return 1
+        self.directory = tempfile.mkdtemp(suffix='.watchlist')
+        prefix = os.path.join(self.directory, 'address')
+        write_watchset(prefix, keys)
+        self.addresses = WatchSet(prefix)
+        logging.info('watching %d addresses', len(self.addresses))
+        self.watcher = Watcher(self.addresses)
+        self.outfile = sys.stdout if options.output == '-' else \
+            open(options.output, 'w')
+        self.writer = csv.writer(self.outfile)
+        self.transactions = []
+        return 0
+
+    def startTX(self, transaction, txhash):
+        self.transactions.append((txhash, transaction))
+
+    def endBlock(self, block):
+        write_rows(self.writer,
+                   self.watcher.block(block['height'], self.transactions))
+        del self.transactions[:]
+
+    def wrapup(self):
+        self.watcher.close()
+        if self.outfile is not sys.stdout:
+            self.outfile.close()
+        logging.info('%d outputs and %d spends found; the filter let %d'
+                     ' of %d hash160s through', self.watcher.outputs,
+                     self.watcher.spends, self.addresses.passed,
+                     self.addresses.tested)
+        shutil.rmtree(self.directory)
+
+def scan_part(arguments):
+    '''
+    scan one height shard, in its own process
+
+    the first pass writes FILENAME with the rows found, and
+    FILENAME.unspent with the matches still unspent at its end; the
+    second writes FILENAME.spends with the spends of the outpoints of
+    `prefix`.
+    '''
+    blockfiles, first, last, prefix, filename, second = arguments
+    watchset = WatchSet(prefix)
+    watcher = Watcher(outpoints=watchset) if second else Watcher(watchset)
+    with open(filename + ('.spends' if second else ''), 'w') as outfile:
+        write_rows(csv.writer(outfile), watch(
+            shard_transactions(blockfiles, first, last), watcher), True)
+    if not second:
+        with open(filename + '.unspent', 'wb') as outfile:
+            for record in watcher.unspent():
+                outfile.write(record)
+    watcher.close()
+    return watchset.passed, watchset.tested
+
+def scan(options, blockfiles=None):
+    '''
+    watch the whole chain in `options.jobs` parallel height shards
+    '''
+    keys = read_watchlist(options.addresses, options.watchlist)
+    directory = tempfile.mkdtemp(suffix='.watchlist')
+    write_watchset(os.path.join(directory, 'address'), keys)
+    logging.info('finding the last block to split the scan into shards')
+    last = -1
+    # nextchunk appends to the list of blockfiles as it finds new ones
+    for block in nextblock(blockfiles and list(blockfiles), wait=False):
+        last = block['height']
+    shard = max(1, -(-(last + 1) // options.jobs))  # rounded up
+    shards = [(start, min(start + shard - 1, last))
+              for start in range(0, last + 1, shard)]
+    logging.info('watching %d addresses over blocks 0 to %d in %d shards',
+                 len(set(keys)), last, len(shards))
+    parts = [os.path.join(directory, 'part.%d' % part)
+             for part in range(len(shards))]
+    # spawned, not forked, so as not to inherit the chain state above,
+    # and one task per process, so as not to inherit an earlier task's
+    pool = multiprocessing.get_context('spawn').Pool(max(1, len(shards)),
+                                                     maxtasksperchild=1)
+    counts = pool.map(scan_part, [
+        (blockfiles, first, last, os.path.join(directory, 'address'),
+         filename, False) for (first, last), filename in zip(shards, parts)])
+    records = []
+    for filename in parts[:-1]:  # spends of the last shard's are not seen
+        with open(filename + '.unspent', 'rb') as infile:
+            data = infile.read()
+        records.extend(data[offset:offset + UNSPENT.size]
+                       for offset in range(0, len(data), UNSPENT.size))
+    later = list(zip(shards, parts))[1:] if records else []
+    if later:
+        logging.info('looking for the spends of %d outputs in later'
+                     ' shards', len(records))
+        prefix = os.path.join(directory, 'outpoint')
+        write_watchset(prefix, [record[:36] for record in records], records)
+        pool.map(scan_part, [
+            (blockfiles, first, last, prefix, filename, True)
+            for (first, last), filename in later])
+    pool.close()
+    pool.join()
+    logging.info('the filter let %d of %d hash160s through',
+                 sum(count[0] for count in counts),
+                 sum(count[1] for count in counts))
+    outfile = sys.stdout if options.output == '-' else \
+        open(options.output, 'w')
+    writer = csv.writer(outfile)
+    key = lambda row: (int(row[1]), int(row[2]), KINDS.index(row[0]),
+                       int(row[4]))
+    for filename in parts:
+        infiles = [open(name) for name in (filename, filename + '.spends')
+                   if os.path.exists(name)]
+        for row in heapq.merge(*map(csv.reader, infiles), key=key):
+            writer.writerow(row[:2] + row[3:])
+        for infile in infiles:
+            infile.close()
+    if outfile is not sys.stdout:
+        outfile.close()
+    shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    GLOBALS, ARGS = option_parser().parse_known_args()
+    OPTIONS = WatchList().optionParser().parse_args(ARGS)
+    if OPTIONS.jobs > 1:
+        scan(OPTIONS, GLOBALS.blockfiles)
+    else:
+        main(command='watchlist')